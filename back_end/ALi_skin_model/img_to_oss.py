@@ -4,28 +4,110 @@ from pathlib import Path
 sys.path.append(str(Path(__file__).parent.parent))
 sys.stdout.reconfigure(encoding='utf-8')
 
-import oss2
 import os
+import hmac
+import json
+import time
 import uuid
+import base64
+import asyncio
+import hashlib
+import logging
+import itertools
+import threading
+import ipaddress
+import contextvars
+from concurrent.futures import TimeoutError as FutureTimeoutError, wait as wait_futures
+from datetime import datetime, timezone
 from pathlib import Path
+from urllib.parse import urlparse
 import back_configuration as bc
+from concurrency import run_blocking, get_part_executor
+from temp_janitor import sharded_path
+from metrics import track_upstream, UPLOAD_PARTS
+from resilience import guard, check_deadline, is_failure, remaining, DeadlineExceeded
+import image_preprocess
+from daily_logger import log_info, log_error
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 64 * 1024
+DEFAULT_MAX_BYTES = 20 * 1024 * 1024
+# 服务端上传的对象目录；浏览器直传使用单独的目录，/api/analyze 不接受服务端上传的对象（可能是其他用户的图片）
+SERVER_UPLOAD_PREFIX = 'uploads/'
+DEFAULT_DIRECT_UPLOAD_PREFIX = 'direct-uploads/'
+DEFAULT_DIRECT_UPLOAD_EXPIRES = 300
+DEFAULT_MULTIPART_THRESHOLD = 2 * 1024 * 1024
+DEFAULT_PART_SIZE = 1024 * 1024
+# OSS 要求除最后一个分片外每个分片至少 100KB
+MIN_PART_SIZE = 100 * 1024
+DEFAULT_PART_CONCURRENCY = 4
+DEFAULT_PART_RETRIES = 3
+PART_RETRY_BACKOFF = 0.2
+
+class UploadTooLarge(ValueError):
+    """上传的文件超过大小上限"""
+
+    def __init__(self, max_bytes):
+        super().__init__(f"上传的文件超过大小上限 {max_bytes} 字节")
+        self.max_bytes = max_bytes
+
+class UploadNotFound(LookupError):
+    """浏览器直传的对象不存在（还没有上传完成，或上传失败）"""
+
+class InvalidUpload(ValueError):
+    """直传的对象不符合要求（不在允许的目录下，或不是图片）"""
+
+def _new_bucket(access_key_id, access_key_secret, bucket_name, oss_endpoint):
+    """新建 oss2.Bucket（未传入复用的 Bucket 时使用）；oss2 在首次使用时才导入，不拖慢服务启动"""
+    import oss2
+    return oss2.Bucket(oss2.Auth(access_key_id, access_key_secret), oss_endpoint, bucket_name)
+
+def oss_object_url(bucket_name, oss_endpoint, object_name):
+    """
+    对象的访问URL：通常为 https://{bucket}.{endpoint}/{object}；
+    endpoint 带协议时沿用（如 http://127.0.0.1:9101），为 IP 或 localhost 时与 oss2 一致使用 {endpoint}/{bucket}/{object}
+    """
+    scheme, _, host = oss_endpoint.rpartition('://')
+    scheme = scheme or 'https'
+    hostname = host.split(':')[0]
+    try:
+        ipaddress.ip_address(hostname)
+        path_style = True
+    except ValueError:
+        path_style = hostname == 'localhost'
+    if path_style:
+        return f'{scheme}://{host}/{bucket_name}/{object_name}'
+    return f'{scheme}://{bucket_name}.{host}/{object_name}'
+
+def oss_object_key(oss_url, bucket_name=None):
+    """从 oss_object_url 生成的URL中取回对象的 key"""
+    if bucket_name is None:
+        _, _, bucket_name, _ = bc.img_to_oss_url()
+    parsed = urlparse(oss_url)
+    path = parsed.path.lstrip('/')
+    prefix = f'{bucket_name}/'
+    if not (parsed.hostname or '').startswith(f'{bucket_name}.') and path.startswith(prefix):
+        return path[len(prefix):]
+    return path
 
 def generate_unique_filename(original_filename):
     """生成唯一的文件名"""
     ext = os.path.splitext(original_filename)[1]
     return f"{uuid.uuid4().hex}{ext}"
 
-def file_paths_oss_url(access_key_id, access_key_secret, bucket_name, oss_endpoint, file_obj=None, local_img_path=None):
+def file_paths_oss_url(access_key_id, access_key_secret, bucket_name, oss_endpoint, file_obj=None, local_img_path=None, bucket=None):
     """
     上传文件到OSS并返回URL
     :param file_obj: 文件对象（优先使用）
     :param local_img_path: 本地文件路径（file_obj为None时使用）
+    :param bucket: 复用的 oss2.Bucket（带连接池），为None时新建
     """
     if not file_obj and not local_img_path:
         raise ValueError("Either file_obj or local_img_path must be provided")
         
-    auth = oss2.Auth(access_key_id, access_key_secret)
-    bucket = oss2.Bucket(auth, oss_endpoint, bucket_name)
+    if bucket is None:
+        bucket = _new_bucket(access_key_id, access_key_secret, bucket_name, oss_endpoint)
     
     # 生成唯一的对象名
     if file_obj:
@@ -34,7 +116,7 @@ def file_paths_oss_url(access_key_id, access_key_secret, bucket_name, oss_endpoi
         else:
             original_filename = str(uuid.uuid4()) + ".jpg"
             
-        object_name = f"uploads/{generate_unique_filename(original_filename)}"
+        object_name = f"{SERVER_UPLOAD_PREFIX}{generate_unique_filename(original_filename)}"
         try:
             if hasattr(file_obj, 'read'):
                 # 如果 file_obj 有 read 方法，直接上传
@@ -43,7 +125,7 @@ def file_paths_oss_url(access_key_id, access_key_secret, bucket_name, oss_endpoi
                 # 否则假设它是文件路径
                 with open(file_obj, 'rb') as f:
                     bucket.put_object(object_name, f)
-            return f'https://{bucket_name}.{oss_endpoint}/{object_name}'
+            return oss_object_url(bucket_name, oss_endpoint, object_name)
         except Exception as e:
             print(f"Error uploading file to OSS: {str(e)}")
             raise
@@ -57,54 +139,502 @@ def file_paths_oss_url(access_key_id, access_key_secret, bucket_name, oss_endpoi
         try:
             with open(local_img_path, 'rb') as fileobj:
                 bucket.put_object(object_name, fileobj)
-            return f'https://{bucket_name}.{oss_endpoint}/{object_name}'
+            return oss_object_url(bucket_name, oss_endpoint, object_name)
         except Exception as e:
             print(f"Error uploading local file to OSS: {str(e)}")
             raise
 
-async def save_and_upload(file_obj):
-    """保存上传的文件到临时目录并上传到OSS"""
-    # 确保临时目录存在
-    temp_dir = os.path.join(os.path.dirname(__file__), 'temp_image')
-    os.makedirs(temp_dir, exist_ok=True)
-    
-    # 生成唯一的文件名
-    filename = generate_unique_filename(file_obj.filename)
-    temp_path = os.path.join(temp_dir, filename)
-    
+def upload_bytes_to_oss(content, original_filename, bucket=None):
+    """
+    将内存中的图片字节直接上传到OSS并返回URL
+    :param content: 图片字节内容
+    :param original_filename: 原始文件名（用于保留扩展名）
+    :param bucket: 复用的 oss2.Bucket（带连接池），为None时新建
+    """
+    access_key_id, access_key_secret, bucket_name, oss_endpoint = bc.img_to_oss_url()
+    if bucket is None:
+        bucket = _new_bucket(access_key_id, access_key_secret, bucket_name, oss_endpoint)
+
+    object_name = f"{SERVER_UPLOAD_PREFIX}{generate_unique_filename(original_filename or '.jpg')}"
     try:
-        # 保存到临时文件
-        with open(temp_path, 'wb') as buffer:
-            # 读取文件内容
-            content = await file_obj.read()
-            buffer.write(content)
-        
-        # 上传到OSS
-        access_key_id, access_key_secret, bucket_name, oss_endpoint = bc.img_to_oss_url()
-        
-        # 使用文件路径上传
-        with open(temp_path, 'rb') as file_to_upload:
-            oss_url = file_paths_oss_url(
-                access_key_id=access_key_id,
-                access_key_secret=access_key_secret,
-                bucket_name=bucket_name,
-                oss_endpoint=oss_endpoint,
-                file_obj=file_to_upload
-            )
-        
-        return oss_url
-        
+        # 超过 upload.multipart.threshold 时分片并发上传
+        put_object_stream(bucket, object_name, [content])
+        return oss_object_url(bucket_name, oss_endpoint, object_name)
     except Exception as e:
-        print(f"Error in save_and_upload: {str(e)}")
+        log_error(f"上传图片到OSS失败: {str(e)}")
         raise
-        
-    finally:
-        # 保留临时文件，不再删除
-        # 确保文件存在
-        if os.path.exists(temp_path):
-            print(f"临时文件已保存在: {temp_path}")
+
+def upload_stream_to_oss(chunks, original_filename, bucket=None):
+    """
+    把分块迭代器上传到OSS并返回URL，不需要事先知道文件大小（小图一次上传，大图边读取边分片并发上传，见 put_object_stream）
+    :param chunks: 产出 bytes 的迭代器
+    :param original_filename: 原始文件名（用于保留扩展名）
+    :param bucket: 复用的 oss2.Bucket（带连接池），为None时新建
+    """
+    access_key_id, access_key_secret, bucket_name, oss_endpoint = bc.img_to_oss_url()
+    if bucket is None:
+        bucket = _new_bucket(access_key_id, access_key_secret, bucket_name, oss_endpoint)
+
+    object_name = f"{SERVER_UPLOAD_PREFIX}{generate_unique_filename(original_filename or '.jpg')}"
+    put_object_stream(bucket, object_name, chunks)
+    return oss_object_url(bucket_name, oss_endpoint, object_name)
+
+def multipart_options():
+    """upload.multipart 配置：是否启用、分片阈值、分片大小、每个上传同时上传的分片数、单个分片的重试次数"""
+    multipart = bc.upload_configuration().get('multipart') or {}
+    part_size = max(MIN_PART_SIZE, int(multipart.get('part_size', DEFAULT_PART_SIZE)))
+    return {
+        "enabled": multipart.get('enabled', True),
+        "threshold": max(part_size, int(multipart.get('threshold', DEFAULT_MULTIPART_THRESHOLD))),
+        "part_size": part_size,
+        "concurrency": max(1, int(multipart.get('concurrency', DEFAULT_PART_CONCURRENCY))),
+        "max_retries": max(0, int(multipart.get('max_retries', DEFAULT_PART_RETRIES))),
+    }
+
+def put_object_stream(bucket, object_name, chunks, options=None):
+    """
+    上传分块迭代器的内容：读到的内容不超过 threshold 时一次 put_object；
+    超过时改为分片上传（已读到的内容作为最前面的分片），其余内容边读取边上传
+    未启用分片上传时以分块传输编码(chunked)一次上传
+    :param options: multipart_options() 的结果，为None时读取配置
+    """
+    options = options or multipart_options()
+    # 耗时包含读取上传内容的时间
+    check_deadline("上传OSS")
+    if not options["enabled"]:
+        with guard('oss'), track_upstream('oss_put'):
+            return bucket.put_object(object_name, chunks)
+    chunks = iter(chunks)
+    head = bytearray()
+    for chunk in chunks:
+        head += chunk
+        if len(head) > options["threshold"]:
+            break
+    else:
+        with guard('oss'), track_upstream('oss_put'):
+            return bucket.put_object(object_name, bytes(head))
+    upload = MultipartUpload(bucket, object_name, options["part_size"], options["concurrency"], options["max_retries"])
+    return upload.upload(itertools.chain([head], chunks))
+
+def iter_parts(chunks, part_size):
+    """把任意大小的块重新切分为 part_size 大小的分片（最后一个分片可以较小）"""
+    buffer = bytearray()
+    for chunk in chunks:
+        view = memoryview(chunk)
+        while view:
+            take = min(part_size - len(buffer), len(view))
+            buffer += view[:take]
+            view = view[take:]
+            if len(buffer) == part_size:
+                yield bytes(buffer)
+                buffer = bytearray()
+    if buffer:
+        yield bytes(buffer)
+
+class MultipartUpload:
+    """
+    OSS 分片上传：内容按 part_size 切分，边读取边把分片交给分片线程池（concurrency.get_part_executor）上传，
+    每个上传同时最多 concurrency 个分片，都在上传时暂停读取（内存中最多保留 concurrency + 1 个分片）
+    分片失败（超时、连接错误、5xx）时只重试该分片；重试用尽或读取失败时中止上传，由 OSS 删除已上传的分片
+    Args:
+        bucket: oss2.Bucket
+        object_name: 对象的 key
+        part_size, concurrency, max_retries: 见 multipart_options
+    """
+
+    def __init__(self, bucket, object_name, part_size=DEFAULT_PART_SIZE, concurrency=DEFAULT_PART_CONCURRENCY,
+                 max_retries=DEFAULT_PART_RETRIES):
+        self.bucket = bucket
+        self.object_name = object_name
+        self.part_size = part_size
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.upload_id = None
+
+    def upload(self, chunks):
+        """上传分块迭代器的全部内容，返回 complete_multipart_upload 的结果"""
+        check_deadline("上传OSS")
+        with guard('oss'), track_upstream('oss_init_multipart'):
+            self.upload_id = self.bucket.init_multipart_upload(self.object_name).upload_id
+        slots = threading.BoundedSemaphore(self.concurrency)
+        futures = []
+        try:
+            for number, data in enumerate(iter_parts(chunks, self.part_size), 1):
+                slots.acquire()
+                # 已有分片重试后仍然失败时不再继续读取
+                for future in futures:
+                    if future.done() and future.exception() is not None:
+                        raise future.exception()
+                # 分片在分片线程池中执行，沿用当前请求的上下文（截止时间）
+                future = get_part_executor().submit(contextvars.copy_context().run, self._upload_part, number, data)
+                future.add_done_callback(lambda _: slots.release())
+                futures.append(future)
+            parts = [future.result() for future in futures]
+            check_deadline("上传OSS")
+            with guard('oss'), track_upstream('oss_complete_multipart'):
+                return self.bucket.complete_multipart_upload(self.object_name, self.upload_id, parts)
+        except BaseException:
+            self.abort(futures)
+            raise
+
+    def _upload_part(self, number, data):
+        """上传一个分片，可重试的错误按指数退避重试，返回 complete_multipart_upload 需要的 PartInfo"""
+        from oss2.models import PartInfo
+        for attempt in itertools.count():
+            check_deadline("上传OSS分片")
+            try:
+                with guard('oss'), track_upstream('oss_part'):
+                    result = self.bucket.upload_part(self.object_name, self.upload_id, number, data)
+            except Exception as e:
+                if attempt >= self.max_retries or not is_failure(e):
+                    raise
+                UPLOAD_PARTS.labels('retried').inc()
+                logger.warning(f"重试上传 {self.object_name} 的第 {number} 个分片: {str(e)}")
+                time.sleep(PART_RETRY_BACKOFF * 2 ** attempt)
+                continue
+            UPLOAD_PARTS.labels('uploaded').inc()
+            return PartInfo(number, result.etag, size=len(data), part_crc=result.crc)
+
+    def abort(self, futures=()):
+        """取消还没开始的分片，等进行中的分片结束后中止上传（失败时只记录错误，OSS 的生命周期规则会清理残留分片）"""
+        for future in futures:
+            future.cancel()
+        wait_futures(futures)
+        try:
+            with track_upstream('oss_abort_multipart'):
+                self.bucket.abort_multipart_upload(self.object_name, self.upload_id)
+        except Exception as e:
+            logger.error(f"中止分片上传 {self.object_name} 失败: {str(e)}")
+
+def oss_url_for_key(object_key):
+    """根据OSS中已有对象的 key 生成访问URL"""
+    object_key = (object_key or '').strip().lstrip('/')
+    if not object_key or '..' in object_key.split('/'):
+        raise ValueError(f"无效的OSS对象: {object_key}")
+    _, _, bucket_name, oss_endpoint = bc.img_to_oss_url()
+    return oss_object_url(bucket_name, oss_endpoint, object_key)
+
+def direct_upload_prefix(prefix=None):
+    """浏览器直传的对象目录（direct_upload.prefix），不能与服务端上传的目录重叠"""
+    prefix = (prefix or DEFAULT_DIRECT_UPLOAD_PREFIX).strip('/') + '/'
+    if prefix == '/' or prefix.startswith(SERVER_UPLOAD_PREFIX) or SERVER_UPLOAD_PREFIX.startswith(prefix):
+        raise ValueError(f"direct_upload.prefix ({prefix}) 不能与服务端上传的目录 {SERVER_UPLOAD_PREFIX} 重叠")
+    return prefix
+
+def direct_upload_ticket(filename, content_type, max_bytes=DEFAULT_MAX_BYTES, prefix=DEFAULT_DIRECT_UPLOAD_PREFIX,
+                         expires_seconds=DEFAULT_DIRECT_UPLOAD_EXPIRES, bucket=None):
+    """
+    签发浏览器直传OSS的短期凭证（只在本地计算签名，不访问OSS），图片不再经过本服务
+    凭证只能上传到这次生成的 object_key，且 Content-Type 必须与申请时一致（PostObject 策略同时要求是 image/）：
+        post: PostObject 表单，fields 原样作为表单字段、最后附加 file 字段，POST 到 url（OSS 校验大小上限）
+        put:  签名URL，以 PUT 上传请求体，必须带 headers 中的请求头（大小在 /api/analyze 时检查）
+    :param bucket: 复用的 oss2.Bucket，为None时新建
+    :return: dict，包含 object_key、expires_at（Unix 时间）、max_bytes、post、put
+    """
+    access_key_id, access_key_secret, bucket_name, oss_endpoint = bc.img_to_oss_url()
+    if bucket is None:
+        bucket = _new_bucket(access_key_id, access_key_secret, bucket_name, oss_endpoint)
+    object_key = f"{prefix}{generate_unique_filename(filename or '.jpg')}"
+    expires_at = int(time.time()) + int(expires_seconds)
+
+    policy = {
+        "expiration": datetime.fromtimestamp(expires_at, timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.000Z'),
+        "conditions": [
+            {"bucket": bucket_name},
+            ["eq", "$key", object_key],
+            ["starts-with", "$Content-Type", "image/"],
+            ["eq", "$Content-Type", content_type],
+            ["content-length-range", 1, int(max_bytes)],
+        ],
+    }
+    encoded_policy = base64.b64encode(json.dumps(policy).encode('utf-8')).decode('ascii')
+    signature = base64.b64encode(
+        hmac.new(access_key_secret.encode('utf-8'), encoded_policy.encode('ascii'), hashlib.sha1).digest()
+    ).decode('ascii')
+    put_headers = {"Content-Type": content_type}
+    return {
+        "object_key": object_key,
+        "expires_at": expires_at,
+        "max_bytes": int(max_bytes),
+        "post": {
+            "url": oss_object_url(bucket_name, oss_endpoint, ''),
+            "fields": {
+                "key": object_key,
+                "policy": encoded_policy,
+                "OSSAccessKeyId": access_key_id,
+                "Signature": signature,
+                "success_action_status": "200",
+                "Content-Type": content_type,
+            },
+        },
+        "put": {
+            "url": bucket.sign_url('PUT', object_key, int(expires_seconds), headers=dict(put_headers)),
+            "headers": put_headers,
+        },
+    }
+
+def check_direct_upload(object_key, max_bytes=DEFAULT_MAX_BYTES, prefix=DEFAULT_DIRECT_UPLOAD_PREFIX, bucket=None):
+    """
+    检查浏览器直传的对象（HEAD 请求，不下载内容）：必须在 prefix 下、存在、是图片且不超过大小上限，
+    超过上限或不是图片的对象直接删除（签名URL无法在上传时限制大小和类型）
+    :return: dict，包含 object_key、oss_url、size、etag、content_type
+    """
+    import oss2
+    object_key = (object_key or '').strip().lstrip('/')
+    if not object_key.startswith(prefix) or '..' in object_key.split('/'):
+        raise InvalidUpload(f"只能分析 {prefix} 下直传的对象: {object_key}")
+    oss_url = oss_url_for_key(object_key)
+    access_key_id, access_key_secret, bucket_name, oss_endpoint = bc.img_to_oss_url()
+    if bucket is None:
+        bucket = _new_bucket(access_key_id, access_key_secret, bucket_name, oss_endpoint)
+
+    check_deadline("查询OSS对象")
+    try:
+        with guard('oss'), track_upstream('oss_head'):
+            meta = bucket.head_object(object_key)
+    except oss2.exceptions.NotFound:
+        raise UploadNotFound(f"OSS对象不存在，请先完成上传: {object_key}") from None
+    content_type = meta.headers.get('Content-Type', '')
+    if max_bytes and meta.content_length > max_bytes:
+        bucket.delete_object(object_key)
+        raise UploadTooLarge(max_bytes)
+    if not content_type.startswith('image/'):
+        bucket.delete_object(object_key)
+        raise InvalidUpload(f"OSS对象不是图片: {content_type}")
+    return {
+        "object_key": object_key,
+        "oss_url": oss_url,
+        "size": meta.content_length,
+        "etag": (meta.etag or '').strip('"'),
+        "content_type": content_type,
+    }
+
+def delete_oss_object(oss_url, bucket=None):
+    """删除 upload_* 上传的对象（用于清理重复上传的图片）"""
+    access_key_id, access_key_secret, bucket_name, oss_endpoint = bc.img_to_oss_url()
+    if bucket is None:
+        bucket = _new_bucket(access_key_id, access_key_secret, bucket_name, oss_endpoint)
+    bucket.delete_object(oss_object_key(oss_url, bucket_name))
+
+def iter_file_chunks(file_obj, chunk_size=DEFAULT_CHUNK_SIZE, max_bytes=None, sinks=()):
+    """
+    按块读取文件对象，每一块先交给 sinks（计算哈希、写本地副本等）再产出
+    累计大小超过 max_bytes 时抛出 UploadTooLarge
+    """
+    total = 0
+    while True:
+        chunk = file_obj.read(chunk_size)
+        if not chunk:
+            break
+        total += len(chunk)
+        if max_bytes and total > max_bytes:
+            raise UploadTooLarge(max_bytes)
+        for sink in sinks:
+            sink(chunk)
+        yield chunk
+
+def read_head(chunks, limit):
+    """从分块迭代器中读取内容，超过 limit 字节时停止；返回 (已读的内容, 是否已经读完)"""
+    head = bytearray()
+    for chunk in chunks:
+        head += chunk
+        if len(head) > limit:
+            return head, False
+    return head, True
+
+def _ingest_sync(file_obj, original_filename, local_path=None, upload=True, bucket=None,
+                 chunk_size=DEFAULT_CHUNK_SIZE, max_bytes=DEFAULT_MAX_BYTES, preprocess=None, known_url=None):
+    """
+    只读一遍上传内容，边读边计算 SHA-256、写本地副本、上传OSS（同步版本，在线程池中执行）
+    内存中最多保留 upload.multipart.threshold 字节（超过后分片上传，最多保留 concurrency + 1 个分片）；
+    启用预处理(preprocess 为 normalize_image 的参数)时需要完整的图片，读完后在进程池中规范化再上传
+    内容读完才上传时（预处理，或不超过分片阈值），先用 known_url(内容哈希) 查询已上传过的地址，
+    命中时不再规范化和上传；边读取边上传的大图只能上传后再由调用方去重
+    """
+    hasher = hashlib.sha256()
+    state = {"size": 0, "too_large": None}
+    preprocess_info = None
+    deduplicated = False
+
+    def count(chunk):
+        state["size"] += len(chunk)
+
+    def chunks(sinks):
+        try:
+            yield from iter_file_chunks(file_obj, chunk_size, max_bytes, sinks)
+        except UploadTooLarge as e:
+            # 异常可能被 HTTP 库包装，记录下来以便重新抛出
+            state["too_large"] = e
+            raise
+
+    local_file = open(local_path, 'wb') if local_path else None
+    sinks = [hasher.update, count] + ([local_file.write] if local_file else [])
+    oss_url = None
+    try:
+        if upload and preprocess:
+            content = b''.join(chunks(sinks))
+            oss_url = known_url(hasher.hexdigest()) if known_url else None
+            if oss_url:
+                deduplicated = True
+            else:
+                content, ext, preprocess_info = image_preprocess.normalize_in_pool(content, preprocess)
+                if ext:
+                    original_filename = os.path.splitext(original_filename)[0] + ext
+                oss_url = upload_bytes_to_oss(content, original_filename, bucket)
+        elif upload:
+            stream = chunks(sinks)
+            head, complete = read_head(stream, multipart_options()["threshold"])
+            oss_url = known_url(hasher.hexdigest()) if complete and known_url else None
+            if oss_url:
+                deduplicated = True
+            elif complete:
+                oss_url = upload_bytes_to_oss(bytes(head), original_filename, bucket)
+            else:
+                oss_url = upload_stream_to_oss(itertools.chain([head], stream), original_filename, bucket)
         else:
-            print(f"警告: 临时文件 {temp_path} 不存在")
+            for _ in chunks(sinks):
+                pass
+    except Exception:
+        if local_file:
+            local_file.close()
+            os.remove(local_path)
+        if state["too_large"] is not None:
+            raise state["too_large"]
+        raise
+    finally:
+        if local_file and not local_file.closed:
+            local_file.close()
+
+    return {
+        "content_hash": hasher.hexdigest(),
+        "size": state["size"],
+        "oss_url": oss_url,
+        "local_path": local_path,
+        "preprocess": preprocess_info,
+        "deduplicated": deduplicated,
+    }
+
+async def ingest_upload(file_obj, original_filename=None, local_path=None, upload=True, bucket=None,
+                        known_url=None):
+    """
+    单次分块读取上传的文件，同时计算内容哈希、写本地副本（local_path 不为空时）和上传到OSS
+    :param file_obj: FastAPI 的 UploadFile、StreamedUpload 或普通的二进制文件对象
+    :param upload: 为False时只计算哈希和写本地副本
+    :param known_url: 同步函数，参数为内容哈希，返回之前上传过的OSS地址（没有时返回None），在线程池中调用
+    :return: dict，包含 content_hash（原图的哈希）、size、oss_url、local_path、preprocess（预处理信息）、
+             deduplicated（是否沿用了之前上传的地址，没有上传）
+    """
+    upload_config = bc.upload_configuration()
+    max_bytes = int(upload_config.get('max_bytes', DEFAULT_MAX_BYTES))
+    chunk_size = int(upload_config.get('chunk_size', DEFAULT_CHUNK_SIZE))
+
+    # 大小已知时（UploadFile.size）直接拒绝，不必读到超限才发现
+    size = getattr(file_obj, 'size', None)
+    if size and max_bytes and size > max_bytes:
+        raise UploadTooLarge(max_bytes)
+
+    if original_filename is None:
+        original_filename = getattr(file_obj, 'filename', None) or '.jpg'
+    # UploadFile 底层是同步的临时文件，StreamedUpload 底层是 RequestBodyReader，都在线程池中直接读取
+    raw = getattr(file_obj, 'file', file_obj)
+    return await run_blocking(
+        _ingest_sync, raw, original_filename, local_path, upload, bucket, chunk_size, max_bytes,
+        image_preprocess.preprocess_options() if upload else None, known_url
+    )
+
+class RequestBodyReader:
+    """
+    把异步的请求体（Starlette 的 Request.stream()）包装成同步的二进制文件对象，在线程池中读取：
+    每次 read 时才从事件循环取下一块，客户端还在发送时就开始计算哈希和上传；等待客户端不超过请求的截止时间
+    """
+
+    def __init__(self, stream, loop):
+        self._stream = stream
+        self._loop = loop
+        self._buffer = bytearray()
+        self._eof = False
+
+    async def _next_chunk(self):
+        try:
+            return await self._stream.__anext__()
+        except StopAsyncIteration:
+            return None
+
+    def _receive(self):
+        future = asyncio.run_coroutine_threadsafe(self._next_chunk(), self._loop)
+        try:
+            return future.result(remaining())
+        except FutureTimeoutError:
+            future.cancel()
+            raise DeadlineExceeded("接收上传的图片已超过截止时间")
+
+    def read(self, size=-1):
+        while not self._eof and (size is None or size < 0 or len(self._buffer) < size):
+            chunk = self._receive()
+            if chunk is None:
+                self._eof = True
+            else:
+                self._buffer += chunk
+        if size is None or size < 0:
+            size = len(self._buffer)
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+class StreamedUpload:
+    """
+    请求体直接是图片（Content-Type: image/*）时代替 UploadFile 交给 ingest_upload：
+    不必等整个请求体接收到临时文件，边接收边上传（大图边接收边分片上传）
+    Args:
+        stream: Request.stream()
+        loop: 请求所在的事件循环
+        filename: 文件名（用于保留扩展名）
+        content_type: 请求的 Content-Type
+        size: Content-Length，未知时为None
+    """
+
+    def __init__(self, stream, loop, filename, content_type, size=None):
+        self.filename = filename
+        self.content_type = content_type
+        self.size = size
+        self.file = RequestBodyReader(stream, loop)
+
+def local_copy_path(original_filename):
+    """temp_image 目录下（按文件名分片的子目录中）的本地副本路径，未启用本地副本时返回None"""
+    if not bc.upload_configuration().get('keep_local_copy', True):
+        return None
+    temp_dir = os.path.join(os.path.dirname(__file__), 'temp_image')
+    temp_path, _ = sharded_path(temp_dir, generate_unique_filename(original_filename or '.jpg'))
+    return temp_path
+
+async def save_and_upload(file_obj, bucket=None):
+    """保存上传的文件到临时目录并上传到OSS（只读取一遍，本地副本和OSS上传同时进行）"""
+    original_filename = getattr(file_obj, 'filename', None) or getattr(file_obj, 'name', None) or '.jpg'
+    temp_path = local_copy_path(original_filename)
+    try:
+        result = await ingest_upload(file_obj, original_filename, temp_path, bucket=bucket)
+    except Exception as e:
+        log_error(f"保存并上传图片失败: {str(e)}")
+        raise
+    if temp_path:
+        log_info(f"临时文件已保存在: {temp_path}")
+    return result["oss_url"]
+
+async def save_and_upload_bytes(content, original_filename, bucket=None):
+    """将已读取的图片内容保存到临时目录并上传到OSS（直接上传内存中的内容，不再回读临时文件）"""
+    temp_path = local_copy_path(original_filename)
+
+    def save_and_upload_sync():
+        if temp_path:
+            with open(temp_path, 'wb') as buffer:
+                buffer.write(content)
+        return upload_bytes_to_oss(content, original_filename, bucket)
+
+    try:
+        return await run_blocking(save_and_upload_sync)
+    except Exception as e:
+        log_error(f"保存并上传图片失败: {str(e)}")
+        raise
 
 if __name__ == "__main__":
     # 测试代码
@@ -119,4 +649,4 @@ if __name__ == "__main__":
     # 测试新版接口
     print("\n测试新版接口:")
     with open(local_img_path, 'rb') as f:
-        print(save_and_upload(f))
+        print(asyncio.run(save_and_upload(f)))
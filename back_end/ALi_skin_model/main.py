@@ -1,14 +1,18 @@
 import os
 import sys
+import time
+import asyncio
+import functools
 import logging
-from fastapi import FastAPI, UploadFile, File, HTTPException
+import mimetypes
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse, FileResponse, Response
+from pydantic import BaseModel
 import uvicorn
-from typing import Dict, Any, Optional
-import json
+from typing import Dict, Any, Optional, List
 
-# 配置日志
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # 添加项目根目录到 Python 路径
@@ -17,15 +21,84 @@ parent_dir = os.path.dirname(current_dir)
 if parent_dir not in sys.path:
     sys.path.append(parent_dir)
 
+# 配置日志：所有模块（包括 uvicorn）的日志经队列交给后台线程写入，见 daily_logger
+from daily_logger import setup_logging
+setup_logging()
+
 try:
     from skin_analysis import Sample
     import back_configuration as bc
-    from img_to_oss import save_and_upload
+    from img_to_oss import (ingest_upload, local_copy_path, delete_oss_object, oss_url_for_key, UploadTooLarge,
+                            direct_upload_ticket, check_direct_upload, UploadNotFound, InvalidUpload, StreamedUpload,
+                            DEFAULT_MAX_BYTES, DEFAULT_DIRECT_UPLOAD_EXPIRES, direct_upload_prefix)
+    from analysis_cache import content_hash, get_analysis_cache, close_analysis_cache
+    from pipeline import Pipeline, Stage, StageError
+    from concurrency import run_blocking, shutdown_executor, is_primary_worker
+    from clients import get_client_registry, close_client_registry, preload_sdks
+    from sse import SSE_HEADERS, format_sse, iterate_in_thread
+    from temp_janitor import sharded_path, get_janitor, run_janitor
+    from image_preprocess import shutdown_process_pool
+    from upstream_scheduler import get_skin_scheduler, SchedulerBusy
+    from job_store import JobWorkers, get_job_store, close_job_store, new_job_id, remove_spool
+    from chart_render import save_chart_spec, render_options, rendered_chart_path, is_chart_key, MEDIA_TYPES
+    from json_codec import FastJSONResponse, dumps as json_dumps
+    import metrics
+    from resilience import (CircuitOpen, DeadlineExceeded, deadline, request_deadline, stage_budget, hedged,
+                            breaker_stats)
+    import logger_config
 except ImportError as e:
     logger.error(f"导入模块失败: {str(e)}")
     raise
 
-app = FastAPI(title="Skin Analysis API", description="API for skin analysis using Alibaba Cloud")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 配置文件修改后自动生效，也可以发送 SIGHUP 立即重新加载
+    logger_config.get_config()
+    logger_config.install_reload_signal()
+    # 启动时创建上游客户端，并在后台预热连接（不阻塞服务启动）；
+    # 上游 SDK 在创建客户端时才导入，不预热时也在后台导入，首次请求不必等待
+    clients = get_client_registry()
+    warm_up = None
+    http_pool = bc.http_pool_configuration()
+    if http_pool.get('warm_up', True):
+        warm_up = asyncio.create_task(run_blocking(clients.warm_up))
+    elif http_pool.get('preload_sdks', True):
+        warm_up = asyncio.create_task(run_blocking(preload_sdks))
+    # 抓取 /metrics 时读取的实时状态
+    metrics.SCHEDULER_QUEUED.labels().set_function(lambda: get_skin_scheduler().stats()["queued"])
+    metrics.SCHEDULER_ACTIVE.labels().set_function(lambda: get_skin_scheduler().stats()["active"])
+    # 后台定期清理临时图片目录（多进程运行时只由 0 号工作进程清理）
+    janitor = asyncio.create_task(run_janitor()) if is_primary_worker() else None
+    # 异步分析任务的工作协程（上次退出时未完成的任务会重新执行）
+    global _job_workers
+    jobs_config = bc.jobs_configuration()
+    if jobs_config.get('enabled', True):
+        _job_workers = JobWorkers(
+            get_job_store(), _run_job,
+            workers=int(jobs_config.get('workers', 4)),
+            max_attempts=int(jobs_config.get('max_attempts', 3)),
+            retention_seconds=float(jobs_config.get('retention_hours', 168)) * 3600,
+            purge_interval=float(jobs_config.get('purge_interval_seconds', 3600)),
+            transient_retries=int(jobs_config.get('transient_retries', 10))
+        )
+        await _job_workers.start()
+    yield
+    if _job_workers is not None:
+        await _job_workers.stop()
+        _job_workers = None
+    close_job_store()
+    if janitor is not None:
+        janitor.cancel()
+    if warm_up is not None and not warm_up.done():
+        warm_up.cancel()
+    # 应用退出时关闭连接池、缓存和线程池
+    close_client_registry()
+    close_analysis_cache()
+    shutdown_process_pool()
+    shutdown_executor()
+
+app = FastAPI(title="Skin Analysis API", description="API for skin analysis using Alibaba Cloud", lifespan=lifespan,
+              default_response_class=FastJSONResponse)
 
 # 配置 CORS
 app.add_middleware(
@@ -35,6 +108,173 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# 按路由统计请求耗时，见 /metrics
+app.add_middleware(metrics.MetricsMiddleware)
+
+def _user_image_path(filename):
+    """生成user_TempImage文件夹（按文件名分片的子目录）中的保存路径，返回(本地路径, 相对URL)"""
+    user_temp_dir = os.path.join(parent_dir, 'user_TempImage')
+    
+    # 生成唯一文件名
+    import uuid
+    from datetime import datetime
+    filename = filename or ''
+    file_extension = os.path.splitext(filename)[1] if '.' in filename else '.jpg'
+    unique_filename = f"{datetime.now().strftime('%Y%m%d%H%M%S')}_{uuid.uuid4().hex[:8]}{file_extension}"
+    file_path, relative_path = sharded_path(user_temp_dir, unique_filename)
+    
+    # 构建图片URL (相对路径)
+    return file_path, f"/user_TempImage/{relative_path}"
+
+def _keep_local_copy():
+    return bc.upload_configuration().get('keep_local_copy', True)
+
+# 可预期的错误及对应的 HTTP 状态码
+_EXPECTED_ERRORS = ((UploadTooLarge, 413), (InvalidUpload, 400), (UploadNotFound, 404), (SchedulerBusy, 503),
+                    (CircuitOpen, 503), (DeadlineExceeded, 504))
+
+def _expected_error(e):
+    """
+    上传超过大小上限(413)、直传的对象无效(400)或不存在(404)、皮肤分析排队已满(503)、
+    上游熔断中(503，带 Retry-After)、超过请求截止时间(504)等可预期的错误转换为 HTTPException，其他错误返回 None
+    """
+    if isinstance(e, StageError):
+        e = e.error
+    for error_type, status_code in _EXPECTED_ERRORS:
+        if isinstance(e, error_type):
+            headers = None
+            if getattr(e, 'retry_after', None) is not None:
+                headers = {"Retry-After": str(max(1, round(e.retry_after)))}
+            return HTTPException(status_code=status_code, detail=str(e), headers=headers)
+    return None
+
+def _with_request_deadline(endpoint):
+    """接口装饰器：整个请求（包括线程池中的上游调用）不超过 resilience.request_deadline"""
+    @functools.wraps(endpoint)
+    async def wrapper(*args, **kwargs):
+        with deadline(request_deadline()):
+            return await endpoint(*args, **kwargs)
+    return wrapper
+
+async def _cached(key, field, compute):
+    """
+    相同图片（内容哈希相同）直接复用缓存中的结果，
+    并发的相同请求只执行一次 compute；缓存未启用时直接执行
+    """
+    cache = get_analysis_cache()
+    if cache is None:
+        return await compute()
+    return await cache.get_or_compute(key, field, compute)
+
+def _known_oss_url(cache, loop):
+    """供 ingest_upload 在线程池中查询同一内容之前上传的OSS地址（缓存在事件循环中读取）"""
+    def known_url(key):
+        entry = asyncio.run_coroutine_threadsafe(cache.get(key), loop).result()
+        return entry.get('oss_url') if entry else None
+    return known_url
+
+async def _ingest(file, local_path=None, filename=None):
+    """
+    单次分块读取上传的图片，同时计算内容哈希、写本地副本并上传到OSS
+    同一张图片之前已经上传过时沿用缓存中的OSS地址：读完才上传的图片（预处理或不超过分片阈值）不再规范化和上传，
+    边读取边上传的大图删除这次重复上传的对象
+    """
+    bucket = get_client_registry().oss_bucket()
+    cache = get_analysis_cache()
+    known_url = _known_oss_url(cache, asyncio.get_running_loop()) if cache is not None else None
+    result = await ingest_upload(file, filename or file.filename, local_path, bucket=bucket, known_url=known_url)
+    if result.get("deduplicated"):
+        logger.info(f"图片之前已上传，沿用: {result['size']} 字节, {result['oss_url']}")
+        return result
+    logger.info(f"图片已读取并上传: {result['size']} 字节, {result['oss_url']}")
+    if result.get("preprocess"):
+        logger.info(f"图片预处理: {result['preprocess']}")
+    if cache is None:
+        return result
+    key = result["content_hash"]
+    entry = await cache.get(key)
+    if entry and entry.get('oss_url'):
+        try:
+            await run_blocking(delete_oss_object, result["oss_url"], bucket)
+        except Exception as e:
+            logger.warning(f"删除重复上传的对象失败: {str(e)}")
+        result["oss_url"] = entry['oss_url']
+    else:
+        await cache.put(key, oss_url=result["oss_url"])
+    return result
+
+async def _direct_upload(object_key):
+    """
+    浏览器直传到OSS的图片（见 /api/upload/policy）：只检查对象（HEAD，不下载内容），
+    按 ETag（对象内容的 MD5）复用缓存中的分析结果，返回与 _ingest 相同结构的结果
+    """
+    config = bc.direct_upload_configuration()
+    if not config.get('enabled', True):
+        raise InvalidUpload("未启用浏览器直传")
+    max_bytes = int(bc.upload_configuration().get('max_bytes', DEFAULT_MAX_BYTES))
+    info = await run_blocking(
+        check_direct_upload, object_key, max_bytes, direct_upload_prefix(config.get('prefix')),
+        get_client_registry().oss_bucket()
+    )
+    logger.info(f"使用直传的图片: {info['size']} 字节, {info['oss_url']}")
+    return {
+        "content_hash": content_hash(f"oss-etag:{info['etag'] or info['oss_url']}".encode('utf-8')),
+        "size": info["size"],
+        "oss_url": info["oss_url"],
+        "local_path": None,
+        "preprocess": None,
+    }
+
+def _streamed_upload(request: Request, filename=None):
+    """
+    请求体直接是图片（Content-Type: image/*，文件名可以用 ?filename= 指定）时，不等请求体接收完就开始读取和上传，
+    返回代替 UploadFile 的 StreamedUpload；不是这种请求时返回None
+    """
+    content_type = request.headers.get('content-type', '').split(';')[0].strip().lower()
+    if not content_type.startswith('image/'):
+        return None
+    length = request.headers.get('content-length', '')
+    if not filename:
+        filename = f"upload{mimetypes.guess_extension(content_type) or '.jpg'}"
+    return StreamedUpload(request.stream(), asyncio.get_running_loop(), filename, content_type,
+                          int(length) if length.isdigit() else None)
+
+def _check_image_source(file, object_key):
+    """/api/analyze 需要上传的图片(file)或直传的 object_key 二者之一"""
+    if (file is None) == (not object_key):
+        raise HTTPException(status_code=400, detail="请上传图片(file)或提供直传的 object_key（二选一）")
+    if file is not None and (not file.content_type or not file.content_type.startswith('image/')):
+        error_msg = f"无效的文件类型: {file.content_type}。请上传图片文件。"
+        logger.warning(error_msg)
+        raise HTTPException(status_code=400, detail=error_msg)
+
+async def _run_skin_analysis(oss_url):
+    """调用阿里云皮肤分析（经过配额调度器排队），返回 SkinAnalysisResult"""
+    skin_analysis = bc.skin_analysis_configuration()
+    if not skin_analysis:
+        raise ValueError("初始化皮肤分析配置失败")
+    # 同一张图片的分析是幂等的，上游响应慢时可以发对冲请求（默认关闭，对冲请求同样经过调度器、占用配额）
+    client = get_client_registry().skin_client()
+    analysis_result = await hedged('skin_analysis', lambda: get_skin_scheduler().call(
+        Sample.main, [], skin_analysis, oss_url, client
+    ))
+    if not analysis_result:
+        raise ValueError("皮肤分析未返回结果")
+    return analysis_result
+
+async def _run_reasoning(analysis_data, question):
+    """调用 DeepSeek 对皮肤分析结果进行推理，返回 dp_analysis_result 的结果"""
+    dp_api_key, dp_base_url, dp_model_name = bc.deepseek_R1_instantiation()
+    from deepseek_R1_reasoning import dp_analysis_result
+    return await run_blocking(
+        dp_analysis_result,
+        analysis_data,
+        dp_api_key,
+        dp_base_url,
+        dp_model_name,
+        question,
+        get_client_registry().deepseek_client()
+    )
 
 @app.post("/api/save-image")
 async def save_image(file: UploadFile = File(...)) -> Dict[str, Any]:
@@ -50,27 +290,11 @@ async def save_image(file: UploadFile = File(...)) -> Dict[str, Any]:
             logger.warning(error_msg)
             raise HTTPException(status_code=400, detail=error_msg)
         
-        # 确保user_TempImage文件夹存在
-        user_temp_dir = os.path.join(parent_dir, 'user_TempImage')
-        os.makedirs(user_temp_dir, exist_ok=True)
-        
-        # 生成唯一文件名
-        import uuid
-        from datetime import datetime
-        file_extension = os.path.splitext(file.filename)[1] if '.' in file.filename else '.jpg'
-        unique_filename = f"{datetime.now().strftime('%Y%m%d%H%M%S')}_{uuid.uuid4().hex[:8]}{file_extension}"
-        file_path = os.path.join(user_temp_dir, unique_filename)
-        
-        # 保存文件
-        with open(file_path, "wb") as buffer:
-            content = await file.read()
-            buffer.write(content)
-        
+        # 按块复制到本地，不把整张图片读入内存
+        file_path, image_url = _user_image_path(file.filename)
+        await ingest_upload(file, file.filename, file_path, upload=False)
         logger.info(f"图片已保存到: {file_path}")
         
-        # 构建图片URL (相对路径)
-        image_url = f"/user_TempImage/{unique_filename}"
-        
         return {
             "status": "success",
             "message": "图片已成功保存",
@@ -81,11 +305,38 @@ async def save_image(file: UploadFile = File(...)) -> Dict[str, Any]:
     except HTTPException:
         raise
     except Exception as e:
+        if _expected_error(e):
+            raise _expected_error(e)
         error_msg = f"保存图片时发生错误: {str(e)}"
         logger.error(error_msg, exc_info=True)
         raise HTTPException(status_code=500, detail=error_msg)
 
+class UploadPolicyRequest(BaseModel):
+    """申请浏览器直传OSS的凭证"""
+    content_type: str
+    filename: str = ''
+
+@app.post("/api/upload/policy")
+async def upload_policy(body: UploadPolicyRequest) -> Dict[str, Any]:
+    """
+    签发浏览器直传OSS的短期凭证（PostObject 表单策略和 PUT 签名URL），图片字节不经过本服务；
+    上传完成后以返回的 object_key 调用 /api/analyze 或 /api/analyze/stream
+    """
+    config = bc.direct_upload_configuration()
+    if not config.get('enabled', True):
+        raise HTTPException(status_code=404, detail="未启用浏览器直传")
+    if not body.content_type.startswith('image/') or any(c in body.content_type for c in '\r\n;"'):
+        raise HTTPException(status_code=400, detail=f"无效的文件类型: {body.content_type}。请上传图片文件。")
+    max_bytes = int(bc.upload_configuration().get('max_bytes', DEFAULT_MAX_BYTES))
+    return direct_upload_ticket(
+        body.filename, body.content_type, max_bytes,
+        prefix=direct_upload_prefix(config.get('prefix')),
+        expires_seconds=int(config.get('expires_seconds', DEFAULT_DIRECT_UPLOAD_EXPIRES)),
+        bucket=get_client_registry().oss_bucket()
+    )
+
 @app.post("/api/upload")
+@_with_request_deadline
 async def upload_image(file: UploadFile = File(...)) -> Dict[str, Any]:
     """
     上传图片并返回分析结果
@@ -100,9 +351,10 @@ async def upload_image(file: UploadFile = File(...)) -> Dict[str, Any]:
             raise HTTPException(status_code=400, detail=error_msg)
         
         try:
-            # 保存文件到临时目录并上传到 OSS
+            # 保存文件到临时目录并上传到 OSS（只读取一遍），按内容哈希复用缓存中的分析结果
             logger.info("开始上传文件到OSS...")
-            oss_url = await save_and_upload(file)
+            uploaded = await _ingest(file, local_copy_path(file.filename))
+            key, oss_url = uploaded["content_hash"], uploaded["oss_url"]
             
             if not oss_url:
                 error_msg = "上传文件到OSS失败，未返回URL"
@@ -111,43 +363,23 @@ async def upload_image(file: UploadFile = File(...)) -> Dict[str, Any]:
                 
             logger.info(f"文件已上传到OSS: {oss_url}")
             
-            # 获取皮肤分析配置
-            logger.info("初始化皮肤分析配置...")
-            skin_analysis, _ = bc.skin_analysis_instantiation()
-            
-            if not skin_analysis:
-                error_msg = "初始化皮肤分析配置失败"
-                logger.error(error_msg)
-                raise HTTPException(status_code=500, detail=error_msg)
-            
             # 调用皮肤分析
             logger.info("开始皮肤分析...")
-            analysis_result = Sample.main([], skin_analysis, oss_url)
-            
-            if not analysis_result:
-                error_msg = "皮肤分析未返回结果"
-                logger.error(error_msg)
-                raise HTTPException(status_code=500, detail=error_msg)
+            analysis_result = await _cached(key, 'analysis', lambda: _run_skin_analysis(oss_url))
+            logger.info("皮肤分析完成")
             
-            # 解析分析结果
-            try:
-                analysis_data = json.loads(analysis_result)
-                logger.info("皮肤分析完成")
-            except json.JSONDecodeError as e:
-                error_msg = f"解析分析结果失败: {str(e)}"
-                logger.error(f"{error_msg}, 原始结果: {analysis_result[:200]}...")
-                analysis_data = {
-                    "error": "Failed to parse analysis result", 
-                    "raw_result": str(analysis_result)[:1000]
-                }
-            
-            return {
+            # 分析结果只在这里序列化一次
+            return FastJSONResponse({
                 "status": "success",
                 "image_url": oss_url,
-                "analysis": analysis_data
-            }
+                "analysis": analysis_result
+            })
             
+        except HTTPException:
+            raise
         except Exception as e:
+            if _expected_error(e):
+                raise _expected_error(e)
             error_msg = f"处理文件时发生错误: {str(e)}"
             logger.error(error_msg, exc_info=True)
             raise HTTPException(status_code=500, detail=error_msg)
@@ -160,37 +392,81 @@ async def upload_image(file: UploadFile = File(...)) -> Dict[str, Any]:
         logger.error(error_msg, exc_info=True)
         raise HTTPException(status_code=500, detail=error_msg)
 
+def _build_analyze_pipeline(file, question, object_key=None):
+    """
+    构建 /api/analyze 的阶段依赖图:
+        upload (单次读取: 哈希 + 本地副本 + OSS) ──> skin_analysis ──> reasoning (DeepSeek)
+                                                                 └─> chart (本地生成或 NIM 设计样式, 可选，与 reasoning 并行)
+    图片已经直传到OSS时(object_key)，upload 阶段只检查对象
+    """
+    clients = get_client_registry()
+
+    async def upload(ctx):
+        if object_key:
+            return await _direct_upload(object_key)
+        local_path = None
+        if _keep_local_copy():
+            local_path, _ = _user_image_path(file.filename)
+        return await _ingest(file, local_path)
+
+    async def skin_analysis(ctx):
+        key, oss_url = ctx["upload"]["content_hash"], ctx["upload"]["oss_url"]
+        return await _cached(key, 'analysis', lambda: _run_skin_analysis(oss_url))
+
+    async def reasoning(ctx):
+        return await _run_reasoning(ctx["skin_analysis"], question)
+
+    async def chart(ctx):
+        # 默认本地生成；creative 模式由 NIM 设计样式（按数据结构缓存）
+        from chart_builder import build_chart
+        chart_config, source = await build_chart(ctx["skin_analysis"], clients.nim_session)
+        # 图表由本服务渲染（/api/charts），不再把配置编码进 quickchart.io 的URL
+        options = render_options()
+        key = await run_blocking(save_chart_spec, chart_config, options)
+        return {"url": f"/api/charts/{key}.{options['format']}", "config": chart_config, "source": source}
+
+    # 每个阶段有各自的时间预算（resilience.stage_budgets），不超过请求剩余的时间
+    stages = [
+        Stage("upload", upload, timeout=stage_budget("upload")),
+        Stage("skin_analysis", skin_analysis, deps=["upload"], timeout=stage_budget("skin_analysis")),
+        Stage("reasoning", reasoning, deps=["skin_analysis"], timeout=stage_budget("reasoning")),
+    ]
+    if bc.pipeline_configuration().get('chart_enabled', True):
+        # 图表生成失败不影响主流程
+        stages.append(Stage("chart", chart, deps=["skin_analysis"], optional=True, timeout=stage_budget("chart")))
+    return Pipeline(stages)
+
 @app.post("/api/analyze")
-async def analyze_skin(file: UploadFile = File(...), question: str = "我的皮肤状况如何？"):
-    """完整的皮肤分析流程"""
+@_with_request_deadline
+async def analyze_skin(request: Request, file: Optional[UploadFile] = File(None),
+                       object_key: Optional[str] = Form(None), question: str = "我的皮肤状况如何？",
+                       filename: Optional[str] = None):
+    """
+    完整的皮肤分析流程（各阶段按依赖关系并发执行）
+    图片可以随请求上传(file)，也可以先通过 /api/upload/policy 直传到OSS，再只提交 object_key；
+    请求体直接是图片（Content-Type: image/*）时边接收边上传到OSS
+    """
     try:
-        # 1. 保存图片到user_TempImage
-        saved_image = await save_image(file)
-        
-        # 2. 上传到OSS
-        oss_url = await save_and_upload(file)
+        if file is None and not object_key:
+            file = _streamed_upload(request, filename)
+        if file is not None:
+            logger.info(f"收到分析请求，文件名: {file.filename}, 类型: {file.content_type}")
+        else:
+            logger.info(f"收到分析请求，直传的对象: {object_key}")
+        _check_image_source(file, object_key)
         
-        # 3. 皮肤分析
-        skin_analysis, _ = bc.skin_analysis_instantiation()
-        analysis_result = Sample.main([], skin_analysis, oss_url)
+        pipeline = _build_analyze_pipeline(file, question, object_key)
+        results, timings = await pipeline.run()
+        logger.info(f"分析完成，各阶段耗时: {timings}")
         
-        # 4. DeepSeek推理
-        dp_api_key, dp_base_url, dp_model_name = bc.deepseek_R1_instantiation()
-        from deepseek_R1_reasoning import dp_analysis_result
-        reasoning_result = dp_analysis_result(
-            analysis_result,
-            dp_api_key,
-            dp_base_url,
-            dp_model_name,
-            question
-        )
+        reasoning_result = results["reasoning"]
         
-        # 构建前端需要的结构化数据
-        return {
+        # 构建前端需要的结构化数据（分析结果只在这里序列化一次）
+        return FastJSONResponse({
             "status": "success",
-            "image_path": saved_image["image_path"],
-            "image_url": oss_url,
-            "analysis": json.loads(analysis_result),
+            "image_path": results["upload"]["local_path"],
+            "image_url": results["upload"]["oss_url"],
+            "analysis": results["skin_analysis"],
             "ai_reasoning": {
                 "title": "🧠 AI模型推理过程",
                 "subtitle": "深度学习算法分析步骤详解",
@@ -198,13 +474,377 @@ async def analyze_skin(file: UploadFile = File(...), question: str = "我的皮
                 "content": reasoning_result["reasoning"],
                 "result": reasoning_result["content"],
                 "progress": 100
-            }
-        }
+            },
+            "chart": results.get("chart"),
+            "timings": timings
+        })
         
+    except HTTPException:
+        raise
     except Exception as e:
+        if _expected_error(e):
+            raise _expected_error(e)
         logger.error(f"分析过程中出错: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
 
+async def _reasoning_events(analysis_result, question):
+    """以 SSE 事件逐条推送 DeepSeek 的推理过程(reasoning)和最终回答(answer)增量"""
+    dp_api_key, dp_base_url, dp_model_name = bc.deepseek_R1_instantiation()
+    from deepseek_R1_reasoning import dp_analysis_stream, iter_response
+    client = get_client_registry().deepseek_client()
+
+    def open_stream():
+        return dp_analysis_stream(analysis_result, dp_api_key, dp_base_url, dp_model_name, question, client)
+
+    started = time.perf_counter()
+    first_token_ms = None
+    async for kind, text in iterate_in_thread(open_stream, iter_response):
+        if first_token_ms is None:
+            first_token_ms = round((time.perf_counter() - started) * 1000, 1)
+        yield format_sse("reasoning" if kind == "reasoning" else "answer", {"delta": text})
+    yield format_sse("done", {
+        "first_token_ms": first_token_ms,
+        "total_ms": round((time.perf_counter() - started) * 1000, 1)
+    })
+
+@app.post("/api/analyze/stream")
+@_with_request_deadline
+async def analyze_skin_stream(request: Request, file: Optional[UploadFile] = File(None),
+                              object_key: Optional[str] = Form(None), question: str = "我的皮肤状况如何？",
+                              filename: Optional[str] = None):
+    """
+    流式皮肤分析，以 SSE 事件依次推送:
+    start -> queued(需要排队时，附带排队位置和预计等待时间) -> analysis(皮肤分析结果)
+    -> reasoning/answer(DeepSeek增量) -> done，出错时推送 error
+    客户端断开时会关闭 DeepSeek 的流式响应，停止继续生成
+    与 /api/analyze 一样可以只提交直传的 object_key，或者直接以图片作为请求体
+    """
+    if file is None and not object_key:
+        file = _streamed_upload(request, filename)
+    if file is not None:
+        logger.info(f"收到流式分析请求，文件名: {file.filename}, 类型: {file.content_type}")
+    else:
+        logger.info(f"收到流式分析请求，直传的对象: {object_key}")
+    _check_image_source(file, object_key)
+    
+    # 返回流式响应前完成上传（按块读取，不整体读入内存），处理函数返回后 UploadFile 可能会被关闭
+    try:
+        uploaded = await (_ingest(file) if file is not None else _direct_upload(object_key))
+    except Exception as e:
+        if _expected_error(e):
+            raise _expected_error(e)
+        logger.error(f"上传图片失败: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e))
+    key, oss_url = uploaded["content_hash"], uploaded["oss_url"]
+
+    async def events():
+        yield format_sse("start", {"status": "processing"})
+        try:
+            # 流式响应在处理函数返回后才开始，单独设置截止时间
+            with deadline(request_deadline()):
+                cache = get_analysis_cache()
+                entry = await cache.get(key) if cache is not None else None
+                if not (entry and entry.get('analysis')):
+                    # 皮肤分析接口有配额限制，需要排队时告知调用方排队位置和预计等待时间
+                    estimate = get_skin_scheduler().estimate()
+                    if estimate["queue_position"] or estimate["estimated_wait_ms"]:
+                        yield format_sse("queued", estimate)
+                analysis_result = await _cached(key, 'analysis', lambda: _run_skin_analysis(oss_url))
+                yield format_sse("analysis", {
+                    "content_hash": key,
+                    "image_url": oss_url,
+                    "analysis": analysis_result
+                })
+                async for event in _reasoning_events(analysis_result, question):
+                    yield event
+        except Exception as e:
+            logger.error(f"流式分析过程中出错: {str(e)}", exc_info=True)
+            yield format_sse("error", {"detail": str(e)})
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+class FollowUpQuestion(BaseModel):
+    """追问请求：通过 content_hash 引用之前的分析结果，或直接提供 analysis"""
+    question: str
+    content_hash: Optional[str] = None
+    analysis: Optional[Dict[str, Any]] = None
+
+@app.post("/api/analyze/stream/followup")
+@_with_request_deadline
+async def followup_stream(body: FollowUpQuestion):
+    """针对已有的皮肤分析结果追问，以 SSE 事件推送 reasoning/answer 增量和 done"""
+    if body.analysis is not None:
+        analysis_result = body.analysis
+    elif body.content_hash:
+        cache = get_analysis_cache()
+        entry = await cache.get(body.content_hash) if cache is not None else None
+        if not entry or not entry.get('analysis'):
+            raise HTTPException(status_code=404, detail="未找到对应的皮肤分析结果，请重新上传图片")
+        analysis_result = entry['analysis']
+    else:
+        raise HTTPException(status_code=400, detail="需要提供 content_hash 或 analysis")
+
+    async def events():
+        try:
+            # 与 /api/analyze/stream 相同：流式响应在处理函数返回后才开始，单独设置截止时间
+            with deadline(request_deadline()):
+                async for event in _reasoning_events(analysis_result, body.question):
+                    yield event
+        except Exception as e:
+            logger.error(f"追问过程中出错: {str(e)}", exc_info=True)
+            yield format_sse("error", {"detail": str(e)})
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+class BatchRequest(BaseModel):
+    """批量分析请求（JSON）：分析OSS中已有的图片"""
+    oss_keys: List[str]
+    reasoning: bool = False
+    question: str = "我的皮肤状况如何？"
+    concurrency: Optional[int] = None
+
+def _form_flag(value):
+    return str(value).lower() in ('1', 'true', 'yes', 'on')
+
+async def _analyze_batch_item(item, reasoning, question):
+    """
+    处理批量分析中的一项：上传（或使用已有的OSS对象）-> 皮肤分析 -> 可选的 DeepSeek 推理
+    Args:
+        item (dict): {"index", "file": UploadFile} 或 {"index", "oss_key"}
+    """
+    started = time.perf_counter()
+    result = {"index": item["index"]}
+    try:
+        if "file" in item:
+            upload = item["file"]
+            result["source"] = upload.filename
+            if not upload.content_type or not upload.content_type.startswith('image/'):
+                raise ValueError(f"无效的文件类型: {upload.content_type}")
+            uploaded = await _ingest(upload, local_copy_path(upload.filename))
+            key, oss_url = uploaded["content_hash"], uploaded["oss_url"]
+        else:
+            result["source"] = item["oss_key"]
+            oss_url = oss_url_for_key(item["oss_key"])
+            # 没有图片内容，以OSS地址作为缓存的key
+            key = content_hash(f"oss:{oss_url}".encode('utf-8'))
+        result.update(content_hash=key, image_url=oss_url)
+
+        analysis_result = await _cached(key, 'analysis', lambda: _run_skin_analysis(oss_url))
+        result["analysis"] = analysis_result
+        if reasoning:
+            reasoning_result = await _run_reasoning(result["analysis"], question)
+            result["reasoning"] = {"content": reasoning_result["reasoning"], "result": reasoning_result["content"]}
+        result["status"] = "success"
+    except Exception as e:
+        # 单项失败不影响整个批次
+        logger.warning(f"批量分析第 {item['index']} 项失败: {str(e)}")
+        result.update(status="error", error=str(e))
+    result["duration_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    return result
+
+@app.post("/api/analyze/batch")
+async def analyze_batch(request: Request):
+    """
+    批量皮肤分析，按完成顺序以 NDJSON 逐行返回每一项的结果，最后一行为汇总
+    请求可以是:
+        multipart/form-data: files（多个图片）、oss_keys（多个已有的OSS对象）、reasoning、question、concurrency
+        application/json: {"oss_keys": [...], "reasoning": false, "question": "...", "concurrency": 4}
+    """
+    batch_config = bc.batch_configuration()
+    max_items = int(batch_config.get('max_items', 500))
+    form = None
+    if request.headers.get('content-type', '').startswith('application/json'):
+        try:
+            body = BatchRequest(**await request.json())
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=f"无效的请求: {str(e)}")
+        items = [{"oss_key": key} for key in body.oss_keys]
+        reasoning, question, concurrency = body.reasoning, body.question, body.concurrency
+    else:
+        # 自己解析表单，上传的文件在流式响应结束后再关闭
+        form = await request.form(max_files=max_items, max_fields=max_items + 10)
+        items = [{"file": f} for f in form.getlist('files') if hasattr(f, 'filename')]
+        items += [{"oss_key": key} for key in form.getlist('oss_keys') if isinstance(key, str) and key]
+        reasoning = _form_flag(form.get('reasoning', False))
+        question = form.get('question') or "我的皮肤状况如何？"
+        concurrency = form.get('concurrency')
+        concurrency = int(concurrency) if isinstance(concurrency, str) and concurrency.isdigit() else None
+
+    if not items or len(items) > max_items:
+        if form is not None:
+            await form.close()
+        raise HTTPException(status_code=400, detail=f"每个批次需要包含 1 到 {max_items} 张图片")
+    for index, item in enumerate(items):
+        item["index"] = index
+
+    max_concurrency = int(batch_config.get('max_concurrency', 16))
+    concurrency = max(1, min(concurrency or int(batch_config.get('concurrency', 4)), max_concurrency))
+    logger.info(f"收到批量分析请求: {len(items)} 项, 并发 {concurrency}, DeepSeek 推理: {reasoning}")
+
+    async def lines():
+        started = time.perf_counter()
+        semaphore = asyncio.Semaphore(concurrency)
+        queue = asyncio.Queue()
+
+        async def worker(item):
+            async with semaphore:
+                await queue.put(await _analyze_batch_item(item, reasoning, question))
+
+        tasks = [asyncio.ensure_future(worker(item)) for item in items]
+        succeeded = 0
+        try:
+            for _ in items:
+                result = await queue.get()
+                succeeded += result["status"] == "success"
+                yield json_dumps(result) + b"\n"
+            yield json_dumps({"summary": {
+                "total": len(items),
+                "succeeded": succeeded,
+                "failed": len(items) - succeeded,
+                "concurrency": concurrency,
+                "duration_ms": round((time.perf_counter() - started) * 1000, 1)
+            }}) + b"\n"
+        finally:
+            # 客户端断开时取消尚未完成的项
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            if form is not None:
+                await form.close()
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+_job_workers = None
+_JOB_DEFAULT_QUESTION = "我的皮肤状况如何？"
+
+async def _run_job(job, progress):
+    """
+    执行一个异步分析任务: upload (OSS) -> skin_analysis -> reasoning (DeepSeek, 可选)
+    各阶段的状态和耗时由 progress 写回任务存储；中断后重新执行时，
+    相同图片的OSS地址和皮肤分析结果直接来自分析缓存，不会重复调用上游
+    """
+    async def upload():
+        local_path = None
+        if _keep_local_copy():
+            local_path, _ = _user_image_path(job["filename"])
+        with open(job["spool_path"], 'rb') as spooled:
+            return await _ingest(spooled, local_path, job["filename"])
+
+    uploaded = await progress.run("upload", upload())
+    key, oss_url = uploaded["content_hash"], uploaded["oss_url"]
+    analysis_result = await progress.run(
+        "skin_analysis", _cached(key, 'analysis', lambda: _run_skin_analysis(oss_url))
+    )
+    result = {
+        "content_hash": key,
+        "image_url": oss_url,
+        "image_path": uploaded["local_path"],
+        "analysis": analysis_result,
+    }
+    if job["reasoning"]:
+        reasoning_result = await progress.run(
+            "reasoning", _run_reasoning(result["analysis"], job["question"] or _JOB_DEFAULT_QUESTION)
+        )
+        result["ai_reasoning"] = {"content": reasoning_result["reasoning"], "result": reasoning_result["content"]}
+    return result
+
+@app.post("/api/jobs", status_code=202)
+async def submit_job(file: UploadFile = File(...), question: str = _JOB_DEFAULT_QUESTION,
+                     reasoning: bool = True) -> Dict[str, Any]:
+    """
+    提交异步分析任务：图片落盘并登记后立即返回任务ID，
+    后台依次执行 上传 -> 皮肤分析 -> DeepSeek 推理，通过 GET /api/jobs/{job_id} 查询进度和结果
+    """
+    if not bc.jobs_configuration().get('enabled', True):
+        raise HTTPException(status_code=503, detail="异步分析任务未启用")
+    if not file.content_type or not file.content_type.startswith('image/'):
+        raise HTTPException(status_code=400, detail=f"无效的文件类型: {file.content_type}。请上传图片文件。")
+
+    store = get_job_store()
+    job_id = new_job_id()
+    spool_path = store.spool_path(job_id, file.filename)
+    try:
+        # 只落盘（同时检查大小上限），上传到OSS在后台执行
+        spooled = await ingest_upload(file, file.filename, spool_path, upload=False)
+        await run_blocking(store.create, job_id, file.filename, spool_path, question, reasoning)
+    except Exception as e:
+        remove_spool(spool_path)
+        if _expected_error(e):
+            raise _expected_error(e)
+        logger.error(f"提交任务失败: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e))
+    logger.info(f"已提交任务 {job_id}: {file.filename}, {spooled['size']} 字节")
+    if _job_workers is not None:
+        _job_workers.notify()
+    return {"job_id": job_id, "status": "pending", "status_url": f"/api/jobs/{job_id}"}
+
+@app.get("/api/jobs/{job_id}")
+async def get_job(job_id: str) -> Dict[str, Any]:
+    """查询异步分析任务的状态、各阶段进度和最终结果"""
+    job = await run_blocking(get_job_store().get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="任务不存在或已过期")
+    total = 3 if job["reasoning"] else 2
+    finished = sum(1 for stage in job["stages"].values() if stage.get("status") == "succeeded")
+    response = {
+        "job_id": job["id"],
+        "status": job["status"],
+        "progress": round(finished * 100 / total),
+        "stages": job["stages"],
+        "attempts": job["attempts"],
+        "created_at": job["created_at"],
+        "updated_at": job["updated_at"],
+        "result": job["result"],
+        "error": job["error"],
+    }
+    if "queue_position" in job:
+        response["queue_position"] = job["queue_position"]
+    if job["status"] == "pending" and job.get("run_after"):
+        # 上游暂时不可用，任务在这个时间之后重新执行
+        response["retry_at"] = job["run_after"]
+    return response
+
+# 图表地址中的哈希由内容决定，内容永远不变，浏览器和CDN可以一直缓存
+_CHART_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+@app.get("/api/charts/{chart_file}")
+async def get_chart(chart_file: str, request: Request):
+    """按内容哈希返回渲染好的图表（{hash}.svg 或 {hash}.png），首次请求时渲染并缓存到磁盘"""
+    key, _, image_format = chart_file.partition('.')
+    if not is_chart_key(key) or image_format not in MEDIA_TYPES:
+        raise HTTPException(status_code=404, detail="图表不存在")
+    headers = {"ETag": f'"{key}.{image_format}"', "Cache-Control": _CHART_CACHE_CONTROL}
+    if request.headers.get('if-none-match') in (headers["ETag"], f'W/{headers["ETag"]}'):
+        return Response(status_code=304, headers=headers)
+    try:
+        path = await rendered_chart_path(key, image_format)
+    except Exception as e:
+        logger.error(f"渲染图表失败: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"渲染图表失败: {str(e)}")
+    if path is None:
+        raise HTTPException(status_code=404, detail="图表不存在或已过期")
+    return FileResponse(path, media_type=MEDIA_TYPES[image_format], headers=headers)
+
+@app.get("/api/skin-analysis/queue")
+async def skin_analysis_queue() -> Dict[str, Any]:
+    """皮肤分析配额调度器的状态：排队数、并发数、限流次数和新请求的预计等待时间"""
+    return get_skin_scheduler().stats()
+
+@app.get("/api/storage")
+async def storage_stats() -> Dict[str, Any]:
+    """临时图片目录的磁盘占用和清理（TTL/配额淘汰）统计"""
+    return get_janitor().stats()
+
+@app.get("/api/upstreams")
+async def upstream_stats() -> Dict[str, Any]:
+    """各上游熔断器的状态：closed/half_open/open、连续失败次数、进行中的请求数和剩余熔断时间"""
+    return breaker_stats()
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Prometheus 指标：各阶段和上游调用的耗时分布、进行中的请求数、错误原因和大模型 token 统计（本进程）"""
+    return Response(metrics.render_metrics(), media_type=metrics.CONTENT_TYPE)
+
 @app.get("/")
 async def root():
     return {"message": "Skin Analysis API is running"}
@@ -220,11 +860,16 @@ if __name__ == "__main__":
     logger.info(f"临时图片目录: {temp_image_dir}")
     logger.info(f"用户上传图片目录: {user_temp_dir}")
     
-    # 启动服务
+    # 开发模式启动服务（修改代码后自动重启）；生产环境使用 back_end/serve.py（多进程、预加载、平滑退出）
     uvicorn.run(
         "main:app", 
         host="0.0.0.0", 
         port=8000, 
         reload=True,
-        log_level="info"
+        # 从任意目录启动都能找到 main 模块
+        app_dir=current_dir,
+        reload_dirs=[parent_dir],
+        log_level="info",
+        # 不使用 uvicorn 自己的日志配置，访问日志等也写入统一的日志后端
+        log_config=None
     )
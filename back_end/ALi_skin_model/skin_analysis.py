@@ -8,68 +8,75 @@ from pathlib import Path
 sys.path.append(str(Path(__file__).parent.parent))
 sys.stdout.reconfigure(encoding='utf-8')
 
-from typing import List
+from typing import List, TYPE_CHECKING
+from collections.abc import Mapping
 import json
-from alibabacloud_imageprocess20200320.client import Client as imageprocess20200320Client
-from alibabacloud_credentials.client import Client as CredentialClient
-from alibabacloud_tea_openapi import models as open_api_models
-from alibabacloud_imageprocess20200320 import models as imageprocess_20200320_models
-from alibabacloud_tea_util import models as util_models
-from alibabacloud_tea_util.client import Client as UtilClient
 
 import back_configuration as bc
+from skin_result import SkinAnalysisResult
+from metrics import track_upstream
+from resilience import guard, upstream_timeout
 
+if TYPE_CHECKING:
+    from alibabacloud_imageprocess20200320.client import Client as imageprocess20200320Client
+
+# 阿里云 SDK（Tea 及其依赖的 aiohttp 等）导入较慢，在首次创建客户端或调用时才导入，
+# 服务启动后由客户端预热在后台完成
 class Sample:
     @staticmethod
-    def create_client(skin_analysis) -> imageprocess20200320Client:
+    def create_client(skin_analysis) -> 'imageprocess20200320Client':
+        from alibabacloud_imageprocess20200320.client import Client as imageprocess20200320Client
+        from alibabacloud_tea_openapi import models as open_api_models
         config = open_api_models.Config(
             access_key_id=skin_analysis.get('access_key_id'),
             access_key_secret=skin_analysis.get('access_key_secret'),
         )
         config.endpoint = skin_analysis.get('endpoint', 'imageprocess.cn-shanghai.aliyuncs.com')
+        # 默认 HTTPS；连接本地的模拟服务（benchmarks/fake_upstreams.py）时配置为 HTTP
+        config.protocol = skin_analysis.get('protocol', 'HTTPS')
         return imageprocess20200320Client(config)
 
     @staticmethod
     def main(
         args: List[str],
         skin_analysis,
-        oss_img_url: str
-    ) -> str:
+        oss_img_url: str,
+        client: 'imageprocess20200320Client' = None
+    ) -> SkinAnalysisResult:
         if not oss_img_url:
             raise ValueError("oss_img_url cannot be empty")
             
-        if not skin_analysis or not isinstance(skin_analysis, dict):
+        if not skin_analysis or not isinstance(skin_analysis, Mapping):
             raise ValueError("Invalid skin_analysis configuration")
             
-        client = Sample.create_client(skin_analysis)
+        from alibabacloud_imageprocess20200320 import models as imageprocess_20200320_models
+        from alibabacloud_tea_util import models as util_models
+        # 优先复用调用方传入的长连接客户端
+        client = client or Sample.create_client(skin_analysis)
         detect_skin_disease_request = imageprocess_20200320_models.DetectSkinDiseaseRequest(
             url=oss_img_url,
             org_id=skin_analysis.get('org_id'),
             org_name=skin_analysis.get('org_name')
         )
-        runtime = util_models.RuntimeOptions()
+        # 超时不超过请求剩余的时间；失败不在 SDK 内重试（限流由调度器重试，其余错误由熔断器统计）
+        timeout_ms = int(upstream_timeout('skin_analysis') * 1000)
+        runtime = util_models.RuntimeOptions(
+            autoretry=False,
+            connect_timeout=min(timeout_ms, 5000),
+            read_timeout=timeout_ms
+        )
         try:
-            response = client.detect_skin_disease_with_options(detect_skin_disease_request, runtime)
-            # 格式化输出
-            def obj_to_dict(obj):
-                if isinstance(obj, dict):
-                    return {k: obj_to_dict(v) for k, v in obj.items()}
-                elif hasattr(obj, '__dict__'):
-                    return {k: obj_to_dict(v) for k, v in obj.__dict__.items() if not k.startswith('_')}
-                elif isinstance(obj, list):
-                    return [obj_to_dict(i) for i in obj]
-                else:
-                    return obj
-
-            # 在打印前使用
-            skin_analysis_data = json.dumps(obj_to_dict(response.body.data), ensure_ascii=False, indent=2)
-
-            return skin_analysis_data
+            # 每次调用（包括被限流后的重试）分别计入指标
+            with guard('skin_analysis'), track_upstream('skin_analysis'):
+                response = client.detect_skin_disease_with_options(detect_skin_disease_request, runtime)
+            # 直接从响应对象取字段，不再转换成 JSON 字符串（由调用方在出口处序列化）
+            return SkinAnalysisResult.from_sdk(response.body.data)
         except Exception as error:
             print(getattr(error, 'message', str(error)))
             if hasattr(error, 'data') and error.data:
                 print(error.data.get("Recommend"))
-            UtilClient.assert_as_string(getattr(error, 'message', str(error)))
+            # 抛给调用方（限流错误由调度器退避重试），不再返回 None
+            raise
 
 
 if __name__ == '__main__':
@@ -80,11 +87,11 @@ if __name__ == '__main__':
     # 获取user_TempImage文件夹中的最新图片
     user_temp_dir = os.path.join(Path(__file__).parent.parent, 'user_TempImage')
     
-    # 获取文件夹中的所有图片文件
-    image_files = glob.glob(os.path.join(user_temp_dir, "*.jpg")) + \
-                 glob.glob(os.path.join(user_temp_dir, "*.jpeg")) + \
-                 glob.glob(os.path.join(user_temp_dir, "*.png")) + \
-                 glob.glob(os.path.join(user_temp_dir, "*.webp"))
+    # 获取文件夹（包括分片子目录）中的所有图片文件
+    image_files = glob.glob(os.path.join(user_temp_dir, "**", "*.jpg"), recursive=True) + \
+                 glob.glob(os.path.join(user_temp_dir, "**", "*.jpeg"), recursive=True) + \
+                 glob.glob(os.path.join(user_temp_dir, "**", "*.png"), recursive=True) + \
+                 glob.glob(os.path.join(user_temp_dir, "**", "*.webp"), recursive=True)
     
     if not image_files:
         print(f"在 {user_temp_dir} 文件夹中没有找到图片文件")
@@ -102,4 +109,4 @@ if __name__ == '__main__':
     # 得到分析结果
     result = Sample.main(sys.argv[1:], skin_analysis, oss_img_url)
     # 打印结果
-    print(result)
\ No newline at end of file
+    print(json.dumps(result.to_dict(), ensure_ascii=False, indent=2))
\ No newline at end of file
@@ -0,0 +1,280 @@
+# -*- coding: utf-8 -*-
+"""
+内容寻址的分析结果缓存
+以上传图片字节的 SHA-256 作为 key，缓存 OSS 地址和 Sample.main 的分析结果：
+内存中是有界的 LRU（分析结果保存为 SkinAnalysisResult 对象），磁盘上用 SQLite 持久化（紧凑的 JSON），服务重启后依然有效；
+同一张图片的并发请求共享同一个进行中的上游调用（single-flight）
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import logger_config
+from concurrency import run_blocking
+from skin_result import SkinAnalysisResult
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DB_PATH = os.path.join(os.path.dirname(__file__), 'cache', 'analysis_cache.sqlite3')
+CACHE_FIELDS = ('oss_url', 'analysis')
+# 读取时更新的访问时间先记在内存中，攒够条数或超过间隔后在一个事务中批量写入
+TOUCH_BATCH_SIZE = 64
+TOUCH_FLUSH_SECONDS = 30
+# 超出 max_disk_entries 时多淘汰的比例，之后的若干次写入不必再淘汰
+EVICT_SLACK_RATIO = 0.01
+
+
+def content_hash(content):
+    """计算上传内容的 SHA-256"""
+    return hashlib.sha256(content).hexdigest()
+
+
+def _to_disk(field, value):
+    return value.to_json() if isinstance(value, SkinAnalysisResult) else value
+
+
+def _from_disk(field, value):
+    return SkinAnalysisResult.from_json(value) if field == 'analysis' else value
+
+
+class SingleFlight:
+    """同一个 key 的并发调用只真正执行一次，其余调用方等待同一个结果"""
+
+    def __init__(self):
+        self._inflight = {}
+
+    async def do(self, key, func):
+        task = self._inflight.get(key)
+        if task is None:
+            # 单独的任务执行上游调用，发起方断开也不会取消其他等待者共享的调用
+            task = asyncio.ensure_future(func())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._done(key, t))
+        return await asyncio.shield(task)
+
+    def _done(self, key, task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            # 标记异常已被读取，避免没有等待者时输出 "exception was never retrieved"
+            task.exception()
+
+    def __len__(self):
+        return len(self._inflight)
+
+
+class AnalysisCache:
+    """
+    两级缓存: 内存 LRU + SQLite
+    Args:
+        db_path (str): SQLite 文件路径
+        max_entries (int): 内存中最多保留的条目数
+        max_disk_entries (int): 磁盘上最多保留的条目数，超出后按最近访问时间淘汰（一次多淘汰 1%）
+    """
+
+    def __init__(self, db_path=DEFAULT_DB_PATH, max_entries=1024, max_disk_entries=100000):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.max_disk_entries = max_disk_entries
+        self._memory = OrderedDict()
+        self._flight = SingleFlight()
+        self._db_lock = threading.Lock()
+        self._conn = None
+        # 磁盘上的条目数（近似值，其他进程也可能写入，淘汰前重新统计）
+        self._disk_entries = 0
+        # 待写入的访问时间 {content_hash: accessed_at}
+        self._touched = {}
+        self._touched_since = 0.0
+        self.hits = 0
+        self.misses = 0
+
+    def _connect(self):
+        if self._conn is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+            conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS analysis_cache ("
+                " content_hash TEXT PRIMARY KEY,"
+                " oss_url TEXT,"
+                " analysis TEXT,"
+                " created_at REAL,"
+                " accessed_at REAL)"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_analysis_cache_accessed ON analysis_cache (accessed_at)"
+            )
+            conn.commit()
+            self._disk_entries = conn.execute("SELECT COUNT(*) FROM analysis_cache").fetchone()[0]
+            self._conn = conn
+        return self._conn
+
+    # ---------- 磁盘读写（同步，在线程池中执行） ----------
+
+    def _disk_get(self, key):
+        with self._db_lock:
+            conn = self._connect()
+            row = conn.execute(
+                "SELECT oss_url, analysis FROM analysis_cache WHERE content_hash = ?", (key,)
+            ).fetchone()
+            if row is not None:
+                self._touch(conn, key, time.time())
+        if row is None:
+            return None
+        return {field: _from_disk(field, value) for field, value in zip(CACHE_FIELDS, row) if value is not None}
+
+    def _disk_put(self, key, fields):
+        now = time.time()
+        with self._db_lock:
+            conn = self._connect()
+            self._touched.pop(key, None)
+            inserted = conn.execute(
+                "INSERT OR IGNORE INTO analysis_cache (content_hash, created_at, accessed_at) VALUES (?, ?, ?)",
+                (key, now, now)
+            ).rowcount
+            self._disk_entries += inserted
+            for field, value in fields.items():
+                conn.execute(
+                    f"UPDATE analysis_cache SET {field} = ?, accessed_at = ? WHERE content_hash = ?",
+                    (_to_disk(field, value), now, key)
+                )
+            if self._disk_entries > self.max_disk_entries:
+                self._evict(conn)
+            conn.commit()
+
+    def _touch(self, conn, key, now):
+        """记录一次读取的访问时间，攒够一批或超过间隔时写入（调用方持有 _db_lock）"""
+        if not self._touched:
+            self._touched_since = now
+        self._touched[key] = now
+        if len(self._touched) >= TOUCH_BATCH_SIZE or now - self._touched_since >= TOUCH_FLUSH_SECONDS:
+            self._flush_touched(conn)
+            conn.commit()
+
+    def _flush_touched(self, conn):
+        if self._touched:
+            conn.executemany(
+                "UPDATE analysis_cache SET accessed_at = ? WHERE content_hash = ?",
+                [(accessed_at, key) for key, accessed_at in self._touched.items()]
+            )
+            self._touched.clear()
+
+    def _evict(self, conn):
+        """按访问时间淘汰最旧的条目，磁盘上的条目数降到上限以下（沿 accessed_at 索引，不排序整个表）"""
+        self._flush_touched(conn)
+        self._disk_entries = conn.execute("SELECT COUNT(*) FROM analysis_cache").fetchone()[0]
+        excess = self._disk_entries - self.max_disk_entries
+        if excess <= 0:
+            return
+        excess += int(self.max_disk_entries * EVICT_SLACK_RATIO)
+        self._disk_entries -= conn.execute(
+            "DELETE FROM analysis_cache WHERE content_hash IN ("
+            " SELECT content_hash FROM analysis_cache ORDER BY accessed_at LIMIT ?)",
+            (excess,)
+        ).rowcount
+
+    # ---------- 内存 LRU ----------
+
+    def _remember(self, key, fields):
+        entry = self._memory.pop(key, {})
+        entry.update(fields)
+        self._memory[key] = entry
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+        return entry
+
+    # ---------- 对外接口 ----------
+
+    async def get(self, key):
+        """读取缓存条目，先查内存再查磁盘"""
+        entry = self._memory.get(key)
+        if entry is not None:
+            self._memory.move_to_end(key)
+            return entry
+        entry = await run_blocking(self._disk_get, key)
+        if entry:
+            return self._remember(key, entry)
+        return None
+
+    async def put(self, key, **fields):
+        """写入缓存条目的一个或多个字段"""
+        fields = {k: v for k, v in fields.items() if k in CACHE_FIELDS and v is not None}
+        if not fields:
+            return
+        self._remember(key, fields)
+        await run_blocking(self._disk_put, key, fields)
+
+    async def get_or_compute(self, key, field, compute):
+        """
+        命中缓存时直接返回，否则通过 single-flight 执行 compute 并写入缓存
+        Args:
+            key (str): 内容哈希
+            field (str): 缓存字段，'oss_url' 或 'analysis'
+            compute: 无参 async 函数，返回该字段的值
+        """
+        entry = await self.get(key)
+        if entry and entry.get(field) is not None:
+            self.hits += 1
+            logger.info(f"分析缓存命中: {key[:12]} {field}")
+            return entry[field]
+
+        self.misses += 1
+
+        async def compute_and_store():
+            value = await compute()
+            await self.put(key, **{field: value})
+            return value
+
+        return await self._flight.do((key, field), compute_and_store)
+
+    def stats(self):
+        """缓存统计信息"""
+        return {
+            "memory_entries": len(self._memory),
+            "inflight": len(self._flight),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+    def close(self):
+        with self._db_lock:
+            if self._conn is not None:
+                self._flush_touched(self._conn)
+                self._conn.commit()
+                self._conn.close()
+                self._conn = None
+
+
+_cache = None
+
+
+def get_analysis_cache():
+    """获取全局分析缓存（按配置创建），未启用时返回 None"""
+    global _cache
+    cache_config = logger_config.Config().get_analysis_cache()
+    if not cache_config.get('enabled', True):
+        return None
+    if _cache is None:
+        db_path = cache_config.get('db_path') or DEFAULT_DB_PATH
+        if not os.path.isabs(db_path):
+            db_path = os.path.join(os.path.dirname(__file__), db_path)
+        _cache = AnalysisCache(
+            db_path=db_path,
+            max_entries=int(cache_config.get('max_entries', 1024)),
+            max_disk_entries=int(cache_config.get('max_disk_entries', 100000))
+        )
+    return _cache
+
+
+def close_analysis_cache():
+    """关闭全局分析缓存（应用退出时调用）"""
+    global _cache
+    if _cache is not None:
+        _cache.close()
+        _cache = None
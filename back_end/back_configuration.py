@@ -7,8 +7,9 @@ from pathlib import Path
 # 将图片存放在OSS上，并获取对应的upload_url
 def img_to_oss_url():
     # 初始化测试配置实例
-    main_configuration = logger_config.Config().get_main_configuration()
-    img_to_oss_url = logger_config.Config().get_img_to_oss()
+    config = logger_config.Config()
+    main_configuration = config.get_main_configuration()
+    img_to_oss_url = config.get_img_to_oss()
 
     # 测试配置
     access_key_id = main_configuration.get('access_key_id')
@@ -25,6 +26,34 @@ def skin_analysis_instantiation(custom_img_path=None):
     oss_img_url = img_to_oss.file_paths_oss_url(access_key_id, access_key_secret, bucket_name, oss_endpoint, custom_img_path)
     return skin_analysis, oss_img_url
 
+# 获取皮肤分析模型的配置（不上传图片，供已经拿到OSS地址的接口使用）
+def skin_analysis_configuration():
+    return logger_config.Config().get_skin_analysis()
+
+# 获取分析流水线的配置
+def pipeline_configuration():
+    return logger_config.Config().get_pipeline()
+
+# 获取上游连接池的配置
+def http_pool_configuration():
+    return logger_config.Config().get_http_pool()
+
+# 获取批量分析的配置
+def batch_configuration():
+    return logger_config.Config().get_batch()
+
+# 获取异步分析任务的配置
+def jobs_configuration():
+    return logger_config.Config().get_jobs()
+
+# 获取图片上传的配置（大小上限、分块大小、是否保留本地副本）
+def upload_configuration():
+    return logger_config.Config().get_upload()
+
+# 获取浏览器直传OSS的配置（对象前缀、签名有效期）
+def direct_upload_configuration():
+    return logger_config.Config().get_direct_upload()
+
 # 对deepseek-R1的基础配置进行实例化
 def deepseek_R1_instantiation():
     deepseek_llm = logger_config.Config().get_deepseek_api()
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+批量分析基准：/api/analyze/batch 的吞吐随并发数的变化
+上游使用 bench_concurrency 中的 sleep 模拟（上传 0.2s、皮肤分析 0.5s），
+皮肤分析经过配额调度器（默认 8 次/秒、并发 8），吞吐应随并发数线性增长，直到达到上游限额后持平；
+同时统计第一行结果返回的时间（结果按完成顺序流式返回，不必等整个批次）
+
+用法: python benchmarks/bench_batch.py [-n 32] [--rate 8]
+（需要 back_end/config.yaml，可直接从 config.yaml.template 复制，上游调用不会真正发出）
+"""
+
+import argparse
+import json
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+BACK_END_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in (BACK_END_DIR, os.path.join(BACK_END_DIR, 'ALi_skin_model')):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+import httpx
+import uvicorn
+
+import main
+from bench_concurrency import install_stand_ins, UPLOAD_SECONDS, ANALYSIS_SECONDS
+from upstream_scheduler import UpstreamScheduler
+
+CONCURRENCY_LEVELS = (1, 2, 4, 8, 16)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def run_batch(base_url, n, concurrency, round_id):
+    files = [("files", (f"face_{round_id}_{i}.jpg", b"\xff\xd8batch-%d-%d" % (round_id, i), "image/jpeg"))
+             for i in range(n)]
+    started = time.perf_counter()
+    first_line = None
+    summary = None
+    with httpx.stream("POST", f"{base_url}/api/analyze/batch", files=files,
+                      data={"concurrency": str(concurrency)}, timeout=300) as response:
+        response.raise_for_status()
+        for line in response.iter_lines():
+            if not line:
+                continue
+            if first_line is None:
+                first_line = time.perf_counter() - started
+            record = json.loads(line)
+            if "summary" in record:
+                summary = record["summary"]
+    return time.perf_counter() - started, first_line, summary
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="/api/analyze/batch 吞吐基准")
+    parser.add_argument("-n", "--items", type=int, default=32)
+    parser.add_argument("--rate", type=float, default=8, help="皮肤分析上游每秒允许的调用数")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        install_stand_ins(temp_dir)
+        main.bc.batch_configuration = lambda: {"max_items": 1000, "concurrency": 4, "max_concurrency": 64}
+        port = free_port()
+        # 不使用 uvicorn 自己的日志配置（dictConfig 会关闭统一日志后端的文件 handler），同 serve.py
+        server = uvicorn.Server(uvicorn.Config(main.app, port=port, log_level="warning", lifespan="off",
+                                               log_config=None))
+        threading.Thread(target=server.run, daemon=True).start()
+        while not server.started:
+            time.sleep(0.05)
+
+        per_item = UPLOAD_SECONDS + ANALYSIS_SECONDS
+        print(f"每个批次 {args.items} 张图片，单张耗时约 {per_item:.1f}s，皮肤分析限额 {args.rate}/s")
+        print(f"{'并发数':>6}{'总耗时':>10}{'吞吐(张/秒)':>14}{'理论上限':>10}{'首行返回':>10}{'失败':>6}")
+        for round_id, concurrency in enumerate(CONCURRENCY_LEVELS):
+            # 每轮使用新的调度器，令牌桶从满状态开始
+            scheduler = UpstreamScheduler('bench', rate=args.rate, burst=1,
+                                          max_concurrency=int(args.rate), max_queue=10000)
+            main.get_skin_scheduler = lambda: scheduler
+            elapsed, first_line, summary = run_batch(f"http://127.0.0.1:{port}", args.items, concurrency, round_id)
+            bound = min(concurrency / per_item, args.rate)
+            print(f"{concurrency:>6}{elapsed:>9.2f}s{args.items / elapsed:>14.2f}{bound:>10.2f}"
+                  f"{first_line:>9.2f}s{summary['failed']:>6}")
+        server.should_exit = True
+
+
+if __name__ == '__main__':
+    main_cli()
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+"""
+本地图表渲染耗时：按 DetectSkinDisease 响应结构构造的样例，分别渲染 SVG 和 PNG（单进程，不含进程池调度）
+原来的 quickchart.io 地址由客户端向外部服务请求，耗时取决于网络，这里只给出本地渲染的成本
+
+用法: python benchmarks/bench_chart_render.py [--rounds 50] [--font /path/to/NotoSansCJK-Regular.ttc]
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+BACK_END_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACK_END_DIR not in sys.path:
+    sys.path.insert(0, BACK_END_DIR)
+
+from chart_builder import build_chart_config
+from chart_render import render_chart
+
+SAMPLE_RESULTS = {'痤疮': 0.46, '黄褐斑': 0.21, '雀斑': 0.12, '湿疹': 0.08, '酒渣鼻': 0.05,
+                  '色素痣': 0.04, '扁平疣': 0.02, '粟丘疹': 0.02}
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="本地图表渲染耗时")
+    parser.add_argument("--rounds", type=int, default=50, help="每种图表和格式的渲染次数")
+    parser.add_argument("--font", default=None, help="PNG 使用的中文字体")
+    args = parser.parse_args()
+
+    print(f"{'图表':<16}{'格式':<6}{'中位数(ms)':>12}{'p95(ms)':>10}{'大小(字节)':>12}")
+    for chart_type in ('radar', 'bar'):
+        config = build_chart_config({"results": SAMPLE_RESULTS}, chart_type)
+        for image_format in ('svg', 'png'):
+            timings, size = [], 0
+            for _ in range(args.rounds):
+                start = time.perf_counter()
+                size = len(render_chart(config, image_format, font_path=args.font))
+                timings.append((time.perf_counter() - start) * 1000)
+            timings.sort()
+            p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+            print(f"{config['type']:<16}{image_format:<6}{statistics.median(timings):>12.2f}{p95:>10.2f}{size:>12}")
+
+
+if __name__ == '__main__':
+    main_cli()
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""
+并发基准：验证 /api/analyze 不再阻塞事件循环
+用 sleep 模拟上游（OSS上传、阿里云皮肤分析、DeepSeek推理、Gemma图表）的阻塞耗时，
+同时发起 N 个请求，总耗时应接近最慢的单个请求，而不是所有请求耗时之和；
+单个请求的耗时应接近关键路径（上传 -> 分析 -> 推理），而不是所有阶段之和
+
+用法: python benchmarks/bench_concurrency.py [-n 8]
+（需要 back_end/config.yaml，可直接从 config.yaml.template 复制，上游调用不会真正发出）
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+BACK_END_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in (BACK_END_DIR, os.path.join(BACK_END_DIR, 'ALi_skin_model')):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+import logging
+import httpx
+import main
+import img_to_oss
+import image_preprocess
+import deepseek_R1_reasoning
+import gemma3n_models
+from skin_result import SkinAnalysisResult
+from upstream_scheduler import UpstreamScheduler
+
+logging.getLogger().setLevel(logging.WARNING)
+
+UPLOAD_SECONDS = 0.2
+ANALYSIS_SECONDS = 0.5
+REASONING_SECONDS = 1.0
+CHART_SECONDS = 0.8
+
+
+def _fake_upload(chunks, original_filename, bucket=None):
+    for _ in chunks:
+        pass
+    time.sleep(UPLOAD_SECONDS)
+    return "https://bucket.oss-cn-shanghai.aliyuncs.com/uploads/fake.jpg"
+
+
+def _fake_upload_bytes(content, original_filename, bucket=None):
+    # 内容读完才上传的小图（不超过分片阈值）走这里
+    return _fake_upload([content], original_filename, bucket)
+
+
+def _fake_skin_analysis(args, skin_analysis, oss_img_url, client=None):
+    time.sleep(ANALYSIS_SECONDS)
+    return SkinAnalysisResult(results={"痤疮": 0.8})
+
+
+def _fake_reasoning(analysis_result, dp_api_key, dp_base_url, dp_model_name, user_question, client=None):
+    time.sleep(REASONING_SECONDS)
+    return {"reasoning": "...", "content": "ok", "status": "completed"}
+
+
+def _fake_chart(data, api_key, invoke_url, model_name, max_tokens, session=None):
+    time.sleep(CHART_SECONDS)
+    return "https://quickchart.io/chart?c={}", {"type": "radar"}
+
+
+class _StandInClients:
+    """替代 ClientRegistry，所有客户端都为 None"""
+
+    def __getattr__(self, name):
+        return lambda: None
+
+
+def install_stand_ins(temp_dir):
+    """把上游调用替换为本地的阻塞模拟"""
+    main.get_client_registry = _StandInClients
+    img_to_oss.upload_stream_to_oss = _fake_upload
+    img_to_oss.upload_bytes_to_oss = _fake_upload_bytes
+    # 请求中的图片是假的字节内容，不做预处理
+    image_preprocess.preprocess_options = lambda: None
+    main.Sample.main = staticmethod(_fake_skin_analysis)
+    # 这里只关心事件循环是否被阻塞，不模拟皮肤分析的配额限制
+    unlimited = UpstreamScheduler('stand-in', rate=1000, burst=1000, max_concurrency=1000)
+    main.get_skin_scheduler = lambda: unlimited
+    main.bc.skin_analysis_configuration = lambda: {"endpoint": "stand-in"}
+    main.bc.deepseek_R1_instantiation = lambda: ("key", "http://stand-in", "deepseek-reasoner")
+    main.bc.skin_data_visualization = lambda: ("key", "http://stand-in", "gemma", 100)
+    main.bc.pipeline_configuration = lambda: {"chart_enabled": True}
+    main.parent_dir = temp_dir
+    # 每个请求的图片都不同，这里不使用分析缓存
+    main.get_analysis_cache = lambda: None
+    deepseek_R1_reasoning.dp_analysis_result = _fake_reasoning
+    gemma3n_models.gemma3n_skin_quickchartURL = _fake_chart
+
+
+async def run(concurrency):
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as client:
+        async def analyze(i):
+            started = time.perf_counter()
+            files = {"file": (f"face_{i}.jpg", b"\xff\xd8fake-jpeg-%d" % i, "image/jpeg")}
+            response = await client.post("/api/analyze", files=files)
+            response.raise_for_status()
+            return time.perf_counter() - started, response.json()["timings"]
+
+        async def probe_root():
+            # 上游繁忙期间，GET / 应该仍能立即返回
+            await asyncio.sleep(0.1)
+            started = time.perf_counter()
+            response = await client.get("/")
+            response.raise_for_status()
+            return time.perf_counter() - started
+
+        started = time.perf_counter()
+        results = await asyncio.gather(probe_root(), *(analyze(i) for i in range(concurrency)))
+        elapsed = time.perf_counter() - started
+    latencies = [latency for latency, _ in results[1:]]
+    return elapsed, results[0], latencies, results[1][1]
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="/api/analyze 并发基准")
+    parser.add_argument("-n", "--concurrency", type=int, default=8)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        install_stand_ins(temp_dir)
+        elapsed, root_latency, latencies, timings = asyncio.run(run(args.concurrency))
+
+    single = UPLOAD_SECONDS + ANALYSIS_SECONDS + REASONING_SECONDS + CHART_SECONDS
+    critical_path = UPLOAD_SECONDS + ANALYSIS_SECONDS + max(REASONING_SECONDS, CHART_SECONDS)
+    slowest = max(latencies)
+    print("单个请求各阶段耗时:")
+    for name, timing in timings.items():
+        if isinstance(timing, dict):
+            print(f"  {name:<14} start={timing['start_ms']}ms duration={timing['duration_ms']}ms {timing['status']}")
+    print(f"并发请求数:        {args.concurrency}")
+    print(f"单个请求阶段总和:  {single:.2f}s")
+    print(f"单个请求关键路径:  {critical_path:.2f}s")
+    print(f"串行总耗时(估算):  {single * args.concurrency:.2f}s")
+    print(f"最慢请求耗时:      {slowest:.2f}s")
+    print(f"实际总耗时:        {elapsed:.2f}s")
+    print(f"繁忙时 GET / 延迟: {root_latency * 1000:.1f}ms")
+
+    ok = elapsed < slowest * 1.5 and slowest < critical_path * 1.5 and root_latency < 0.5
+    print("结果:", "通过" if ok else "失败（请求被串行化或事件循环被阻塞）")
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main_cli())
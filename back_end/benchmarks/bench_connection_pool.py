@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""
+连接池基准：对比“每个请求新建客户端”和“复用 ClientRegistry 中的长连接客户端”
+在本地起一个 keep-alive 的 HTTP 服务，模拟 OSS、DeepSeek(OpenAI 兼容) 和 NIM，
+统计每种方式的平均耗时和服务端实际建立的 TCP 连接数
+（本地回环没有 TLS 握手和网络往返，真实环境下节省的时间会更明显）
+注意：OpenAI SDK 读到 [DONE] 后会主动关闭流式响应的连接，所以 DeepSeek 这一组
+节省的主要是每次构造 OpenAI 客户端的开销，连接数不会减少
+
+用法: python benchmarks/bench_connection_pool.py [-n 200]
+"""
+
+import argparse
+import http.server
+import json
+import os
+import socket
+import sys
+import threading
+import time
+
+BACK_END_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACK_END_DIR not in sys.path:
+    sys.path.insert(0, BACK_END_DIR)
+
+import oss2
+import requests
+from openai import OpenAI
+
+import clients
+
+
+class StandInHandler(http.server.BaseHTTPRequestHandler):
+    """同时充当 OSS PutObject、OpenAI 流式 chat.completions 和 NIM 的本地替身"""
+    protocol_version = 'HTTP/1.1'
+    connections = 0
+    connections_lock = threading.Lock()
+
+    def setup(self):
+        super().setup()
+        # 响应头和响应体分两次写出，关闭 Nagle 避免 keep-alive 连接上出现 40ms 的延迟确认
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        with StandInHandler.connections_lock:
+            StandInHandler.connections += 1
+
+    def _read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length)
+
+    def _send(self, body, content_type='application/json', headers=None):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_PUT(self):
+        self._read_body()
+        self._send(b'', headers={'ETag': '"stand-in"', 'x-oss-request-id': 'stand-in'})
+
+    def do_POST(self):
+        self._read_body()
+        if self.path.endswith('/chat/completions') and self.path.startswith('/v1'):
+            chunk = {
+                "id": "stand-in", "object": "chat.completion.chunk", "created": 0, "model": "stand-in",
+                "choices": [{"index": 0, "delta": {"content": "ok"}, "finish_reason": None}]
+            }
+            body = f"data: {json.dumps(chunk)}\n\ndata: [DONE]\n\n".encode()
+            self._send(body, content_type='text/event-stream')
+        else:
+            body = {"choices": [{"message": {"content": "{}"}}]}
+            self._send(json.dumps(body).encode())
+
+    def log_message(self, *args):
+        pass
+
+
+def measure(name, func, n):
+    StandInHandler.connections = 0
+    started = time.perf_counter()
+    for _ in range(n):
+        func()
+    elapsed = time.perf_counter() - started
+    print(f"  {name:<28} {elapsed / n * 1000:8.2f} ms/请求   新建连接 {StandInHandler.connections:4d}")
+    return elapsed
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="上游连接池基准")
+    parser.add_argument("-n", "--requests", type=int, default=200)
+    args = parser.parse_args()
+
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f'http://127.0.0.1:{server.server_port}'
+
+    # 让注册表指向本地替身
+    clients.bc.img_to_oss_url = lambda: ('id', 'secret', 'bucket', base)
+    clients.bc.deepseek_R1_instantiation = lambda: ('key', f'{base}/v1', 'stand-in')
+    registry = clients.ClientRegistry(pool_size=4)
+    image = os.urandom(64 * 1024)
+    messages = [{"role": "user", "content": "hi"}]
+
+    def oss_fresh():
+        bucket = oss2.Bucket(oss2.Auth('id', 'secret'), base, 'bucket')
+        bucket.put_object('uploads/bench.jpg', image)
+
+    def oss_pooled():
+        registry.oss_bucket().put_object('uploads/bench.jpg', image)
+
+    def deepseek_fresh():
+        client = OpenAI(api_key='key', base_url=f'{base}/v1')
+        for _ in client.chat.completions.create(model='stand-in', messages=messages, stream=True):
+            pass
+        client.close()
+
+    def deepseek_pooled():
+        client = registry.deepseek_client()
+        for _ in client.chat.completions.create(model='stand-in', messages=messages, stream=True):
+            pass
+
+    def nim_fresh():
+        requests.post(f'{base}/nim', json={"messages": messages}, timeout=30).json()
+
+    def nim_pooled():
+        registry.nim_session().post(f'{base}/nim', json={"messages": messages}, timeout=30).json()
+
+    print(f"每组 {args.requests} 个请求:")
+    for label, fresh, pooled in (
+        ("OSS put_object", oss_fresh, oss_pooled),
+        ("DeepSeek 流式补全", deepseek_fresh, deepseek_pooled),
+        ("NIM requests.post", nim_fresh, nim_pooled),
+    ):
+        print(label)
+        fresh_time = measure("每次新建客户端", fresh, args.requests)
+        pooled_time = measure("复用 ClientRegistry", pooled, args.requests)
+        print(f"  加速比 {fresh_time / pooled_time:.2f}x")
+
+    registry.close()
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main_cli()
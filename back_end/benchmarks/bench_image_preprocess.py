@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""
+图片预处理基准：对比原图直接上传和规范化（旋正、限制最长边、重新编码、去元数据）后上传
+统计每张图片节省的字节数、预处理耗时，以及按上行带宽估算的上传耗时变化
+（皮肤分析接口从OSS下载图片的耗时与上传字节数成正比，同样按比例减少）
+
+用法: python benchmarks/bench_image_preprocess.py [--images 目录] [--mbps 20] [--max-edge 2048]
+不指定 --images 时生成一组类似手机照片的样例（4000x3000、带 EXIF 方向和 GPS 信息）
+"""
+
+import argparse
+import asyncio
+import glob
+import io
+import os
+import random
+import sys
+import time
+
+BACK_END_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACK_END_DIR not in sys.path:
+    sys.path.insert(0, BACK_END_DIR)
+
+from PIL import Image, ImageDraw, ImageFilter
+
+import image_preprocess
+
+SAMPLE_SIZES = [(4000, 3000), (4032, 3024), (3000, 4000), (4624, 3468), (2400, 1800)]
+
+
+def make_sample(width, height, seed):
+    """生成一张带肤色渐变、噪点和 EXIF 的样例照片（JPEG 质量 95，接近手机直出）"""
+    rng = random.Random(seed)
+    small = Image.new('RGB', (width // 8, height // 8))
+    draw = ImageDraw.Draw(small)
+    for y in range(small.height):
+        tone = 170 + int(40 * y / small.height)
+        draw.line([(0, y), (small.width, y)], fill=(tone, tone - 40, tone - 70))
+    for _ in range(400):
+        x, y, r = rng.randrange(small.width), rng.randrange(small.height), rng.randrange(1, 6)
+        draw.ellipse([x - r, y - r, x + r, y + r], fill=(rng.randrange(120, 200), 80, 70))
+    image = small.resize((width, height), Image.BICUBIC)
+    noise = Image.effect_noise((width, height), 24).convert('RGB')
+    image = Image.blend(image, noise, 0.12).filter(ImageFilter.SMOOTH)
+
+    exif = Image.Exif()
+    exif[0x0112] = rng.choice([1, 6, 8])          # Orientation
+    exif[0x010F] = 'PhoneMaker'                    # Make
+    exif[0x8825] = {1: 'N', 2: (31.0, 14.0, 0.0)}  # GPSInfo
+    output = io.BytesIO()
+    image.save(output, format='JPEG', quality=95, exif=exif)
+    return output.getvalue()
+
+
+def load_images(directory):
+    paths = []
+    for pattern in ('*.jpg', '*.jpeg', '*.png', '*.webp'):
+        paths.extend(glob.glob(os.path.join(directory, '**', pattern), recursive=True))
+    return [(os.path.basename(path), open(path, 'rb').read()) for path in sorted(paths)]
+
+
+async def run(images, options, mbps):
+    # 预先启动进程池，不把进程启动时间计入单张图片的耗时
+    image_preprocess.get_process_pool().submit(int).result()
+    loop = asyncio.get_running_loop()
+    rows = []
+    for name, content in images:
+        started = time.perf_counter()
+        data, _, info = await loop.run_in_executor(None, image_preprocess.normalize_in_pool, content, options)
+        elapsed = time.perf_counter() - started
+        if info is None:
+            print(f"  {name}: 无法解码，跳过")
+            continue
+        with Image.open(io.BytesIO(data)) as out:
+            has_exif = bool(out.getexif())
+        rows.append((name, info, elapsed, has_exif))
+
+    bytes_per_second = mbps * 1000 * 1000 / 8
+    total_before = total_after = 0
+    time_before = time_after = 0.0
+    print(f"{'图片':<16}{'原始尺寸':>12}{'新尺寸':>12}{'原始KB':>10}{'新KB':>9}{'节省':>8}"
+          f"{'预处理ms':>10}{'上传ms(前)':>12}{'上传ms(后)':>12}  EXIF")
+    for name, info, elapsed, has_exif in rows:
+        before = info["original_bytes"] / bytes_per_second
+        after = elapsed + info["bytes"] / bytes_per_second
+        total_before += info["original_bytes"]
+        total_after += info["bytes"]
+        time_before += before
+        time_after += after
+        saved = 1 - info["bytes"] / info["original_bytes"]
+        print(f"{name[:15]:<16}{'x'.join(map(str, info['original_size'])):>12}{'x'.join(map(str, info['size'])):>12}"
+              f"{info['original_bytes'] / 1024:>10.0f}{info['bytes'] / 1024:>9.0f}{saved:>8.1%}"
+              f"{elapsed * 1000:>10.0f}{before * 1000:>12.0f}{after * 1000:>12.0f}  {'有' if has_exif else '无'}")
+
+    if rows:
+        print(f"合计: {total_before / 2**20:.1f}MB -> {total_after / 2**20:.1f}MB，节省 {1 - total_after / total_before:.1%}")
+        print(f"按 {mbps}Mbps 上行估算的平均上传耗时（含预处理）: "
+              f"{time_before / len(rows) * 1000:.0f}ms -> {time_after / len(rows) * 1000:.0f}ms")
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="图片预处理基准")
+    parser.add_argument("--images", help="样例图片目录，默认生成合成样例")
+    parser.add_argument("--mbps", type=float, default=20, help="估算上传耗时使用的上行带宽")
+    parser.add_argument("--max-edge", type=int, default=image_preprocess.DEFAULT_MAX_EDGE)
+    parser.add_argument("--format", default=image_preprocess.DEFAULT_FORMAT)
+    parser.add_argument("--quality", type=int, default=image_preprocess.DEFAULT_QUALITY)
+    args = parser.parse_args()
+
+    if args.images:
+        images = load_images(args.images)
+    else:
+        print("生成样例图片...")
+        images = [(f"sample_{i}_{w}x{h}.jpg", make_sample(w, h, i)) for i, (w, h) in enumerate(SAMPLE_SIZES)]
+    options = {"max_edge": args.max_edge, "image_format": args.format.upper(), "quality": args.quality}
+    try:
+        asyncio.run(run(images, options, args.mbps))
+    finally:
+        image_preprocess.shutdown_process_pool()
+
+
+if __name__ == '__main__':
+    main_cli()
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""
+日志调用方的耗时：原来的同步写法（每次调用检查日期、在调用方线程格式化并写 RotatingFileHandler 和控制台）
+与队列日志后端（调用方只放入队列，由后台线程格式化和写文件）对比
+控制台输出重定向到 /dev/null，日志文件写到临时目录
+
+用法: python benchmarks/bench_logging.py [--count 20000]
+"""
+
+import argparse
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+from logging.handlers import RotatingFileHandler
+
+BACK_END_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACK_END_DIR not in sys.path:
+    sys.path.insert(0, BACK_END_DIR)
+
+import daily_logger
+
+
+def sync_logger(log_dir, devnull):
+    """原来 DailyLogger 的处理器配置"""
+    logger = logging.getLogger('bench_sync')
+    logger.propagate = False
+    logger.setLevel(logging.DEBUG)
+    formatter = logging.Formatter(daily_logger.TEXT_FORMAT, datefmt='%Y-%m-%d %H:%M:%S')
+    for handler in (RotatingFileHandler(os.path.join(log_dir, 'sync.log'), maxBytes=10 * 1024 * 1024,
+                                        backupCount=5, encoding='utf-8'),
+                    logging.StreamHandler(devnull)):
+        handler.setFormatter(formatter)
+        logger.addHandler(handler)
+
+    def log(message):
+        # 原来每次调用都检查日期
+        now = datetime.now()
+        f"{now.year}-{now.month}-{now.day}"
+        logger.info(message)
+    return log
+
+
+def measure(log, count):
+    timings = []
+    for i in range(count):
+        start = time.perf_counter()
+        log(f"分析完成，各阶段耗时: {{'upload': {i}, 'skin_analysis': 512.3}}")
+        timings.append((time.perf_counter() - start) * 1e6)
+    timings.sort()
+    return statistics.median(timings), timings[int(len(timings) * 0.99)], timings[-1]
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="日志调用耗时")
+    parser.add_argument("--count", type=int, default=20000, help="日志条数")
+    args = parser.parse_args()
+
+    log_dir = tempfile.mkdtemp(prefix='bench_logging_')
+    devnull = open(os.devnull, 'w')
+    sys.stdout, stdout = devnull, sys.stdout
+    try:
+        sync_result = measure(sync_logger(log_dir, devnull), args.count)
+        daily_logger.setup_logging(log_dir)
+        queued = logging.getLogger('bench_queue')
+        queue_result = measure(queued.info, args.count)
+        start = time.perf_counter()
+        daily_logger.shutdown_logging()
+        drain_ms = (time.perf_counter() - start) * 1000
+    finally:
+        sys.stdout = stdout
+    print(f"{args.count} 条日志，日志目录: {log_dir}")
+    print(f"{'':<10}{'中位数(us)':>12}{'p99(us)':>10}{'最大(us)':>12}")
+    for name, (median, p99, worst) in (("同步写入", sync_result), ("队列", queue_result)):
+        print(f"{name:<10}{median:>12.1f}{p99:>10.1f}{worst:>12.1f}")
+    print(f"后台线程写完剩余日志: {drain_ms:.0f}ms，丢弃 {daily_logger.dropped_records()} 条")
+
+
+if __name__ == '__main__':
+    main_cli()
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""
+OSS 上传基准：对比一次 put_object 和分片并发上传（img_to_oss.put_object_stream）在不同图片大小下的耗时和吞吐
+上传到本地模拟的 OSS（fake_upstreams），可以设置每个连接的带宽、每次请求的延迟和错误率：
+  一次上传受单个连接的带宽限制，失败后整张图片重新上传；分片上传多个连接并发，失败时只重试失败的分片
+--client-mbps 模拟客户端上传请求体的速度：边接收边上传时，上传与接收重叠，请求体接收完后只需等待最后几个分片
+
+用法:
+    python benchmarks/bench_multipart_upload.py
+    python benchmarks/bench_multipart_upload.py --sizes 1,4,16 --oss-bandwidth-mbps 2 --oss-error-rate 0.05
+    python benchmarks/bench_multipart_upload.py --client-mbps 4 --concurrency 1,4,8
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+BACK_END_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+for path in (os.path.join(BACK_END_DIR, 'ALi_skin_model'), BACK_END_DIR, BENCH_DIR):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+from fake_upstreams import FakeUpstreams, add_arguments, ACCESS_KEY_ID, ACCESS_KEY_SECRET, BUCKET_NAME
+
+MB = 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+
+
+def parse_args():
+    parser = add_arguments(argparse.ArgumentParser(description=__doc__,
+                                                   formatter_class=argparse.RawDescriptionHelpFormatter))
+    parser.set_defaults(oss_latency_ms=30, oss_bandwidth_mbps=2)
+    parser.add_argument('--sizes', default='0.25,1,2,4,8,16', help='图片大小（MB，逗号分隔）')
+    parser.add_argument('--concurrency', default='1,4,8', help='分片上传的并发分片数（逗号分隔）')
+    parser.add_argument('--part-size', type=int, default=1 * MB, help='分片大小（字节）')
+    parser.add_argument('--max-retries', type=int, default=3, help='分片的重试次数；一次上传失败后整体重新上传的次数')
+    parser.add_argument('--client-mbps', type=float, default=0, help='客户端上传请求体的速度（MB/s），0 表示内容已在内存中')
+    parser.add_argument('-n', '--repeat', type=int, default=3, help='每组重复次数（取中位数）')
+    return parser.parse_args()
+
+
+def client_body(content, client_mbps):
+    """按块产出上传内容；设置了客户端速度时按速度等待，模拟请求体还在接收中"""
+    started = time.perf_counter()
+    for offset in range(0, len(content), CHUNK_SIZE):
+        if client_mbps:
+            due = started + offset / (client_mbps * MB)
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        yield content[offset:offset + CHUNK_SIZE]
+
+
+def run_case(upload, content, repeat):
+    """重复上传 repeat 次，返回 (成功的上传耗时的中位数, 失败次数)"""
+    durations, failures = [], 0
+    for _ in range(repeat):
+        started = time.perf_counter()
+        try:
+            upload(content)
+        except Exception as e:
+            failures += 1
+            print(f"    上传失败: {type(e).__name__}: {str(e)[:80]}")
+            continue
+        durations.append(time.perf_counter() - started)
+    return (statistics.median(durations) if durations else None), failures
+
+
+def main():
+    args = parse_args()
+    fakes = FakeUpstreams(args).start()
+    work = tempfile.mkdtemp()
+    # 错误注入时不让OSS熔断器打开，只比较重试方式
+    config_path = fakes.write_config(os.path.join(work, 'config.yaml'), extra={
+        'resilience': {'upstreams': {'oss': {'timeout': 120, 'failure_threshold': 1000000}}},
+    })
+    os.environ['SKIN_ANALYSIS_CONFIG'] = config_path
+
+    import oss2
+    import img_to_oss
+
+    bucket = oss2.Bucket(oss2.Auth(ACCESS_KEY_ID, ACCESS_KEY_SECRET), fakes.url('oss'), BUCKET_NAME)
+    sizes = [float(size) for size in args.sizes.split(',') if size]
+    concurrencies = [int(value) for value in args.concurrency.split(',') if value]
+
+    def single_put(content):
+        # 一次上传：失败后整张图片重新上传
+        options = {"enabled": False}
+        for attempt in range(args.max_retries + 1):
+            try:
+                return img_to_oss.put_object_stream(bucket, 'uploads/bench.jpg', client_body(content, args.client_mbps),
+                                                    options)
+            except Exception as e:
+                if attempt >= args.max_retries or not img_to_oss.is_failure(e):
+                    raise
+
+    def multipart(concurrency):
+        options = {"enabled": True, "threshold": args.part_size, "part_size": args.part_size,
+                   "concurrency": concurrency, "max_retries": args.max_retries}
+
+        def upload(content):
+            return img_to_oss.put_object_stream(bucket, 'uploads/bench.jpg', client_body(content, args.client_mbps),
+                                                options)
+        return upload
+
+    print(f"OSS 每个连接 {args.oss_bandwidth_mbps or '不限'} MB/s，每次请求延迟 {args.oss_latency_ms:.0f}ms，"
+          f"错误率 {args.oss_error_rate:.0%}；客户端 {args.client_mbps or '不限'} MB/s；"
+          f"分片 {args.part_size // 1024}KB；每组 {args.repeat} 次取中位数")
+    modes = [("一次上传", single_put)] + [(f"分片 x{concurrency}", multipart(concurrency)) for concurrency in concurrencies]
+    print(f"{'大小':>8}  " + "".join(f"{label:>22}" for label, _ in modes))
+    try:
+        for size in sizes:
+            content = os.urandom(int(size * MB))
+            cells = []
+            for label, upload in modes:
+                requests_before = fakes.faults.requests['oss']
+                median, failures = run_case(upload, content, args.repeat)
+                requests = (fakes.faults.requests['oss'] - requests_before) / args.repeat
+                if median is None:
+                    cells.append(f"{'失败':>22}")
+                    continue
+                cell = f"{median * 1000:7.0f}ms {len(content) / MB / median:5.1f}MB/s {requests:3.0f}次"
+                cells.append(f"{cell + ('!' if failures else ''):>22}")
+            print(f"{size:>6.2f}MB  " + "".join(cells))
+    finally:
+        fakes.stop()
+    print("每格：耗时中位数、吞吐、平均每次上传的 PutObject/UploadPart 请求数（含重试），! 表示有上传最终失败")
+    print(f"注入的错误: {fakes.faults.stats()['injected_errors']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""
+提示词 token 统计：皮肤数据以原来的方式（完整结果、indent=2）和按 llm_payload 配置裁剪、紧凑编码后，
+DeepSeek 系统提示和 NIM 图表提示词的 token 数对比
+  数据来源（按顺序）：--payload 指定的 JSON 文件；分析缓存(SQLite)中保存的真实皮肤分析结果；
+  都没有时使用按 DetectSkinDisease 响应结构构造的样例
+  token 数：安装了 tiktoken 时用 cl100k_base 统计（与 DeepSeek 的分词器不同，只用于比较），
+  否则按 DeepSeek 文档的估算方法：1 个英文字符约 0.3 个 token，1 个中文字符约 0.6 个 token
+
+用法: python benchmarks/bench_prompt_tokens.py [--payload a.json ...] [--cache cache/analysis_cache.sqlite3] [--limit 20]
+"""
+
+import argparse
+import json
+import os
+import random
+import sqlite3
+import statistics
+import sys
+
+BACK_END_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in (BACK_END_DIR, os.path.join(BACK_END_DIR, 'ALi_skin_model')):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+import deepseek_R1_reasoning
+from gemma3n_models import chart_prompt
+from prompt_template import load_prompt
+from skin_payload import llm_payload, payload_options, DEFAULT_FIELDS
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding('cl100k_base')
+except Exception:  # 未安装或无法下载词表时使用估算
+    _encoding = None
+
+# DetectSkinDisease 的病症类别（results 的中文名与 results_english 的英文名）
+SAMPLE_CLASSES = (
+    ('痤疮', 'acne'), ('酒渣鼻', 'rosacea'), ('黄褐斑', 'melasma'), ('雀斑', 'freckle'),
+    ('脂溢性皮炎', 'seborrheic_dermatitis'), ('湿疹', 'eczema'), ('白癜风', 'vitiligo'),
+    ('色素痣', 'nevus'), ('脂溢性角化病', 'seborrheic_keratosis'), ('扁平疣', 'flat_wart'),
+    ('荨麻疹', 'urticaria'), ('银屑病', 'psoriasis'), ('汗管瘤', 'syringoma'), ('粟丘疹', 'milium'),
+)
+
+
+def count_tokens(text):
+    if _encoding is not None:
+        return len(_encoding.encode(text))
+    cjk = sum(1 for ch in text if '一' <= ch <= '鿿' or '　' <= ch <= '￯')
+    return round(cjk * 0.6 + (len(text) - cjk) * 0.3)
+
+
+def sample_payloads(n=5, seed=0):
+    """按 SDK 响应结构（Sample.main 的输出）构造样例"""
+    rng = random.Random(seed)
+    payloads = []
+    for _ in range(n):
+        scores = [rng.random() ** 4 for _ in SAMPLE_CLASSES]
+        total = sum(scores)
+        payloads.append({
+            "body_part": "面部",
+            "image_quality": rng.uniform(0.6, 0.99),
+            "image_type": "clinical",
+            "results": {zh: score / total for (zh, _), score in zip(SAMPLE_CLASSES, scores)},
+            "results_english": {en: score / total for (_, en), score in zip(SAMPLE_CLASSES, scores)},
+        })
+    return payloads
+
+
+def cached_payloads(db_path, limit):
+    """分析缓存中保存的真实皮肤分析结果"""
+    if not os.path.exists(db_path):
+        return []
+    with sqlite3.connect(db_path) as conn:
+        rows = conn.execute(
+            "SELECT analysis FROM analysis_cache WHERE analysis IS NOT NULL ORDER BY accessed_at DESC LIMIT ?",
+            (limit,)
+        ).fetchall()
+    return [json.loads(analysis) for analysis, in rows]
+
+
+def measure(payload, prompt, options):
+    before = json.dumps(payload, ensure_ascii=False, indent=2)
+    after = llm_payload(payload, options)
+    render = lambda data: prompt.render(skin_data=data, user_question="我的皮肤状况如何？")
+    return {
+        "data": (count_tokens(before), count_tokens(after)),
+        "deepseek": (count_tokens(render(before)), count_tokens(render(after))),
+        "nim": (count_tokens(chart_prompt(before)), count_tokens(chart_prompt(after))),
+    }
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="提示词 token 统计")
+    parser.add_argument("--payload", nargs="*", default=[], help="皮肤分析结果的 JSON 文件")
+    parser.add_argument("--cache", default=os.path.join(BACK_END_DIR, 'cache', 'analysis_cache.sqlite3'),
+                        help="分析缓存的 SQLite 文件")
+    parser.add_argument("--limit", type=int, default=20, help="最多读取的缓存条目数")
+    args = parser.parse_args()
+
+    payloads, source = [], ""
+    for path in args.payload:
+        with open(path, encoding='utf-8') as f:
+            payloads.append(json.load(f))
+    if payloads:
+        source = f"{len(payloads)} 个 JSON 文件"
+    else:
+        payloads = cached_payloads(args.cache, args.limit)
+        source = f"分析缓存中的 {len(payloads)} 条结果" if payloads else ""
+    if not payloads:
+        payloads = sample_payloads()
+        source = f"{len(payloads)} 个按 DetectSkinDisease 响应结构构造的样例"
+
+    options = payload_options() or {"fields": DEFAULT_FIELDS, "top_k": 0, "min_score": 0.0, "precision": 3}
+    prompt = load_prompt(deepseek_R1_reasoning.SYSTEM_PROMPT_PATH)
+    counter = "tiktoken cl100k_base" if _encoding is not None else "DeepSeek 文档的字符估算"
+    print(f"数据来源: {source}；token 计数: {counter}")
+    print(f"裁剪参数: {options}")
+
+    results = [measure(payload, prompt, options) for payload in payloads]
+    print(f"{'':<18}{'原来(中位数)':>12}{'裁剪后(中位数)':>14}{'减少':>8}")
+    for key, label in (("data", "皮肤数据"), ("deepseek", "DeepSeek系统提示"), ("nim", "NIM图表提示词")):
+        before = statistics.median(r[key][0] for r in results)
+        after = statistics.median(r[key][1] for r in results)
+        print(f"{label:<18}{before:>12.0f}{after:>14.0f}{1 - after / before:>8.1%}")
+
+
+if __name__ == '__main__':
+    main_cli()
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""
+分析结果的编码开销：每个 /api/analyze 请求中，皮肤分析结果从 SDK 响应到 HTTP 响应经过的处理
+  原来：obj_to_dict 递归转换 -> json.dumps(indent=2) -> json.loads -> DeepSeek 提示词编码
+        -> FastAPI jsonable_encoder + json.dumps 编码响应
+  现在：SkinAnalysisResult.from_sdk -> DeepSeek 提示词编码 -> json_codec 编码响应（一次）
+统计每个请求的 CPU 时间和内存分配的峰值（tracemalloc）
+数据来源与 bench_prompt_tokens 相同：--payload 指定的 JSON 文件、分析缓存中的真实结果或构造的样例
+
+用法: python benchmarks/bench_result_encoding.py [--payload a.json ...] [--rounds 2000]
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+BACK_END_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in (BACK_END_DIR, os.path.join(BACK_END_DIR, 'ALi_skin_model')):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+from fastapi.encoders import jsonable_encoder
+
+import json_codec
+from bench_prompt_tokens import cached_payloads, sample_payloads
+from skin_payload import llm_payload
+from skin_result import SkinAnalysisResult
+
+try:
+    from alibabacloud_imageprocess20200320.models import DetectSkinDiseaseResponseBodyData
+except ImportError:  # 未安装 SDK 时用同样字段的简单对象代替
+    class DetectSkinDiseaseResponseBodyData:
+        def __init__(self, **fields):
+            self.__dict__.update(fields)
+
+
+def sdk_data(payload):
+    """按 SDK 响应对象的形式构造（与 Sample.main 拿到的 response.body.data 相同）"""
+    return DetectSkinDiseaseResponseBodyData(**{k: payload.get(k) for k in (
+        'body_part', 'image_quality', 'image_type', 'results', 'results_english')})
+
+
+def obj_to_dict(obj):
+    """原来 Sample.main 中的递归转换"""
+    if isinstance(obj, dict):
+        return {k: obj_to_dict(v) for k, v in obj.items()}
+    elif hasattr(obj, '__dict__'):
+        return {k: obj_to_dict(v) for k, v in obj.__dict__.items() if not k.startswith('_')}
+    elif isinstance(obj, list):
+        return [obj_to_dict(i) for i in obj]
+    return obj
+
+
+def envelope(analysis):
+    return {"status": "success", "image_url": "https://bucket.oss/a.jpg", "analysis": analysis,
+            "ai_reasoning": {"content": "", "result": ""}, "timings": {}}
+
+
+def before(data, options):
+    text = json.dumps(obj_to_dict(data), ensure_ascii=False, indent=2)
+    analysis = json.loads(text)
+    llm_payload(analysis, options)
+    return json.dumps(jsonable_encoder(envelope(analysis)), ensure_ascii=False).encode('utf-8')
+
+
+def after(data, options):
+    analysis = SkinAnalysisResult.from_sdk(data)
+    llm_payload(analysis, options)
+    return json_codec.dumps(envelope(analysis))
+
+
+def cpu_per_request(func, items, options, rounds):
+    start = time.process_time()
+    for i in range(rounds):
+        func(items[i % len(items)], options)
+    return (time.process_time() - start) / rounds * 1e6
+
+
+def peak_bytes(func, item, options):
+    """单个请求处理过程中分配内存的峰值"""
+    tracemalloc.start()
+    func(item, options)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="分析结果编码开销")
+    parser.add_argument("--payload", nargs="*", default=[], help="皮肤分析结果的 JSON 文件")
+    parser.add_argument("--cache", default=os.path.join(BACK_END_DIR, 'cache', 'analysis_cache.sqlite3'),
+                        help="分析缓存的 SQLite 文件")
+    parser.add_argument("--rounds", type=int, default=2000, help="每种方式的请求数")
+    args = parser.parse_args()
+
+    payloads = []
+    for path in args.payload:
+        with open(path, encoding='utf-8') as f:
+            payloads.append(json.load(f))
+    payloads = payloads or cached_payloads(args.cache, 50) or sample_payloads()
+    items = [sdk_data(payload) for payload in payloads]
+    # 与默认配置相同的裁剪参数，不读取配置文件
+    options = {"fields": ('body_part', 'image_quality', 'image_type', 'results'),
+               "top_k": 0, "min_score": 0.0, "precision": 3}
+    assert json.loads(before(items[0], options)) == json.loads(after(items[0], options))
+
+    encoder = "orjson" if json_codec.orjson is not None else "json（未安装 orjson）"
+    print(f"{len(payloads)} 个分析结果，{args.rounds} 次请求，编码器: {encoder}")
+    print(f"{'':<8}{'CPU(us/请求)':>14}{'峰值内存(字节)':>16}")
+    results = {}
+    for name, func in (("原来", before), ("现在", after)):
+        cpu_us = cpu_per_request(func, items, options, args.rounds)
+        peak = max(peak_bytes(func, item, options) for item in items)
+        results[name] = (cpu_us, peak)
+        print(f"{name:<8}{cpu_us:>14.1f}{peak:>16}")
+    (cpu_before, peak_before), (cpu_after, peak_after) = results["原来"], results["现在"]
+    print(f"CPU 减少 {1 - cpu_after / cpu_before:.1%}，峰值内存减少 {1 - peak_after / peak_before:.1%}")
+
+
+if __name__ == '__main__':
+    main_cli()
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""
+皮肤分析配额调度基准
+模拟一个有速率和并发限额的上游（超出限额立即返回 Throttling.User 错误），同时发起 N 个调用，对比：
+  直接调用        ：不排队，被限流就失败
+  直接调用+重试    ：不排队，被限流后随机退避重试
+  调度器          ：经过 UpstreamScheduler（令牌桶 + 并发上限 + FIFO + 限流退避）
+  调度器(配额偏高) ：调度器配置的速率高于上游实际限额，验证限流后能自动放慢
+统计成功数、触发的限流错误数、总耗时、上游实际吞吐和调用方延迟分位数
+
+用法: python benchmarks/bench_skin_scheduler.py [-n 60] [--rate 5] [--concurrency 3]
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import threading
+import time
+
+BACK_END_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACK_END_DIR not in sys.path:
+    sys.path.insert(0, BACK_END_DIR)
+
+import logging
+
+from concurrency import run_blocking
+from upstream_scheduler import UpstreamScheduler
+
+logging.getLogger().setLevel(logging.ERROR)
+
+SERVICE_SECONDS = 0.3
+
+
+class ThrottlingError(Exception):
+    """与阿里云 Tea SDK 的限流异常一样带有 code"""
+    code = 'Throttling.User'
+
+
+class QuotaUpstream:
+    """按令牌桶和并发数限额的上游替身"""
+
+    def __init__(self, rate, concurrency):
+        self.rate = rate
+        self.concurrency = concurrency
+        self._lock = threading.Lock()
+        self._tokens = rate
+        self._updated = time.monotonic()
+        self._active = 0
+        self.accepted = 0
+        self.throttled = 0
+
+    def analyze(self, oss_url):
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.rate, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens < 1 or self._active >= self.concurrency:
+                self.throttled += 1
+                raise ThrottlingError("Request was denied due to user flow control.")
+            self._tokens -= 1
+            self._active += 1
+            self.accepted += 1
+        try:
+            time.sleep(SERVICE_SECONDS)
+            return '{"results": {}}'
+        finally:
+            with self._lock:
+                self._active -= 1
+
+
+async def run_direct(upstream, n, retry):
+    async def one(i):
+        started = time.perf_counter()
+        for attempt in range(6 if retry else 1):
+            try:
+                await run_blocking(upstream.analyze, f"https://oss/{i}.jpg")
+                return time.perf_counter() - started
+            except ThrottlingError:
+                if retry:
+                    await asyncio.sleep(random.uniform(0, min(8, 0.5 * 2 ** attempt)))
+        return None
+    return await asyncio.gather(*(one(i) for i in range(n)))
+
+
+async def run_scheduled(upstream, n, rate, concurrency):
+    scheduler = UpstreamScheduler('bench', rate=rate, burst=max(1, int(rate)), max_concurrency=concurrency,
+                                  max_queue=n, max_retries=6)
+
+    async def one(i):
+        started = time.perf_counter()
+        try:
+            await scheduler.call(upstream.analyze, f"https://oss/{i}.jpg")
+            return time.perf_counter() - started
+        except ThrottlingError:
+            return None
+    return await asyncio.gather(*(one(i) for i in range(n)))
+
+
+def report(label, upstream, latencies, elapsed):
+    ok = sorted(latency for latency in latencies if latency is not None)
+    p50 = ok[len(ok) // 2] if ok else 0
+    p95 = ok[int(len(ok) * 0.95) - 1] if ok else 0
+    print(f"{label:<16}{len(ok):>6}/{len(latencies):<5}{upstream.throttled:>8}{elapsed:>9.2f}s"
+          f"{upstream.accepted / elapsed:>10.2f}{p50:>9.2f}s{p95:>9.2f}s")
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="皮肤分析配额调度基准")
+    parser.add_argument("-n", "--requests", type=int, default=60)
+    parser.add_argument("--rate", type=float, default=5, help="上游每秒允许的调用数")
+    parser.add_argument("--concurrency", type=int, default=3, help="上游允许的并发调用数")
+    args = parser.parse_args()
+
+    print(f"上游限额: {args.rate}/s, 并发 {args.concurrency}, 单次耗时 {SERVICE_SECONDS}s, 同时发起 {args.requests} 个调用")
+    print(f"{'方式':<14}{'成功/总数':>12}{'限流次数':>6}{'总耗时':>8}{'上游QPS':>10}{'p50':>9}{'p95':>10}")
+    cases = (
+        ("直接调用", lambda u: run_direct(u, args.requests, retry=False)),
+        ("直接调用+重试", lambda u: run_direct(u, args.requests, retry=True)),
+        ("调度器", lambda u: run_scheduled(u, args.requests, args.rate, args.concurrency)),
+        ("调度器(配额偏高)", lambda u: run_scheduled(u, args.requests, args.rate * 1.6, args.concurrency + 1)),
+    )
+    for label, case in cases:
+        upstream = QuotaUpstream(args.rate, args.concurrency)
+        started = time.perf_counter()
+        latencies = asyncio.run(case(upstream))
+        report(label, upstream, latencies, time.perf_counter() - started)
+
+
+if __name__ == '__main__':
+    main_cli()
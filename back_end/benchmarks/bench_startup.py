@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""
+冷启动基准：服务从启动到可以接受请求的时间，以及导入耗时的分解
+  导入耗时    ：在新进程中以 python -X importtime 导入 main，按顶层包汇总（含子模块）
+  延迟导入    ：上游 SDK（阿里云、oss2、openai 等）不在启动时导入，单独列出各自的导入耗时
+  可用时间    ：以 uvicorn 启动服务，从进程创建到 GET / 首次返回 200 的时间（多次取中位数）
+滚动重启和扩容时新实例的可用时间主要取决于这里
+
+用法: python benchmarks/bench_startup.py [--runs 5] [--top 15]
+（需要 back_end/config.yaml，可直接从 config.yaml.template 复制；启动后的连接预热在后台进行，不影响结果）
+"""
+
+import argparse
+import collections
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+BACK_END_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_DIR = os.path.join(BACK_END_DIR, 'ALi_skin_model')
+if BACK_END_DIR not in sys.path:
+    sys.path.insert(0, BACK_END_DIR)
+
+import httpx
+
+from clients import PRELOAD_MODULES
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def import_breakdown(module='main'):
+    """
+    在新进程中导入 module，解析 -X importtime 的输出
+    Returns:
+        tuple: (总耗时 ms, {顶层包: 包内各模块自身耗时之和 ms})
+    """
+    output = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=APP_DIR, capture_output=True, text=True, check=True
+    ).stderr
+    total = 0.0
+    packages = collections.defaultdict(float)
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        # 格式: "import time: 自身耗时(us) | 累计耗时(us) | 缩进表示嵌套层级的模块名"
+        self_part, cumulative_part, name = line[len('import time:'):].split('|', 2)
+        self_us, cumulative_us = int(self_part), int(cumulative_part)
+        name = name.strip()
+        # 每个模块的自身耗时计入其顶层包
+        packages[name.split('.')[0]] += self_us / 1000
+        if name == module:
+            total = cumulative_us / 1000
+    return total, packages
+
+
+def deferred_import_cost(modules=PRELOAD_MODULES):
+    """在新进程中逐个导入被延迟的 SDK，返回 {模块: 耗时 ms 或 None(未安装)}"""
+    code = (
+        "import importlib, sys, time\n"
+        "for name in sys.argv[1:]:\n"
+        "    started = time.perf_counter()\n"
+        "    try:\n"
+        "        importlib.import_module(name)\n"
+        "        print(name, round((time.perf_counter() - started) * 1000, 1))\n"
+        "    except Exception:\n"
+        "        print(name, '-')\n"
+    )
+    output = subprocess.run([sys.executable, '-c', code, *modules], cwd=APP_DIR,
+                            capture_output=True, text=True, check=True).stdout
+    costs = {}
+    for line in output.splitlines():
+        name, value = line.split()
+        costs[name] = None if value == '-' else float(value)
+    return costs
+
+
+def time_to_ready(timeout=60):
+    """启动 uvicorn 子进程，返回从进程创建到 GET / 返回 200 的秒数"""
+    port = free_port()
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'main:app', '--host', '127.0.0.1', '--port', str(port),
+         '--log-level', 'warning'],
+        cwd=APP_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        with httpx.Client(timeout=1) as client:
+            while time.perf_counter() - started < timeout:
+                if process.poll() is not None:
+                    raise RuntimeError(f"服务进程已退出（返回码 {process.returncode}），请检查 config.yaml")
+                try:
+                    if client.get(f"http://127.0.0.1:{port}/").status_code == 200:
+                        return time.perf_counter() - started
+                except httpx.TransportError:
+                    pass
+                time.sleep(0.01)
+        raise TimeoutError(f"服务在 {timeout}s 内未就绪")
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="冷启动基准")
+    parser.add_argument("--runs", type=int, default=5, help="测量可用时间的次数")
+    parser.add_argument("--top", type=int, default=15, help="列出导入耗时最多的顶层包数量")
+    args = parser.parse_args()
+
+    total, packages = import_breakdown()
+    print(f"导入 main 耗时: {total:.1f} ms")
+    print(f"{'顶层包':<36}{'耗时(ms)':>10}{'占比':>8}")
+    for name, cost in sorted(packages.items(), key=lambda item: item[1], reverse=True)[:args.top]:
+        print(f"{name:<36}{cost:>10.1f}{cost / total:>8.1%}")
+
+    print("\n启动时未导入（后台或首次使用时导入）的 SDK（按顺序导入，已随前面的模块导入的显示为 0）:")
+    for name, cost in deferred_import_cost().items():
+        print(f"  {name:<45}{'未安装' if cost is None else f'{cost:.1f} ms':>10}")
+
+    readiness = [time_to_ready() for _ in range(args.runs)]
+    print(f"\n可用时间（{args.runs} 次）: 中位数 {statistics.median(readiness) * 1000:.0f} ms, "
+          f"最短 {min(readiness) * 1000:.0f} ms, 最长 {max(readiness) * 1000:.0f} ms")
+
+
+if __name__ == '__main__':
+    main_cli()
@@ -0,0 +1,642 @@
+# -*- coding: utf-8 -*-
+"""
+本地模拟上游：不访问任何云服务即可压测和复现性能问题
+  OSS：path 风格的对象存储（PUT/GET/HEAD/DELETE，对象保存在内存中），oss2 的 endpoint 配置为 http://127.0.0.1:端口；
+      支持浏览器直传：校验 PostObject 表单的策略和签名、PUT 签名URL 的签名和有效期（允许跨域）；
+      支持分片上传（初始化、上传分片、完成、中止），延迟、带宽和错误注入对每个分片单独生效
+  阿里云 DetectSkinDisease：RPC 接口，轮流返回 fixtures/detect_skin_disease.json 中录制的结果，
+      可模拟限流（超过 --skin-qps 返回 Throttling.User），默认先从 OSS 下载图片（与真实服务一样依赖上传结果）
+  DeepSeek / NIM：OpenAI 兼容的 /v1/chat/completions，支持流式(SSE)和 stream_options.include_usage，
+      DeepSeek 先输出推理过程(reasoning_content)再输出回答，NIM 输出带说明文字和代码块的 Chart.js 配置
+每个上游都可以设置延迟、首个 token 时间、生成速度和错误注入（按比例返回指定的状态码）
+
+用法:
+    python benchmarks/fake_upstreams.py --write-config /tmp/fake_config.yaml [--llm-ttft-ms 300 --llm-tokens-per-sec 60 ...]
+    SKIN_ANALYSIS_CONFIG=/tmp/fake_config.yaml python -m uvicorn main:app --app-dir ALi_skin_model
+load_test.py --spawn 会在同一进程中启动这些模拟服务
+"""
+
+import argparse
+import asyncio
+import base64
+import collections
+import hashlib
+import hmac
+import json
+import os
+import random
+import socket
+import sys
+import threading
+import time
+import uuid
+import xml.etree.ElementTree as ElementTree
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+
+BACK_END_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+if BACK_END_DIR not in sys.path:
+    sys.path.insert(0, BACK_END_DIR)
+
+import uvicorn
+import yaml
+from fastapi import FastAPI, Request
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+
+BUCKET_NAME = 'fake-bucket'
+ACCESS_KEY_ID = 'fake-ak'
+ACCESS_KEY_SECRET = 'fake-secret'
+MAX_STORED_BYTES = 256 * 1024 * 1024
+
+REASONING_TEXT = (
+    "用户上传的是{body_part}的照片，图片质量{quality}。检测结果中概率最高的是{top}，"
+    "其余类别的概率明显较低。需要结合皮损形态、分布和病程判断，"
+    "同时提醒用户模型结果不能替代医生面诊，给出日常护理和就医建议。"
+)
+ANSWER_TEXT = (
+    "## 分析结果\n根据图片分析，最可能的情况是**{top}**（概率约{score:.0%}）。\n\n"
+    "## 建议\n1. 保持皮肤清洁，避免用手挤压或抓挠；\n2. 作息规律，减少辛辣刺激饮食；\n"
+    "3. 症状持续或加重时请及时到皮肤科就诊。\n\n以上内容仅供参考，不能替代专业医生的诊断。"
+)
+CHART_TEXT = "以下是根据皮肤数据设计的图表配置：\n```json\n{config}\n```\n图表按概率从高到低显示各类别。"
+
+
+def add_arguments(parser):
+    """模拟上游的参数（load_test.py --spawn 也使用这些参数）"""
+    group = parser.add_argument_group('模拟上游')
+    group.add_argument('--host', default='127.0.0.1')
+    group.add_argument('--oss-port', type=int, default=0, help='0 表示随机端口')
+    group.add_argument('--skin-port', type=int, default=0)
+    group.add_argument('--deepseek-port', type=int, default=0)
+    group.add_argument('--nim-port', type=int, default=0)
+    group.add_argument('--oss-latency-ms', type=float, default=20, help='每次请求的固定延迟')
+    group.add_argument('--oss-bandwidth-mbps', type=float, default=0,
+                       help='每个连接的上传/下载带宽（MB/s），0 表示不限')
+    group.add_argument('--oss-error-rate', type=float, default=0.0)
+    group.add_argument('--skin-latency-ms', type=float, default=500)
+    group.add_argument('--skin-jitter-ms', type=float, default=100, help='延迟的随机波动（±）')
+    group.add_argument('--skin-qps', type=float, default=0, help='超过时返回 Throttling.User，0 表示不限流')
+    group.add_argument('--skin-error-rate', type=float, default=0.0)
+    group.add_argument('--skin-no-fetch', action='store_true', help='不从 OSS 下载图片')
+    group.add_argument('--llm-ttft-ms', type=float, default=300, help='首个 token 时间')
+    group.add_argument('--llm-tokens-per-sec', type=float, default=60, help='生成速度，0 表示不限')
+    group.add_argument('--llm-reasoning-tokens', type=int, default=120, help='DeepSeek 推理过程的 token 数（近似）')
+    group.add_argument('--llm-error-rate', type=float, default=0.0)
+    group.add_argument('--llm-error-status', type=int, default=429, help='注入错误时返回的状态码')
+    group.add_argument('--seed', type=int, default=None, help='随机数种子（错误注入和延迟波动）')
+    return parser
+
+
+class FaultInjector:
+    """按比例注入错误，并统计各上游的请求数和注入的错误数"""
+
+    def __init__(self, seed=None):
+        self.random = random.Random(seed)
+        self.requests = collections.Counter()
+        self.errors = collections.Counter()
+
+    def hit(self, name, error_rate):
+        self.requests[name] += 1
+        if error_rate and self.random.random() < error_rate:
+            self.errors[name] += 1
+            return True
+        return False
+
+    def jitter(self, base_ms, jitter_ms):
+        if not jitter_ms:
+            return base_ms / 1000
+        return max(0.0, base_ms + self.random.uniform(-jitter_ms, jitter_ms)) / 1000
+
+    def stats(self):
+        return {"requests": dict(self.requests), "injected_errors": dict(self.errors)}
+
+
+# ---------- OSS ----------
+
+def _oss_signature(string_to_sign):
+    return base64.b64encode(
+        hmac.new(ACCESS_KEY_SECRET.encode('utf-8'), string_to_sign.encode('utf-8'), hashlib.sha1).digest()
+    ).decode('ascii')
+
+
+def _check_post_policy(form, bucket, size):
+    """校验 PostObject 表单：签名、有效期和策略中的条件，不满足时返回错误信息"""
+    policy = form.get('policy') or ''
+    if form.get('OSSAccessKeyId') != ACCESS_KEY_ID or form.get('Signature') != _oss_signature(policy):
+        return 'SignatureDoesNotMatch'
+    document = json.loads(base64.b64decode(policy))
+    expiration = datetime.strptime(document['expiration'], '%Y-%m-%dT%H:%M:%S.000Z').replace(tzinfo=timezone.utc)
+    if expiration < datetime.now(timezone.utc):
+        return 'Policy expired'
+    for condition in document.get('conditions', []):
+        if isinstance(condition, dict):
+            name, value = next(iter(condition.items()))
+            actual = bucket if name == 'bucket' else form.get(name)
+            if actual != value:
+                return f'Invalid according to Policy: {name}'
+        elif condition[0] == 'content-length-range':
+            if not condition[1] <= size <= condition[2]:
+                return 'Invalid according to Policy: content-length-range'
+        elif condition[0] in ('eq', 'starts-with'):
+            actual = form.get(condition[1].lstrip('$')) or ''
+            if (actual != condition[2]) if condition[0] == 'eq' else not actual.startswith(condition[2]):
+                return f'Invalid according to Policy: {condition[1]}'
+    return None
+
+
+def oss_app(options, faults):
+    """path 风格的 OSS：/{bucket}/{key}，对象保存在内存中（超过上限时淘汰最早的对象）"""
+    app = FastAPI()
+    # 浏览器直传需要跨域
+    app.add_middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['*'], allow_headers=['*'],
+                       expose_headers=['ETag', 'x-oss-request-id'])
+    objects = collections.OrderedDict()
+    content_types = {}
+    # 进行中的分片上传：upload_id -> {"bucket", "key", "content_type", "parts": {分片号: 内容}}
+    uploads = {}
+    state = {"bytes": 0}
+
+    def oss_error(status, code, message):
+        body = (f'<?xml version="1.0" encoding="UTF-8"?>\n<Error><Code>{code}</Code><Message>{message}</Message>'
+                f'<RequestId>{uuid.uuid4().hex}</RequestId><HostId>fake-oss</HostId></Error>')
+        return Response(body, status_code=status, media_type='application/xml',
+                        headers={'x-oss-request-id': uuid.uuid4().hex})
+
+    async def transfer_delay(size):
+        delay = options.oss_latency_ms / 1000
+        if options.oss_bandwidth_mbps:
+            delay += size / (options.oss_bandwidth_mbps * 1024 * 1024)
+        await asyncio.sleep(delay)
+
+    @app.head('/')
+    @app.get('/')
+    async def service_root():
+        return Response(headers={'x-oss-request-id': uuid.uuid4().hex})
+
+    def store(bucket, key, body, content_type):
+        old = objects.pop((bucket, key), None)
+        if old is not None:
+            state["bytes"] -= len(old)
+        objects[(bucket, key)] = body
+        content_types[(bucket, key)] = content_type or 'application/octet-stream'
+        state["bytes"] += len(body)
+        while state["bytes"] > MAX_STORED_BYTES and objects:
+            evicted_key, evicted = objects.popitem(last=False)
+            content_types.pop(evicted_key, None)
+            state["bytes"] -= len(evicted)
+        return '"' + hashlib.md5(body).hexdigest().upper() + '"'
+
+    def multipart_etag(parts):
+        digest = hashlib.md5(b''.join(hashlib.md5(part).digest() for part in parts)).hexdigest().upper()
+        return f'"{digest}-{len(parts)}"'
+
+    @app.put('/{bucket}/{key:path}')
+    async def put_object(bucket: str, key: str, request: Request):
+        query = request.query_params
+        if 'uploadId' in query:
+            return await upload_part(bucket, key, request)
+        # 签名URL（浏览器直传）：校验有效期和签名；SDK 的请求头签名不校验
+        if 'Signature' in query:
+            expires = query.get('Expires', '0')
+            string_to_sign = (f"PUT\n{request.headers.get('content-md5', '')}\n"
+                              f"{request.headers.get('content-type', '')}\n{expires}\n/{bucket}/{key}")
+            if int(expires) < time.time():
+                return oss_error(403, 'AccessDenied', 'Request has expired.')
+            if query.get('OSSAccessKeyId') != ACCESS_KEY_ID or query.get('Signature') != _oss_signature(string_to_sign):
+                return oss_error(403, 'SignatureDoesNotMatch', 'The request signature we calculated does not match.')
+        # 与真实服务一样先接收完整的请求体（包括分块传输编码）再返回
+        body = await request.body()
+        await transfer_delay(len(body))
+        if faults.hit('oss', options.oss_error_rate):
+            return oss_error(503, 'ServiceUnavailable', 'Injected error')
+        etag = store(bucket, key, body, request.headers.get('content-type'))
+        return Response(headers={'ETag': etag, 'x-oss-request-id': uuid.uuid4().hex})
+
+    @app.post('/{bucket}')
+    @app.post('/{bucket}/')
+    async def post_object(bucket: str, request: Request):
+        """PostObject（浏览器表单直传）：按表单中的策略和签名校验后保存 file 字段的内容"""
+        form = await request.form()
+        upload = form.get('file')
+        if upload is None or not hasattr(upload, 'read'):
+            return oss_error(400, 'InvalidArgument', 'The file field is missing.')
+        body = await upload.read()
+        fields = {name: value for name, value in form.items() if isinstance(value, str)}
+        error = _check_post_policy(fields, bucket, len(body))
+        if error:
+            return oss_error(403, 'AccessDenied', error)
+        await transfer_delay(len(body))
+        if faults.hit('oss', options.oss_error_rate):
+            return oss_error(503, 'ServiceUnavailable', 'Injected error')
+        etag = store(bucket, fields['key'], body, fields.get('Content-Type'))
+        status = int(fields.get('success_action_status') or 204)
+        return Response(status_code=status if status in (200, 201, 204) else 204,
+                        headers={'ETag': etag, 'x-oss-request-id': uuid.uuid4().hex})
+
+    async def upload_part(bucket, key, request):
+        """UploadPart：与 PutObject 一样接收完请求体后按带宽计算延迟"""
+        upload = uploads.get(request.query_params['uploadId'])
+        if upload is None or (upload['bucket'], upload['key']) != (bucket, key):
+            return oss_error(404, 'NoSuchUpload', 'The specified upload does not exist.')
+        body = await request.body()
+        await transfer_delay(len(body))
+        if faults.hit('oss', options.oss_error_rate):
+            return oss_error(503, 'ServiceUnavailable', 'Injected error')
+        upload['parts'][int(request.query_params['partNumber'])] = body
+        return Response(headers={'ETag': '"' + hashlib.md5(body).hexdigest().upper() + '"',
+                                 'x-oss-request-id': uuid.uuid4().hex})
+
+    @app.post('/{bucket}/{key:path}')
+    async def multipart_upload(bucket: str, key: str, request: Request):
+        """InitiateMultipartUpload（?uploads）和 CompleteMultipartUpload（?uploadId=）"""
+        query = request.query_params
+        await transfer_delay(0)
+        if 'uploads' in query:
+            upload_id = uuid.uuid4().hex
+            uploads[upload_id] = {"bucket": bucket, "key": key, "parts": {},
+                                  "content_type": request.headers.get('content-type')}
+            body = (f'<?xml version="1.0" encoding="UTF-8"?>\n<InitiateMultipartUploadResult><Bucket>{bucket}</Bucket>'
+                    f'<Key>{key}</Key><UploadId>{upload_id}</UploadId></InitiateMultipartUploadResult>')
+            return Response(body, media_type='application/xml', headers={'x-oss-request-id': uuid.uuid4().hex})
+        upload = uploads.get(query.get('uploadId'))
+        if upload is None or (upload['bucket'], upload['key']) != (bucket, key):
+            return oss_error(404, 'NoSuchUpload', 'The specified upload does not exist.')
+        requested = []
+        for part in ElementTree.fromstring(await request.body()).iter('Part'):
+            number = int(part.findtext('PartNumber'))
+            body = upload['parts'].get(number)
+            if body is None or part.findtext('ETag').strip('"') != hashlib.md5(body).hexdigest().upper():
+                return oss_error(400, 'InvalidPart', f'Part {number} was not uploaded or the ETag does not match.')
+            requested.append(number)
+        if not requested or requested != sorted(requested):
+            return oss_error(400, 'InvalidPartOrder', 'The list of parts was not in ascending order.')
+        parts = [upload['parts'][number] for number in requested]
+        if any(len(part) < 100 * 1024 for part in parts[:-1]):
+            return oss_error(400, 'EntityTooSmall', 'Your proposed upload is smaller than the minimum allowed size.')
+        del uploads[query['uploadId']]
+        store(bucket, key, b''.join(parts), upload['content_type'])
+        etag = multipart_etag(parts)
+        body = (f'<?xml version="1.0" encoding="UTF-8"?>\n<CompleteMultipartUploadResult><Bucket>{bucket}</Bucket>'
+                f'<Key>{key}</Key><ETag>{etag}</ETag></CompleteMultipartUploadResult>')
+        return Response(body, media_type='application/xml',
+                        headers={'ETag': etag, 'x-oss-request-id': uuid.uuid4().hex})
+
+    @app.api_route('/{bucket}/{key:path}', methods=['GET', 'HEAD'])
+    async def get_object(bucket: str, key: str, request: Request):
+        body = objects.get((bucket, key))
+        if body is None:
+            return oss_error(404, 'NoSuchKey', 'The specified key does not exist.')
+        await transfer_delay(len(body) if request.method == 'GET' else 0)
+        headers = {'ETag': '"' + hashlib.md5(body).hexdigest().upper() + '"',
+                   'x-oss-request-id': uuid.uuid4().hex}
+        media_type = content_types.get((bucket, key), 'image/jpeg')
+        if request.method == 'HEAD':
+            headers['Content-Length'] = str(len(body))
+            return Response(headers=headers, media_type=media_type)
+        return Response(body, headers=headers, media_type=media_type)
+
+    @app.delete('/{bucket}/{key:path}')
+    async def delete_object(bucket: str, key: str, request: Request):
+        if 'uploadId' in request.query_params:
+            # AbortMultipartUpload：删除已上传的分片
+            if uploads.pop(request.query_params['uploadId'], None) is None:
+                return oss_error(404, 'NoSuchUpload', 'The specified upload does not exist.')
+            return Response(status_code=204, headers={'x-oss-request-id': uuid.uuid4().hex})
+        body = objects.pop((bucket, key), None)
+        content_types.pop((bucket, key), None)
+        if body is not None:
+            state["bytes"] -= len(body)
+        return Response(status_code=204, headers={'x-oss-request-id': uuid.uuid4().hex})
+
+    app.state.objects = objects
+    app.state.uploads = uploads
+    return app
+
+
+# ---------- 阿里云 DetectSkinDisease ----------
+
+class _RateLimiter:
+    """固定速率的令牌桶（容量为 1 秒的令牌），用于模拟公测版的 QPS 限制"""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.monotonic()
+
+    def allow(self):
+        if not self.rate:
+            return True
+        now = time.monotonic()
+        self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+
+def skin_app(options, faults, payloads=None):
+    """阿里云 RPC 风格的 DetectSkinDisease，按顺序轮流返回录制的结果"""
+    import httpx
+
+    http = {}
+
+    @asynccontextmanager
+    async def lifespan(app):
+        http['client'] = httpx.AsyncClient(timeout=10)
+        yield
+        await http['client'].aclose()
+
+    app = FastAPI(lifespan=lifespan)
+    payloads = payloads or load_payloads()
+    counter = {"next": 0}
+    limiter = _RateLimiter(options.skin_qps)
+
+    def rpc_error(status, code, message):
+        return JSONResponse({"RequestId": str(uuid.uuid4()).upper(), "Code": code, "Message": message,
+                             "Recommend": "https://api.aliyun.com/troubleshoot", "HostId": "fake-imageprocess"},
+                            status_code=status)
+
+    @app.head('/')
+    async def service_root():
+        return Response()
+
+    @app.api_route('/', methods=['GET', 'POST'])
+    async def rpc(request: Request):
+        params = dict(request.query_params)
+        if request.method == 'POST':
+            params.update(dict(await request.form()))
+        # 新版 Tea SDK 把接口名放在 x-acs-action 请求头中，旧版放在 Action 参数中
+        action = request.headers.get('x-acs-action') or params.get('Action')
+        if action != 'DetectSkinDisease':
+            return rpc_error(404, 'InvalidAction.NotFound', f"Specified api is not found: {action}")
+        if not limiter.allow():
+            return rpc_error(429, 'Throttling.User', 'Request was denied due to user flow control.')
+        url = params.get('Url')
+        if not url:
+            return rpc_error(400, 'MissingUrl', 'Url is mandatory for this action.')
+        started = time.perf_counter()
+        if not options.skin_no_fetch:
+            # 与真实服务一样从 OSS 下载图片
+            try:
+                image = await http['client'].get(url)
+            except httpx.HTTPError as e:
+                return rpc_error(400, 'InvalidFile.Download', f'Failed to download image: {e}')
+            if image.status_code != 200:
+                return rpc_error(400, 'InvalidFile.Download', f'Failed to download image: HTTP {image.status_code}')
+        remaining = faults.jitter(options.skin_latency_ms, options.skin_jitter_ms) - (time.perf_counter() - started)
+        await asyncio.sleep(max(0.0, remaining))
+        if faults.hit('skin', options.skin_error_rate):
+            return rpc_error(500, 'InternalError', 'Injected error')
+        data = payloads[counter["next"] % len(payloads)]
+        counter["next"] += 1
+        return {"RequestId": str(uuid.uuid4()).upper(), "Data": data}
+
+    return app
+
+
+def load_payloads(path=None):
+    with open(path or os.path.join(FIXTURES_DIR, 'detect_skin_disease.json'), encoding='utf-8') as f:
+        return json.load(f)
+
+
+# ---------- DeepSeek / NIM（OpenAI 兼容） ----------
+
+def split_tokens(text, size=2):
+    """把文本切成近似 token 的小段（中文大约每个 token 1~2 个字）"""
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+def _skin_summary(messages):
+    """从提示词中找出概率最高的类别，让输出内容与输入对应"""
+    prompt = "\n".join(str(m.get("content", "")) for m in messages)
+    for payload in load_payloads.cache:
+        name, score = max(payload["Results"].items(), key=lambda item: item[1])
+        if f'"{name}"' in prompt:
+            return payload, (name, score)
+    payload = load_payloads.cache[0]
+    return payload, max(payload["Results"].items(), key=lambda item: item[1])
+
+
+def _completion_parts(kind, messages, options):
+    """
+    Returns:
+        tuple: (推理过程的 token 列表, 输出内容的 token 列表)
+    """
+    payload, (top, score) = _skin_summary(messages)
+    if kind == 'nim':
+        results = sorted(payload["Results"].items(), key=lambda item: -item[1])
+        config = {
+            "type": "bar",
+            "data": {"labels": [name for name, _ in results],
+                     "datasets": [{"label": "概率", "data": [value for _, value in results],
+                                   "backgroundColor": "rgba(54, 162, 235, 0.6)"}]},
+            "options": {"plugins": {"title": {"display": True, "text": "皮肤分析结果"}},
+                        "scales": {"y": {"beginAtZero": True, "max": 1}}},
+        }
+        return [], split_tokens(CHART_TEXT.format(config=json.dumps(config, ensure_ascii=False, indent=2)), 4)
+    reasoning = split_tokens(REASONING_TEXT.format(
+        body_part=payload.get("BodyPart"), quality=payload.get("ImageQuality"), top=top))
+    while len(reasoning) < options.llm_reasoning_tokens:
+        reasoning += reasoning
+    return reasoning[:options.llm_reasoning_tokens], split_tokens(ANSWER_TEXT.format(top=top, score=score))
+
+
+def llm_app(kind, options, faults):
+    """OpenAI 兼容的 chat completions（kind 为 deepseek 或 nim）"""
+    app = FastAPI()
+
+    @app.head('/')
+    @app.head('/v1')
+    @app.head('/v1/chat/completions')
+    async def service_root():
+        return Response()
+
+    @app.post('/v1/chat/completions')
+    @app.post('/chat/completions')
+    async def chat_completions(request: Request):
+        body = await request.json()
+        messages = body.get("messages") or []
+        model = body.get("model") or kind
+        if faults.hit(kind, options.llm_error_rate):
+            await asyncio.sleep(options.llm_ttft_ms / 1000 / 3)
+            return JSONResponse({"error": {"message": "Injected error", "type": "fake_error",
+                                           "code": options.llm_error_status}},
+                                status_code=options.llm_error_status)
+        reasoning, content = _completion_parts(kind, messages, options)
+        prompt_tokens = sum(len(str(m.get("content", ""))) for m in messages) // 2
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": len(reasoning) + len(content),
+                 "total_tokens": prompt_tokens + len(reasoning) + len(content)}
+        if reasoning:
+            usage["completion_tokens_details"] = {"reasoning_tokens": len(reasoning)}
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        created = int(time.time())
+
+        if not body.get("stream"):
+            await asyncio.sleep(options.llm_ttft_ms / 1000 + _generation_seconds(len(reasoning) + len(content), options))
+            message = {"role": "assistant", "content": "".join(content)}
+            if reasoning:
+                message["reasoning_content"] = "".join(reasoning)
+            return {"id": completion_id, "object": "chat.completion", "created": created, "model": model,
+                    "choices": [{"index": 0, "message": message, "finish_reason": "stop"}], "usage": usage}
+
+        include_usage = bool((body.get("stream_options") or {}).get("include_usage"))
+
+        def chunk(delta, finish_reason=None, **extra):
+            data = {"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                    "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}] if delta is not None else [],
+                    **extra}
+            return f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+        async def stream():
+            await asyncio.sleep(options.llm_ttft_ms / 1000)
+            yield chunk({"role": "assistant", "content": ""})
+            tokens = [("reasoning_content", text) for text in reasoning] + [("content", text) for text in content]
+            first = time.perf_counter()
+            for index, (field, text) in enumerate(tokens):
+                # 按目标速率发送：落后时连续发送，不累积 sleep 的误差
+                due = first + _generation_seconds(index, options)
+                delay = due - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                yield chunk({field: text})
+            yield chunk({}, finish_reason="stop")
+            if include_usage:
+                yield chunk(None, usage=usage)
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(stream(), media_type='text/event-stream')
+
+    return app
+
+
+def _generation_seconds(tokens, options):
+    return tokens / options.llm_tokens_per_sec if options.llm_tokens_per_sec else 0.0
+
+
+load_payloads.cache = load_payloads()
+
+
+# ---------- 启动 ----------
+
+def _free_port(host):
+    with socket.socket() as s:
+        s.bind((host, 0))
+        return s.getsockname()[1]
+
+
+class FakeUpstreams:
+    """
+    在后台线程的事件循环中运行四个模拟服务
+    用法:
+        fakes = FakeUpstreams(options).start()
+        fakes.write_config('/tmp/fake_config.yaml')
+        ...
+        fakes.stop()
+    """
+
+    def __init__(self, options):
+        self.options = options
+        self.faults = FaultInjector(options.seed)
+        host = options.host
+        self.ports = {
+            'oss': options.oss_port or _free_port(host),
+            'skin': options.skin_port or _free_port(host),
+            'deepseek': options.deepseek_port or _free_port(host),
+            'nim': options.nim_port or _free_port(host),
+        }
+        apps = {
+            'oss': oss_app(options, self.faults),
+            'skin': skin_app(options, self.faults),
+            'deepseek': llm_app('deepseek', options, self.faults),
+            'nim': llm_app('nim', options, self.faults),
+        }
+        self.servers = [
+            uvicorn.Server(uvicorn.Config(apps[name], host=host, port=port, log_level='warning',
+                                          access_log=False, log_config=None))
+            for name, port in self.ports.items()
+        ]
+        self._thread = None
+
+    def url(self, name):
+        return f"http://{self.options.host}:{self.ports[name]}"
+
+    def start(self, timeout=10):
+        self._thread = threading.Thread(target=lambda: asyncio.run(self.serve()), name='fake-upstreams', daemon=True)
+        self._thread.start()
+        deadline = time.monotonic() + timeout
+        while not all(server.started for server in self.servers):
+            if time.monotonic() > deadline or not self._thread.is_alive():
+                raise RuntimeError("模拟上游启动失败")
+            time.sleep(0.02)
+        return self
+
+    async def serve(self):
+        await asyncio.gather(*(server.serve() for server in self.servers))
+
+    def stop(self):
+        for server in self.servers:
+            server.should_exit = True
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+
+    def config_overrides(self):
+        """把服务的上游地址指向模拟服务的配置项"""
+        host = self.options.host
+        return {
+            'skin_analysis_main_configuration': {'access_key_id': ACCESS_KEY_ID, 'access_key_secret': ACCESS_KEY_SECRET},
+            'img_to_oss': {'bucket_name': BUCKET_NAME, 'oss_endpoint': self.url('oss')},
+            'skin_analysis': {'access_key_id': ACCESS_KEY_ID, 'access_key_secret': ACCESS_KEY_SECRET,
+                              'endpoint': f"{host}:{self.ports['skin']}", 'protocol': 'HTTP'},
+            'deepseek_api': {'api_key': 'fake-key', 'base_url': f"{self.url('deepseek')}/v1"},
+            'gemma3n_api': {'api_key': 'fake-key', 'invoke_url': f"{self.url('nim')}/v1/chat/completions"},
+        }
+
+    def write_config(self, path, base_path=None, extra=None):
+        """以 config.yaml.template（或 base_path）为基础，写出连接模拟上游的配置文件"""
+        with open(base_path or os.path.join(BACK_END_DIR, 'config.yaml.template'), encoding='utf-8') as f:
+            config = yaml.safe_load(f) or {}
+        for overrides in (self.config_overrides(), extra or {}):
+            config = merge_config(config, overrides)
+        with open(path, 'w', encoding='utf-8') as f:
+            yaml.safe_dump(config, f, allow_unicode=True, sort_keys=False)
+        return path
+
+
+def merge_config(base, overrides):
+    """逐级合并配置，overrides 中的值覆盖 base 中的同名项"""
+    merged = dict(base or {})
+    for key, value in overrides.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            value = merge_config(merged[key], value)
+        merged[key] = value
+    return merged
+
+
+def main():
+    parser = add_arguments(argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter))
+    parser.add_argument('--write-config', help='写出连接模拟上游的配置文件（用 SKIN_ANALYSIS_CONFIG 指定给服务）')
+    parser.add_argument('--base-config', help='配置文件的基础，默认 config.yaml.template')
+    options = parser.parse_args()
+
+    fakes = FakeUpstreams(options).start()
+    for name in fakes.ports:
+        print(f"{name:>8}: {fakes.url(name)}")
+    if options.write_config:
+        fakes.write_config(options.write_config, options.base_config)
+        print(f"配置已写入 {options.write_config}，启动服务: "
+              f"SKIN_ANALYSIS_CONFIG={options.write_config} python -m uvicorn main:app --app-dir ALi_skin_model")
+    try:
+        while True:
+            time.sleep(10)
+            print(json.dumps(fakes.faults.stats(), ensure_ascii=False))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        fakes.stop()
+
+
+if __name__ == '__main__':
+    main()
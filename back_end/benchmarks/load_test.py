@@ -0,0 +1,330 @@
+# -*- coding: utf-8 -*-
+"""
+压测：以固定并发向 /api/upload 或 /api/analyze 发送请求，报告吞吐、延迟分位数(p50/p95/p99)和错误，
+/api/analyze 还按响应中的 timings 报告各阶段（upload/skin_analysis/reasoning/chart）的耗时分布
+每个请求默认使用内容不同的图片，避免命中按内容哈希的分析缓存
+
+用法:
+    # 启动本地模拟上游和服务（子进程）后压测，不访问任何云服务
+    python benchmarks/load_test.py --spawn --endpoint analyze -c 16 -n 200
+    python benchmarks/load_test.py --spawn --skin-qps 2 --set skin_analysis_quota.rate_per_second=2 -c 8 --duration 30
+    # 以 serve.py 启动 4 个工作进程（皮肤分析配额在进程间共享）
+    python benchmarks/load_test.py --spawn --workers 4 --skin-qps 2 --set skin_analysis_quota.rate_per_second=2 -c 16 -n 60
+    # 压测已经运行的服务
+    python benchmarks/load_test.py --url http://127.0.0.1:8000 --endpoint upload -c 32 -n 500
+    # 结果超过阈值时退出码为 1，可以在部署前检查性能回退
+    python benchmarks/load_test.py --spawn -n 100 --max-p95-ms 3000 --json result.json
+"""
+
+import argparse
+import asyncio
+import collections
+import io
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+BACK_END_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACK_END_DIR not in sys.path:
+    sys.path.insert(0, BACK_END_DIR)
+
+import httpx
+import yaml
+
+from fake_upstreams import FakeUpstreams, add_arguments as add_fake_arguments, merge_config
+
+STAGES = ('upload', 'skin_analysis', 'reasoning', 'chart')
+
+
+def percentile(values, q):
+    """最近秩法的分位数，values 为空时返回 None"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(q / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def distribution(values):
+    return {
+        "count": len(values),
+        "mean": round(sum(values) / len(values), 1) if values else None,
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+        "max": max(values) if values else None,
+    }
+
+
+class ImageSource:
+    """生成内容各不相同的 JPEG，也可以基于指定的图片"""
+
+    def __init__(self, path=None, size=(512, 512), unique=True):
+        from PIL import Image
+        if path:
+            self.image = Image.open(path).convert('RGB')
+        else:
+            self.image = Image.linear_gradient('L').resize(size).convert('RGB')
+        self.unique = unique
+        self._cached = None
+        # 序号在预热和各接口之间连续，不会重复
+        self._index = 0
+
+    def next(self):
+        index, self._index = self._index, self._index + 1
+        if not self.unique:
+            if self._cached is None:
+                self._cached = self._encode(self.image)
+            return self._cached
+        from PIL import Image
+        image = self.image.copy()
+        # 每个请求在左上角贴一块按序号生成的随机噪声：服务端重新编码（image_preprocess）后内容哈希仍然不同
+        noise = random.Random(index).randbytes(16 * 16 * 3)
+        image.paste(Image.frombytes('RGB', (16, 16), noise), (0, 0))
+        return self._encode(image)
+
+    @staticmethod
+    def _encode(image):
+        buffer = io.BytesIO()
+        image.save(buffer, format='JPEG', quality=90)
+        return buffer.getvalue()
+
+
+async def run_load(base_url, endpoint, concurrency, images, total=None, duration=None, timeout=120, question=None):
+    """
+    以固定并发发送请求，直到发送了 total 个请求或经过 duration 秒
+    Returns:
+        tuple: (每个请求的记录列表, 实际耗时秒数)
+    """
+    path = {"upload": "/api/upload", "analyze": "/api/analyze"}[endpoint]
+    params = {"question": question} if question and endpoint == "analyze" else None
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    records = []
+    counter = {"next": 0}
+    started = time.perf_counter()
+    deadline = started + duration if duration else None
+
+    def take():
+        if total is not None and counter["next"] >= total:
+            return None
+        if deadline is not None and time.perf_counter() >= deadline:
+            return None
+        counter["next"] += 1
+        return counter["next"] - 1
+
+    async def worker(client):
+        while (index := take()) is not None:
+            # 图片在计时之前生成
+            content = images.next()
+            record = {"index": index, "status": None, "latency_ms": None, "timings": None, "error": None}
+            request_started = time.perf_counter()
+            try:
+                response = await client.post(path, params=params,
+                                             files={"file": (f"load_{index}.jpg", content, "image/jpeg")})
+                record["status"] = response.status_code
+                if response.status_code == 200 and endpoint == "analyze":
+                    record["timings"] = response.json().get("timings")
+                elif response.status_code != 200:
+                    record["error"] = response.text[:200]
+            except httpx.HTTPError as e:
+                record["error"] = f"{type(e).__name__}: {e}"
+            record["latency_ms"] = round((time.perf_counter() - request_started) * 1000, 1)
+            records.append(record)
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=timeout, limits=limits) as client:
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+    return records, time.perf_counter() - started
+
+
+def summarize(records, elapsed, endpoint, concurrency):
+    ok = [r for r in records if r["status"] == 200]
+    errors = collections.Counter(str(r["status"] or r["error"].split(':')[0]) for r in records if r["status"] != 200)
+    report = {
+        "endpoint": endpoint,
+        "concurrency": concurrency,
+        "requests": len(records),
+        "succeeded": len(ok),
+        "errors": dict(errors),
+        "elapsed_s": round(elapsed, 2),
+        "throughput_rps": round(len(ok) / elapsed, 2) if elapsed else None,
+        "latency_ms": distribution([r["latency_ms"] for r in ok]),
+    }
+    stages = {}
+    for name in STAGES:
+        timings = [r["timings"][name] for r in ok if r["timings"] and r["timings"].get(name)]
+        if timings:
+            stages[name] = {
+                **distribution([t["duration_ms"] for t in timings if t.get("status") == "ok"]),
+                "status": dict(collections.Counter(t.get("status") for t in timings)),
+            }
+    totals = [r["timings"]["total_ms"] for r in ok if r["timings"] and r["timings"].get("total_ms") is not None]
+    if totals:
+        stages["total"] = distribution(totals)
+    if stages:
+        report["stages_ms"] = stages
+    return report
+
+
+def print_report(report):
+    latency = report["latency_ms"]
+    print(f"\n{report['endpoint']}  并发 {report['concurrency']}  请求 {report['requests']}  "
+          f"成功 {report['succeeded']}  错误 {report['errors'] or 0}  耗时 {report['elapsed_s']}s")
+    print(f"吞吐: {report['throughput_rps']} req/s")
+    print(f"{'':<14}{'count':>7}{'mean':>10}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}  (ms)")
+    rows = [("latency", latency)] + list((report.get("stages_ms") or {}).items())
+    for name, dist in rows:
+        print(f"{name:<14}{dist['count']:>7}" + "".join(
+            f"{'-' if dist[key] is None else dist[key]:>10}" for key in ('mean', 'p50', 'p95', 'p99', 'max')))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def parse_overrides(items):
+    """--set section.key=value（值按 YAML 解析），key 可以多级，例如 resilience.stage_budgets.chart=5"""
+    overrides = {}
+    for item in items or ():
+        key, _, value = item.partition('=')
+        section, _, name = key.partition('.')
+        if not name:
+            raise SystemExit(f"--set 格式应为 section.key=value: {item}")
+        *parents, name = name.split('.')
+        target = overrides.setdefault(section, {})
+        for parent in parents:
+            target = target.setdefault(parent, {})
+        target[name] = yaml.safe_load(value)
+    return overrides
+
+
+def spawn_service(fakes, work_dir, overrides, workers=0, startup_timeout=60):
+    """
+    写出连接模拟上游的配置（缓存、任务和日志都放在临时目录中），在子进程中启动服务
+    workers 为 0 时以 uvicorn 单进程启动，否则以 serve.py 启动 workers 个工作进程
+    Returns:
+        tuple: (子进程, 服务地址)
+    """
+    extra = {
+        'analysis_cache': {'db_path': os.path.join(work_dir, 'analysis_cache.sqlite3')},
+        'chart': {'cache_dir': os.path.join(work_dir, 'charts')},
+        'jobs': {'db_path': os.path.join(work_dir, 'jobs.sqlite3'), 'spool_dir': os.path.join(work_dir, 'jobs')},
+        'logging': {'dir': os.path.join(work_dir, 'logs'), 'console': False},
+        'skin_analysis_quota': {'shared_db': os.path.join(work_dir, 'quota.sqlite3')},
+        'server': {'access_log': False},
+    }
+    for section, values in overrides.items():
+        extra[section] = merge_config(extra.get(section, {}), values)
+    config_path = fakes.write_config(os.path.join(work_dir, 'config.yaml'), extra=extra)
+    port = free_port()
+    env = dict(os.environ, SKIN_ANALYSIS_CONFIG=config_path)
+    if workers:
+        command = [sys.executable, os.path.join(BACK_END_DIR, 'serve.py'), '--workers', str(workers),
+                   '--host', '127.0.0.1', '--port', str(port)]
+    else:
+        command = [sys.executable, '-m', 'uvicorn', 'main:app', '--app-dir', os.path.join(BACK_END_DIR, 'ALi_skin_model'),
+                   '--host', '127.0.0.1', '--port', str(port), '--log-level', 'warning', '--no-access-log']
+    process = subprocess.Popen(command, cwd=BACK_END_DIR, env=env)
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + startup_timeout
+    while True:
+        if process.poll() is not None:
+            raise RuntimeError(f"服务启动失败，退出码 {process.returncode}")
+        try:
+            if httpx.get(f"{base_url}/", timeout=1).status_code == 200:
+                return process, base_url
+        except httpx.HTTPError:
+            pass
+        if time.monotonic() > deadline:
+            process.terminate()
+            raise RuntimeError("等待服务启动超时")
+        time.sleep(0.2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument('--url', help='已经运行的服务地址')
+    target.add_argument('--spawn', action='store_true', help='启动模拟上游和服务（子进程）后压测')
+    parser.add_argument('--endpoint', choices=('upload', 'analyze', 'both'), default='analyze')
+    parser.add_argument('-c', '--concurrency', type=int, default=8)
+    parser.add_argument('-n', '--requests', type=int, default=None, help='每个接口的请求数（默认 100）')
+    parser.add_argument('--duration', type=float, default=None, help='按时长压测（秒），与 -n 二选一')
+    parser.add_argument('--warmup', type=int, default=2, help='正式计时前的预热请求数')
+    parser.add_argument('--image', help='基于这张图片生成请求（默认生成 512x512 的渐变图）')
+    parser.add_argument('--same-image', action='store_true', help='所有请求使用同一张图片（测试缓存命中）')
+    parser.add_argument('--question', default=None)
+    parser.add_argument('--timeout', type=float, default=120)
+    parser.add_argument('--workers', type=int, default=0,
+                        help='--spawn 时以 serve.py 启动多个工作进程（默认以 uvicorn 单进程启动）')
+    parser.add_argument('--set', action='append', metavar='SECTION.KEY=VALUE',
+                        help='--spawn 时覆盖服务配置，例如 --set skin_analysis_quota.rate_per_second=8')
+    parser.add_argument('--json', help='把结果写入 JSON 文件')
+    parser.add_argument('--max-p95-ms', type=float, default=None, help='p95 超过时退出码为 1')
+    parser.add_argument('--min-rps', type=float, default=None, help='吞吐低于时退出码为 1')
+    add_fake_arguments(parser)
+    options = parser.parse_args()
+    total = options.requests if options.requests is not None or options.duration else 100
+
+    fakes = process = None
+    work_dir = None
+    try:
+        if options.spawn:
+            fakes = FakeUpstreams(options).start()
+            work_dir = tempfile.TemporaryDirectory(prefix='skin_load_')
+            process, base_url = spawn_service(fakes, work_dir.name, parse_overrides(options.set), options.workers)
+            print("模拟上游: " + ", ".join(f"{name}={fakes.url(name)}" for name in fakes.ports))
+            print(f"服务: {base_url}（配置 {os.path.join(work_dir.name, 'config.yaml')}）")
+        else:
+            base_url = options.url.rstrip('/')
+
+        images = ImageSource(options.image, unique=not options.same_image)
+        endpoints = ('upload', 'analyze') if options.endpoint == 'both' else (options.endpoint,)
+        reports = []
+        for endpoint in endpoints:
+            if options.warmup:
+                asyncio.run(run_load(base_url, endpoint, min(options.warmup, options.concurrency), images,
+                                     total=options.warmup, timeout=options.timeout, question=options.question))
+            records, elapsed = asyncio.run(run_load(
+                base_url, endpoint, options.concurrency, images, total=total, duration=options.duration,
+                timeout=options.timeout, question=options.question))
+            report = summarize(records, elapsed, endpoint, options.concurrency)
+            print_report(report)
+            reports.append(report)
+        if fakes is not None:
+            print(f"\n模拟上游: {json.dumps(fakes.faults.stats(), ensure_ascii=False)}")
+    finally:
+        if process is not None:
+            process.terminate()
+            try:
+                process.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        if fakes is not None:
+            fakes.stop()
+        if work_dir is not None:
+            work_dir.cleanup()
+
+    if options.json:
+        with open(options.json, 'w', encoding='utf-8') as f:
+            json.dump(reports, f, ensure_ascii=False, indent=2)
+    failed = []
+    for report in reports:
+        p95 = report["latency_ms"]["p95"]
+        if options.max_p95_ms is not None and (p95 is None or p95 > options.max_p95_ms):
+            failed.append(f"{report['endpoint']} p95 {p95}ms > {options.max_p95_ms}ms")
+        if options.min_rps is not None and (report["throughput_rps"] or 0) < options.min_rps:
+            failed.append(f"{report['endpoint']} 吞吐 {report['throughput_rps']} < {options.min_rps} req/s")
+    if failed:
+        print("\n未达到性能要求: " + "; ".join(failed))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
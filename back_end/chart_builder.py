@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+"""
+皮肤数据图表（Chart.js 配置）
+DetectSkinDisease 的结果结构固定（results 为 病症名称 -> 概率），图表可以直接按字段生成，
+不需要每次请求都让大模型输出一遍 Chart.js 配置（数秒、最多 8000 token，还要从输出中抽取和修补JSON）。
+  local   ：本地生成雷达图或柱状图，亚毫秒级
+  creative：由 NIM 设计图表样式（类型、配色、options），按数据结构的指纹缓存，
+            同样结构的结果只调用一次大模型，之后只把当前数据填入缓存的样式中；调用失败时使用本地生成的配置
+"""
+
+import copy
+import hashlib
+import json
+import logging
+import threading
+from collections import OrderedDict
+
+import logger_config
+from analysis_cache import SingleFlight
+from concurrency import run_blocking
+from resilience import hedged
+from skin_result import as_dict
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TOP_K = 8
+DEFAULT_CREATIVE_CACHE_ENTRIES = 64
+# 类别数在这个范围内时用雷达图，否则用柱状图
+RADAR_MIN_LABELS = 3
+RADAR_MAX_LABELS = 12
+PALETTE = ('#4e79a7', '#f28e2b', '#e15759', '#76b7b2', '#59a14f',
+           '#edc948', '#b07aa1', '#ff9da7', '#9c755f', '#bab0ac')
+# creative 模式下接受的图表类型（Chart.js 2，与 quickchart.io 的默认版本一致）
+CREATIVE_TYPES = ('radar', 'bar', 'horizontalBar', 'line', 'polarArea', 'doughnut', 'pie')
+
+
+def chart_series(analysis, top_k=DEFAULT_TOP_K):
+    """
+    从皮肤分析结果中取出图表数据
+    Returns:
+        tuple: (类别名称列表, 百分比数值列表)，按概率从高到低排列
+    """
+    results = (as_dict(analysis) or {}).get('results') or {}
+    items = [(str(name), value) for name, value in results.items()
+             if isinstance(value, (int, float)) and not isinstance(value, bool)]
+    items.sort(key=lambda item: item[1], reverse=True)
+    if top_k:
+        items = items[:top_k]
+    # 概率为 0~1 时换算成百分比
+    scale = 100 if items and max(value for _, value in items) <= 1 else 1
+    return [name for name, _ in items], [round(value * scale, 1) for _, value in items]
+
+
+def build_chart_config(analysis, chart_type='auto', top_k=DEFAULT_TOP_K, title="皮肤分析结果"):
+    """
+    按固定结构生成 Chart.js 配置
+    Args:
+        analysis (SkinAnalysisResult | dict | str): 皮肤分析结果
+        chart_type (str): auto、radar 或 bar
+        top_k (int): 最多显示的类别数，0 表示全部
+    """
+    labels, values = chart_series(analysis, top_k)
+    if chart_type == 'auto':
+        chart_type = 'radar' if RADAR_MIN_LABELS <= len(labels) <= RADAR_MAX_LABELS else 'bar'
+    dataset = {"label": "概率 (%)", "data": values}
+    if chart_type == 'radar':
+        dataset.update(backgroundColor='rgba(78,121,167,0.25)', borderColor=PALETTE[0],
+                       pointBackgroundColor=PALETTE[0], borderWidth=2)
+        options = {
+            "title": {"display": True, "text": title},
+            "legend": {"display": False},
+            "scale": {"ticks": {"beginAtZero": True, "min": 0, "max": 100, "stepSize": 20}},
+        }
+    else:
+        chart_type = 'horizontalBar'
+        dataset.update(backgroundColor=[PALETTE[i % len(PALETTE)] for i in range(len(values))], borderWidth=0)
+        options = {
+            "title": {"display": True, "text": title},
+            "legend": {"display": False},
+            "scales": {"xAxes": [{"ticks": {"beginAtZero": True, "min": 0, "max": 100}}]},
+        }
+    return {"type": chart_type, "data": {"labels": labels, "datasets": [dataset]}, "options": options}
+
+
+def schema_fingerprint(analysis, top_k=DEFAULT_TOP_K, chart_type='auto'):
+    """数据结构的指纹：顶层字段和图表中显示的类别名称（不含数值），结构相同的结果共用同一个图表样式"""
+    analysis = as_dict(analysis)
+    labels, _ = chart_series(analysis, top_k)
+    schema = {"fields": sorted((analysis or {}).keys()), "labels": sorted(labels), "type": chart_type}
+    return hashlib.sha256(json.dumps(schema, ensure_ascii=False, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+
+
+def apply_style(config, styled):
+    """把大模型设计的样式（图表类型、options、数据集的配色等）套用到本地生成的配置上，数据仍然来自本地"""
+    result = copy.deepcopy(config)
+    if not isinstance(styled, dict):
+        return result
+    if styled.get('type') in CREATIVE_TYPES:
+        result['type'] = styled['type']
+    if isinstance(styled.get('options'), dict):
+        result['options'] = copy.deepcopy(styled['options'])
+    datasets = (styled.get('data') or {}).get('datasets') if isinstance(styled.get('data'), dict) else None
+    if datasets and isinstance(datasets[0], dict):
+        style = {k: v for k, v in datasets[0].items() if k not in ('data', 'label')}
+        result['data']['datasets'][0].update(copy.deepcopy(style))
+    return result
+
+
+class ChartStyleCache:
+    """creative 模式的图表样式缓存（内存 LRU，按数据结构指纹），同一指纹的并发请求只调用一次大模型"""
+
+    def __init__(self, max_entries=DEFAULT_CREATIVE_CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self._styles = OrderedDict()
+        self._lock = threading.Lock()
+        self._flight = SingleFlight()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            style = self._styles.get(key)
+            if style is not None:
+                self._styles.move_to_end(key)
+            return style
+
+    def put(self, key, style):
+        with self._lock:
+            self._styles[key] = style
+            self._styles.move_to_end(key)
+            while len(self._styles) > self.max_entries:
+                self._styles.popitem(last=False)
+
+    async def get_or_design(self, key, design):
+        style = self.get(key)
+        if style is not None:
+            self.hits += 1
+            return style
+        self.misses += 1
+
+        async def compute():
+            style = await design()
+            self.put(key, style)
+            return style
+        return await self._flight.do(key, compute)
+
+    def stats(self):
+        return {"entries": len(self._styles), "hits": self.hits, "misses": self.misses}
+
+
+_style_cache = None
+_style_cache_lock = threading.Lock()
+
+
+def get_style_cache():
+    global _style_cache
+    if _style_cache is None:
+        with _style_cache_lock:
+            if _style_cache is None:
+                entries = logger_config.Config().get_chart().get('creative_cache_entries', DEFAULT_CREATIVE_CACHE_ENTRIES)
+                _style_cache = ChartStyleCache(int(entries))
+    return _style_cache
+
+
+async def build_chart(analysis, nim_session_factory=None):
+    """
+    按配置生成图表配置
+    Args:
+        analysis (SkinAnalysisResult | dict): 皮肤分析结果
+        nim_session_factory: 返回复用的 requests.Session 的函数（只在 creative 模式调用 NIM 时使用）
+
+    Returns:
+        tuple: (Chart.js 配置, 来源 "local" / "creative" / "creative-cached" / "local-fallback")
+    """
+    chart_config = logger_config.Config().get_chart()
+    chart_type = chart_config.get('type', 'auto')
+    top_k = int(chart_config.get('top_k', DEFAULT_TOP_K))
+    config = build_chart_config(analysis, chart_type, top_k)
+    if chart_config.get('mode', 'local') != 'creative':
+        return config, "local"
+
+    import back_configuration as bc
+    from gemma3n_models import get_chart_config_from_nim
+    cache = get_style_cache()
+    key = schema_fingerprint(analysis, top_k, chart_type)
+    cached = cache.get(key) is not None
+
+    async def design():
+        api_key, invoke_url, model_name, max_tokens = bc.skin_data_visualization()
+        # 设计样式是幂等的，NIM 响应慢时发对冲请求（见 resilience.upstreams.nim.hedge_after）
+        return await hedged('nim', lambda: run_blocking(
+            get_chart_config_from_nim, analysis, api_key, invoke_url, model_name, max_tokens,
+            nim_session_factory() if nim_session_factory else None
+        ))
+
+    try:
+        style = await cache.get_or_design(key, design)
+    except Exception as e:
+        logger.warning(f"NIM 生成图表样式失败，使用本地生成的图表: {str(e)}")
+        return config, "local-fallback"
+    return apply_style(config, style), "creative-cached" if cached else "creative"
@@ -0,0 +1,423 @@
+# -*- coding: utf-8 -*-
+"""
+图表渲染（替代 quickchart.io）
+原来把整个 Chart.js 配置 URL 编码进 https://quickchart.io/chart?c=... ，每次查看都要请求第三方，配置较大时还会超过URL长度限制。
+这里在服务内把图表配置渲染为 SVG 或 PNG：
+  先把配置转换为与输出格式无关的图元（矩形、折线、多边形、扇形、文字），再输出为 SVG 文本或用 Pillow 绘制 PNG；
+  配置按内容哈希保存在磁盘上，首次请求 /api/charts/{hash}.{svg|png} 时在进程池中渲染并缓存文件，
+  同一个哈希的内容永远不变，响应带 ETag 和 immutable 缓存头，重复查看不再产生任何渲染
+"""
+
+import hashlib
+import io
+import json
+import math
+import os
+import re
+import threading
+from xml.sax.saxutils import escape, quoteattr
+
+import logger_config
+from analysis_cache import SingleFlight
+from concurrency import run_blocking
+from temp_janitor import sharded_path
+
+try:
+    from PIL import Image, ImageColor, ImageDraw, ImageFont
+except ImportError:  # Pillow 未安装时只能输出 SVG
+    Image = ImageColor = ImageDraw = ImageFont = None
+
+BACK_END_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_CACHE_DIR = os.path.join(BACK_END_DIR, 'cache', 'charts')
+DEFAULT_WIDTH = 640
+DEFAULT_HEIGHT = 480
+DEFAULT_FORMAT = 'svg'
+MEDIA_TYPES = {'svg': 'image/svg+xml', 'png': 'image/png'}
+PALETTE = ('#4e79a7', '#f28e2b', '#e15759', '#76b7b2', '#59a14f',
+           '#edc948', '#b07aa1', '#ff9da7', '#9c755f', '#bab0ac')
+GRID_COLOR = '#d9d9d9'
+TEXT_COLOR = '#333333'
+TITLE_SIZE = 18
+LABEL_SIZE = 12
+# PNG 中的中文需要 CJK 字体，未配置 font_path 时依次尝试这些常见位置
+FONT_CANDIDATES = (
+    '/usr/share/fonts/opentype/noto/NotoSansCJK-Regular.ttc',
+    '/usr/share/fonts/truetype/noto/NotoSansCJK-Regular.ttc',
+    '/usr/share/fonts/noto-cjk/NotoSansCJK-Regular.ttc',
+    '/usr/share/fonts/truetype/wqy/wqy-microhei.ttc',
+    '/usr/share/fonts/wqy-microhei/wqy-microhei.ttc',
+    'C:/Windows/Fonts/msyh.ttc',
+    '/System/Library/Fonts/PingFang.ttc',
+)
+_KEY_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+
+
+# ---------- 图表配置 -> 图元 ----------
+
+def _text_width(text, size):
+    """估算文字宽度（中文按字号，其他字符按 0.6 倍字号），只用于布局"""
+    return sum(size if ord(ch) > 0x2e80 else size * 0.6 for ch in str(text))
+
+
+def _nice_max(value):
+    """坐标轴的上限取整到 1/2/5 x 10^n"""
+    if value <= 0:
+        return 1
+    exponent = 10 ** math.floor(math.log10(value))
+    for step in (1, 2, 5, 10):
+        if value <= step * exponent:
+            return step * exponent
+    return 10 * exponent
+
+
+def _color_at(color, index, default):
+    if isinstance(color, list):
+        color = color[index % len(color)] if color else None
+    return str(color) if isinstance(color, str) and color else default
+
+
+def _fmt(value):
+    return f"{value:g}" if isinstance(value, (int, float)) else str(value)
+
+
+def _chart_parts(config):
+    data = config.get('data') or {}
+    labels = [str(label) for label in data.get('labels') or []]
+    datasets = [d for d in data.get('datasets') or [] if isinstance(d, dict)]
+    values = [v if isinstance(v, (int, float)) else 0 for v in (datasets[0].get('data') if datasets else []) or []]
+    values = values[:len(labels)] + [0] * (len(labels) - len(values))
+    options = config.get('options') or {}
+    title = (options.get('title') or {}).get('text') if (options.get('title') or {}).get('display', True) else None
+    return labels, values, datasets[0] if datasets else {}, options, title
+
+
+def _axis_max(options, values, scale_key):
+    if scale_key == 'scale':
+        ticks = (options.get('scale') or {}).get('ticks') or {}
+    else:
+        axes = (options.get('scales') or {}).get(scale_key) or [{}]
+        ticks = (axes[0] if axes and isinstance(axes[0], dict) else {}).get('ticks') or {}
+    maximum = ticks.get('max')
+    return maximum if isinstance(maximum, (int, float)) and maximum > 0 else _nice_max(max(values or [0]))
+
+
+def chart_primitives(config, width=DEFAULT_WIDTH, height=DEFAULT_HEIGHT):
+    """
+    把 Chart.js 配置转换为图元列表
+    支持 radar、bar、horizontalBar、line、pie、doughnut、polarArea（后三种按饼图绘制），只绘制第一个数据集
+    Returns:
+        list: ("rect", x, y, w, h, fill) / ("line", points, stroke, width) / ("polygon", points, fill, stroke, width) /
+              ("circle", cx, cy, r, fill) / ("wedge", cx, cy, r, start_deg, end_deg, fill) / ("text", x, y, text, size, fill, anchor)
+    """
+    labels, values, dataset, options, title = _chart_parts(config)
+    chart_type = config.get('type', 'bar')
+    items = [("rect", 0, 0, width, height, '#ffffff')]
+    top = 12
+    if title:
+        items.append(("text", width / 2, top + TITLE_SIZE / 2, title, TITLE_SIZE, TEXT_COLOR, 'middle'))
+        top += TITLE_SIZE + 12
+    if not labels:
+        items.append(("text", width / 2, height / 2, "无数据", LABEL_SIZE, TEXT_COLOR, 'middle'))
+        return items
+
+    fill = dataset.get('backgroundColor')
+    stroke = dataset.get('borderColor')
+    if chart_type == 'radar':
+        items += _radar(labels, values, options, fill, stroke, width, height, top)
+    elif chart_type == 'horizontalBar':
+        items += _horizontal_bars(labels, values, options, fill, width, height, top)
+    elif chart_type in ('pie', 'doughnut', 'polarArea'):
+        items += _pie(labels, values, fill, chart_type == 'doughnut', width, height, top)
+    else:
+        items += _vertical_bars(labels, values, options, fill, stroke, chart_type == 'line', width, height, top)
+    return items
+
+
+def _radar(labels, values, options, fill, stroke, width, height, top):
+    items = []
+    maximum = _axis_max(options, values, 'scale')
+    label_margin = max(_text_width(label, LABEL_SIZE) for label in labels) + 10
+    cx, cy = width / 2, (top + height) / 2
+    radius = max(10, min(width / 2 - label_margin, (height - top) / 2 - LABEL_SIZE - 8))
+    count = len(labels)
+    angle = lambda i: -math.pi / 2 + 2 * math.pi * i / count
+    point = lambda i, r: (cx + r * math.cos(angle(i)), cy + r * math.sin(angle(i)))
+    for step in range(1, 6):
+        r = radius * step / 5
+        items.append(("polygon", [point(i, r) for i in range(count)], None, GRID_COLOR, 1))
+        items.append(("text", cx + 4, cy - r, _fmt(round(maximum * step / 5, 2)), LABEL_SIZE - 2, '#888888', 'start'))
+    for i, label in enumerate(labels):
+        items.append(("line", [(cx, cy), point(i, radius)], GRID_COLOR, 1))
+        x, y = point(i, radius + 8)
+        anchor = 'middle' if abs(x - cx) < 1 else ('start' if x > cx else 'end')
+        items.append(("text", x, y, label, LABEL_SIZE, TEXT_COLOR, anchor))
+    shape = [point(i, radius * min(max(value / maximum, 0), 1)) for i, value in enumerate(values)]
+    line_color = _color_at(stroke, 0, PALETTE[0])
+    items.append(("polygon", shape, _color_at(fill, 0, 'rgba(78,121,167,0.25)'), line_color, 2))
+    items += [("circle", x, y, 3, line_color) for x, y in shape]
+    return items
+
+
+def _horizontal_bars(labels, values, options, fill, width, height, top):
+    items = []
+    maximum = _axis_max(options, values, 'xAxes')
+    left = min(width / 3, max(_text_width(label, LABEL_SIZE) for label in labels) + 16)
+    right, bottom = width - 48, height - 28
+    band = (bottom - top) / len(labels)
+    for step in range(6):
+        x = left + (right - left) * step / 5
+        items.append(("line", [(x, top), (x, bottom)], GRID_COLOR, 1))
+        items.append(("text", x, bottom + 14, _fmt(round(maximum * step / 5, 2)), LABEL_SIZE - 2, '#888888', 'middle'))
+    for i, (label, value) in enumerate(zip(labels, values)):
+        y = top + band * i
+        length = (right - left) * min(max(value / maximum, 0), 1)
+        items.append(("rect", left, y + band * 0.15, length, band * 0.7, _color_at(fill, i, PALETTE[i % len(PALETTE)])))
+        items.append(("text", left - 8, y + band / 2, label, LABEL_SIZE, TEXT_COLOR, 'end'))
+        items.append(("text", left + length + 4, y + band / 2, _fmt(value), LABEL_SIZE - 1, TEXT_COLOR, 'start'))
+    return items
+
+
+def _vertical_bars(labels, values, options, fill, stroke, as_line, width, height, top):
+    items = []
+    maximum = _axis_max(options, values, 'yAxes')
+    left, right, bottom = 48, width - 16, height - 40
+    band = (right - left) / len(labels)
+    for step in range(6):
+        y = bottom - (bottom - top) * step / 5
+        items.append(("line", [(left, y), (right, y)], GRID_COLOR, 1))
+        items.append(("text", left - 6, y, _fmt(round(maximum * step / 5, 2)), LABEL_SIZE - 2, '#888888', 'end'))
+    points = []
+    for i, (label, value) in enumerate(zip(labels, values)):
+        x = left + band * i
+        length = (bottom - top) * min(max(value / maximum, 0), 1)
+        points.append((x + band / 2, bottom - length))
+        if not as_line:
+            items.append(("rect", x + band * 0.15, bottom - length, band * 0.7, length,
+                          _color_at(fill, i, PALETTE[i % len(PALETTE)])))
+        items.append(("text", x + band / 2, bottom + 14, label, LABEL_SIZE, TEXT_COLOR, 'middle'))
+    if as_line:
+        line_color = _color_at(stroke, 0, PALETTE[0])
+        items.append(("line", points, line_color, 2))
+        items += [("circle", x, y, 3, line_color) for x, y in points]
+    return items
+
+
+def _pie(labels, values, fill, doughnut, width, height, top):
+    items = []
+    total = sum(value for value in values if value > 0) or 1
+    legend_width = max(_text_width(label, LABEL_SIZE) for label in labels) + 40
+    radius = max(10, min((width - legend_width) / 2, (height - top) / 2) - 12)
+    cx, cy = (width - legend_width) / 2, (top + height) / 2
+    start = -90.0
+    for i, (label, value) in enumerate(zip(labels, values)):
+        color = _color_at(fill, i, PALETTE[i % len(PALETTE)])
+        sweep = 360.0 * max(value, 0) / total
+        if sweep > 0:
+            items.append(("wedge", cx, cy, radius, start, start + sweep, color))
+        start += sweep
+        y = top + 10 + i * (LABEL_SIZE + 8)
+        items.append(("rect", width - legend_width, y - 6, 12, 12, color))
+        items.append(("text", width - legend_width + 18, y, f"{label} {_fmt(value)}", LABEL_SIZE, TEXT_COLOR, 'start'))
+    if doughnut:
+        items.append(("circle", cx, cy, radius * 0.5, '#ffffff'))
+    return items
+
+
+# ---------- 图元 -> SVG / PNG ----------
+
+def render_svg(items, width, height):
+    parts = [f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" '
+             f'viewBox="0 0 {width} {height}" font-family="sans-serif">']
+    points_attr = lambda points: ' '.join(f"{x:.1f},{y:.1f}" for x, y in points)
+    for item in items:
+        kind = item[0]
+        if kind == "rect":
+            _, x, y, w, h, fill = item
+            parts.append(f'<rect x="{x:.1f}" y="{y:.1f}" width="{w:.1f}" height="{h:.1f}" fill={quoteattr(fill)}/>')
+        elif kind == "line":
+            _, points, stroke, stroke_width = item
+            parts.append(f'<polyline points="{points_attr(points)}" fill="none" stroke={quoteattr(stroke)} '
+                         f'stroke-width="{stroke_width}"/>')
+        elif kind == "polygon":
+            _, points, fill, stroke, stroke_width = item
+            parts.append(f'<polygon points="{points_attr(points)}" fill={quoteattr(fill or "none")} '
+                         f'stroke={quoteattr(stroke or "none")} stroke-width="{stroke_width}"/>')
+        elif kind == "circle":
+            _, cx, cy, r, fill = item
+            parts.append(f'<circle cx="{cx:.1f}" cy="{cy:.1f}" r="{r:.1f}" fill={quoteattr(fill)}/>')
+        elif kind == "wedge":
+            _, cx, cy, r, start, end, fill = item
+            if end - start >= 359.99:
+                parts.append(f'<circle cx="{cx:.1f}" cy="{cy:.1f}" r="{r:.1f}" fill={quoteattr(fill)}/>')
+                continue
+            x1, y1 = cx + r * math.cos(math.radians(start)), cy + r * math.sin(math.radians(start))
+            x2, y2 = cx + r * math.cos(math.radians(end)), cy + r * math.sin(math.radians(end))
+            large = 1 if end - start > 180 else 0
+            parts.append(f'<path d="M{cx:.1f},{cy:.1f} L{x1:.1f},{y1:.1f} A{r:.1f},{r:.1f} 0 {large} 1 '
+                         f'{x2:.1f},{y2:.1f} Z" fill={quoteattr(fill)} stroke="#ffffff"/>')
+        elif kind == "text":
+            _, x, y, text, size, fill, anchor = item
+            parts.append(f'<text x="{x:.1f}" y="{y:.1f}" font-size="{size}" fill={quoteattr(fill)} '
+                         f'text-anchor="{anchor}" dominant-baseline="central">{escape(str(text))}</text>')
+    parts.append('</svg>')
+    return '\n'.join(parts).encode('utf-8')
+
+
+def _pil_color(color):
+    """Pillow 不支持 rgba() 中 0~1 的透明度，单独解析"""
+    match = re.match(r'rgba\(\s*([\d.]+)\s*,\s*([\d.]+)\s*,\s*([\d.]+)\s*,\s*([\d.]+)\s*\)', str(color))
+    if match:
+        r, g, b, a = (float(v) for v in match.groups())
+        return int(r), int(g), int(b), int(a * 255 if a <= 1 else a)
+    try:
+        return ImageColor.getrgb(str(color))
+    except ValueError:
+        return ImageColor.getrgb(PALETTE[0])
+
+
+def _load_font(size, font_path=None):
+    for path in ([font_path] if font_path else []) + list(FONT_CANDIDATES):
+        if path and os.path.exists(path):
+            try:
+                return ImageFont.truetype(path, size)
+            except OSError:
+                continue
+    try:
+        return ImageFont.load_default(size)
+    except TypeError:  # Pillow < 10.1 的默认字体不能指定字号
+        return ImageFont.load_default()
+
+
+def render_png(items, width, height, font_path=None, supersample=2):
+    """用 Pillow 绘制（按 supersample 倍放大绘制后缩小，实现抗锯齿）"""
+    if Image is None:
+        raise RuntimeError("未安装 Pillow，无法输出 PNG")
+    s = supersample
+    image = Image.new('RGB', (width * s, height * s), '#ffffff')
+    draw = ImageDraw.Draw(image, 'RGBA')
+    fonts = {}
+    scaled = lambda points: [(x * s, y * s) for x, y in points]
+    for item in items:
+        kind = item[0]
+        if kind == "rect":
+            _, x, y, w, h, fill = item
+            if w > 0 and h > 0:
+                draw.rectangle([x * s, y * s, (x + w) * s, (y + h) * s], fill=_pil_color(fill))
+        elif kind == "line":
+            _, points, stroke, stroke_width = item
+            draw.line(scaled(points), fill=_pil_color(stroke), width=max(1, stroke_width * s))
+        elif kind == "polygon":
+            _, points, fill, stroke, stroke_width = item
+            if fill:
+                draw.polygon(scaled(points), fill=_pil_color(fill))
+            if stroke:
+                draw.line(scaled(points + points[:1]), fill=_pil_color(stroke), width=max(1, stroke_width * s))
+        elif kind == "circle":
+            _, cx, cy, r, fill = item
+            draw.ellipse([(cx - r) * s, (cy - r) * s, (cx + r) * s, (cy + r) * s], fill=_pil_color(fill))
+        elif kind == "wedge":
+            _, cx, cy, r, start, end, fill = item
+            draw.pieslice([(cx - r) * s, (cy - r) * s, (cx + r) * s, (cy + r) * s], start, end,
+                          fill=_pil_color(fill), outline='#ffffff')
+        elif kind == "text":
+            _, x, y, text, size, fill, anchor = item
+            font = fonts.get(size) or fonts.setdefault(size, _load_font(size * s, font_path))
+            text = str(text)
+            text_width = draw.textlength(text, font=font)
+            left = x * s - (text_width / 2 if anchor == 'middle' else text_width if anchor == 'end' else 0)
+            box = draw.textbbox((0, 0), text, font=font)
+            draw.text((left, y * s - (box[1] + box[3]) / 2), text, font=font, fill=_pil_color(fill))
+    if s > 1:
+        image = image.resize((width, height), Image.LANCZOS)
+    output = io.BytesIO()
+    image.save(output, format='PNG', optimize=True)
+    return output.getvalue()
+
+
+def render_chart(config, image_format=DEFAULT_FORMAT, width=DEFAULT_WIDTH, height=DEFAULT_HEIGHT, font_path=None):
+    """
+    渲染图表（在进程池中执行）
+    Returns:
+        bytes: SVG 或 PNG 内容
+    """
+    items = chart_primitives(config, width, height)
+    if image_format == 'png':
+        return render_png(items, width, height, font_path)
+    return render_svg(items, width, height)
+
+
+# ---------- 按内容哈希缓存 ----------
+
+def render_options():
+    """当前配置下的渲染参数"""
+    chart_config = logger_config.Config().get_chart()
+    image_format = str(chart_config.get('render_format', DEFAULT_FORMAT)).lower()
+    return {
+        "format": image_format if image_format in MEDIA_TYPES else DEFAULT_FORMAT,
+        "width": int(chart_config.get('width', DEFAULT_WIDTH)),
+        "height": int(chart_config.get('height', DEFAULT_HEIGHT)),
+        "font_path": chart_config.get('font_path') or None,
+        "cache_dir": _resolve(chart_config.get('cache_dir')),
+    }
+
+
+def _resolve(path):
+    if not path:
+        return DEFAULT_CACHE_DIR
+    return path if os.path.isabs(path) else os.path.join(BACK_END_DIR, path)
+
+
+def _atomic_write(path, content):
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temp_path, 'wb') as f:
+        f.write(content)
+    os.replace(temp_path, path)
+
+
+def save_chart_spec(config, options=None):
+    """
+    按内容哈希保存图表配置和尺寸（同一配置只写一次），返回哈希
+    哈希包含尺寸，配置的尺寸修改后生成新的地址，已发出的地址对应的内容不变
+    """
+    options = options or render_options()
+    spec = {"config": config, "width": options["width"], "height": options["height"]}
+    encoded = json.dumps(spec, ensure_ascii=False, sort_keys=True, separators=(',', ':')).encode('utf-8')
+    key = hashlib.sha256(encoded).hexdigest()[:32]
+    path, _ = sharded_path(options["cache_dir"], f"{key}.json")
+    if not os.path.exists(path):
+        _atomic_write(path, encoded)
+    return key
+
+
+def is_chart_key(key):
+    return bool(_KEY_PATTERN.match(key or ''))
+
+
+_flight = SingleFlight()
+
+
+async def rendered_chart_path(key, image_format):
+    """
+    已渲染的图表文件路径，首次请求时在进程池中渲染并缓存；图表不存在时返回 None
+    同一个图表的并发请求只渲染一次
+    """
+    options = render_options()
+    spec_path, _ = sharded_path(options["cache_dir"], f"{key}.json")
+    output_path, _ = sharded_path(options["cache_dir"], f"{key}.{image_format}")
+    if os.path.exists(output_path):
+        return output_path
+    if not os.path.exists(spec_path):
+        return None
+
+    async def render():
+        def load_and_render():
+            with open(spec_path, 'rb') as f:
+                spec = json.loads(f.read())
+            from image_preprocess import get_process_pool
+            content = get_process_pool().submit(
+                render_chart, spec["config"], image_format, spec["width"], spec["height"], options["font_path"]
+            ).result()
+            _atomic_write(output_path, content)
+        await run_blocking(load_and_render)
+        return output_path
+    return await _flight.do((key, image_format), render)
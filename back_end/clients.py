@@ -0,0 +1,272 @@
+# -*- coding: utf-8 -*-
+"""
+上游客户端注册表
+阿里云 imageprocess 客户端、oss2 Bucket、DeepSeek(OpenAI) 客户端和 NIM 的 requests 会话
+在应用启动时创建一次并在请求间复用，复用 keep-alive 连接池，避免每个请求重新建立 TCP/TLS 连接
+"""
+
+import json
+import logging
+import threading
+
+import logger_config
+import back_configuration as bc
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_POOL_SIZE = 16
+DEFAULT_WARM_UP_TIMEOUT = 5
+# 决定客户端如何创建的配置：只有这些配置变化时，配置热更新才重新创建注册表
+CLIENT_CONFIG_SECTIONS = ('skin_analysis_main_configuration', 'img_to_oss', 'skin_analysis', 'deepseek_api',
+                          'gemma3n_api', 'http_pool')
+# 被替换的注册表额外保留的时间（秒），之后关闭它的连接池
+RETIRE_MARGIN_SECONDS = 30
+# 导入较慢的上游 SDK，服务启动时不导入，由 preload_sdks 在后台导入
+PRELOAD_MODULES = (
+    'alibabacloud_imageprocess20200320.client',
+    'alibabacloud_imageprocess20200320.models',
+    'alibabacloud_tea_openapi.models',
+    'alibabacloud_tea_util.models',
+    'oss2',
+    'openai',
+    'requests',
+)
+
+
+def preload_sdks(modules=PRELOAD_MODULES):
+    """
+    在后台线程中导入上游 SDK（尽力而为，未安装的只记录日志）
+    Returns:
+        dict: 每个模块的导入耗时（毫秒）或失败原因
+    """
+    import importlib
+    import time
+    results = {}
+    for name in modules:
+        started = time.perf_counter()
+        try:
+            importlib.import_module(name)
+            results[name] = round((time.perf_counter() - started) * 1000, 1)
+        except Exception as e:
+            results[name] = f"failed: {e}"
+            logger.warning(f"导入 {name} 失败: {str(e)}")
+    logger.info(f"上游 SDK 导入完成: {results}")
+    return results
+
+
+class ClientRegistry:
+    """
+    按需创建并缓存各个上游客户端（线程安全）
+    Args:
+        pool_size (int): 每个上游的 keep-alive 连接池大小
+        connect_timeout (float): 建立连接的超时时间（秒）
+    """
+
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE, connect_timeout=None, config_version=0):
+        self.pool_size = pool_size
+        self.connect_timeout = connect_timeout
+        # 创建时的配置版本，配置热更新后会重新创建注册表
+        self.config_version = config_version
+        self._clients = {}
+        self._lock = threading.Lock()
+        # 由注册表自己创建的底层连接池，退出时需要关闭
+        self._oss_session = None
+        self._deepseek_http = None
+
+    def _get(self, name, factory):
+        client = self._clients.get(name)
+        if client is None:
+            with self._lock:
+                client = self._clients.get(name)
+                if client is None:
+                    client = factory()
+                    self._clients[name] = client
+        return client
+
+    def skin_client(self):
+        """阿里云 imageprocess 客户端（Tea SDK 内部按 host 复用连接池）"""
+        def factory():
+            from ALi_skin_model.skin_analysis import Sample
+            return Sample.create_client(bc.skin_analysis_configuration())
+        return self._get('skin', factory)
+
+    def oss_bucket(self):
+        """带连接池的 oss2 Bucket"""
+        def factory():
+            import oss2
+            access_key_id, access_key_secret, bucket_name, oss_endpoint = bc.img_to_oss_url()
+            self._oss_session = oss2.Session(pool_size=self.pool_size)
+            return oss2.Bucket(
+                oss2.Auth(access_key_id, access_key_secret),
+                oss_endpoint,
+                bucket_name,
+                session=self._oss_session,
+                connect_timeout=self.connect_timeout
+            )
+        return self._get('oss', factory)
+
+    def deepseek_client(self):
+        """DeepSeek 的 OpenAI 客户端，底层 httpx 连接池按配置设置大小"""
+        def factory():
+            import httpx
+            from openai import OpenAI, DefaultHttpxClient
+            api_key, base_url, _ = bc.deepseek_R1_instantiation()
+            self._deepseek_http = DefaultHttpxClient(
+                limits=httpx.Limits(
+                    max_connections=self.pool_size,
+                    max_keepalive_connections=self.pool_size
+                )
+            )
+            # 默认不在 SDK 内重试：DeepSeek 不健康时由熔断器快速失败，不让重试叠加排队
+            from resilience import upstream_options
+            max_retries = int(upstream_options('deepseek').get('max_retries', 0))
+            return OpenAI(api_key=api_key, base_url=base_url, http_client=self._deepseek_http,
+                          max_retries=max_retries)
+        return self._get('deepseek', factory)
+
+    def nim_session(self):
+        """NVIDIA NIM 的 requests 会话"""
+        def factory():
+            import requests
+            from requests.adapters import HTTPAdapter
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.pool_size)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            return session
+        return self._get('nim', factory)
+
+    def warm_up(self, timeout=DEFAULT_WARM_UP_TIMEOUT):
+        """
+        启动时预先建立到各个上游的连接（尽力而为，失败只记录日志）
+        Returns:
+            dict: 每个上游的预热结果
+        """
+        results = {}
+
+        def warm(name, func):
+            try:
+                func()
+                results[name] = "ok"
+            except Exception as e:
+                results[name] = f"failed: {e}"
+                logger.warning(f"预热 {name} 连接失败: {str(e)}")
+
+        def warm_oss():
+            from ALi_skin_model.img_to_oss import oss_object_url
+            _, _, bucket_name, oss_endpoint = bc.img_to_oss_url()
+            self.oss_bucket()
+            self._oss_session.session.head(oss_object_url(bucket_name, oss_endpoint, ''), timeout=timeout)
+
+        def warm_deepseek():
+            _, base_url, _ = bc.deepseek_R1_instantiation()
+            self.deepseek_client()
+            self._deepseek_http.head(base_url, timeout=timeout)
+
+        def warm_nim():
+            _, invoke_url, _, _ = bc.skin_data_visualization()
+            if invoke_url:
+                self.nim_session().head(invoke_url, timeout=timeout)
+
+        warm('skin', self.skin_client)
+        warm('oss', warm_oss)
+        warm('deepseek', warm_deepseek)
+        warm('nim', warm_nim)
+        logger.info(f"上游连接预热完成: {results}")
+        return results
+
+    def close(self):
+        """关闭所有连接池"""
+        with self._lock:
+            resources = {
+                'oss': self._oss_session.session if self._oss_session else None,
+                'deepseek': self._deepseek_http,
+                'nim': self._clients.get('nim'),
+            }
+            self._clients = {}
+            self._oss_session = self._deepseek_http = None
+        for name, resource in resources.items():
+            if resource is None:
+                continue
+            try:
+                resource.close()
+            except Exception as e:
+                logger.warning(f"关闭 {name} 连接池失败: {str(e)}")
+
+
+_registry = None
+_registry_settings = None
+_registry_lock = threading.Lock()
+# 被替换、等待关闭的注册表 -> 关闭它的定时器
+_retired = {}
+
+
+def client_settings(snapshot):
+    """配置中决定客户端如何创建的部分（密钥、endpoint、连接池大小、DeepSeek 的重试次数）"""
+    settings = {name: snapshot.section(name) for name in CLIENT_CONFIG_SECTIONS}
+    upstreams = snapshot.section('resilience').get('upstreams') or {}
+    settings['deepseek_max_retries'] = (upstreams.get('deepseek') or {}).get('max_retries')
+    return json.dumps(logger_config.thaw(settings), sort_keys=True, default=str)
+
+
+def _retire(registry):
+    """
+    被替换的注册表可能仍被进行中的请求使用，过了请求可能持续的最长时间再关闭连接池：
+    流式响应在处理函数返回后重新计算截止时间，所以按两倍的 resilience.request_deadline 计算
+    """
+    from resilience import request_deadline
+    timer = threading.Timer(2 * request_deadline() + RETIRE_MARGIN_SECONDS, _close_retired, args=(registry,))
+    timer.daemon = True
+    _retired[registry] = timer
+    timer.start()
+
+
+def _close_retired(registry):
+    with _registry_lock:
+        if _retired.pop(registry, None) is None:
+            return
+    registry.close()
+
+
+def get_client_registry():
+    """
+    获取全局客户端注册表（按配置创建）
+    配置热更新后，密钥、endpoint 等客户端配置有变化时创建新的注册表，没有变化时继续使用原来的连接池；
+    旧注册表可能仍被进行中的请求使用，等这些请求结束后再关闭（见 _retire）
+    """
+    global _registry, _registry_settings
+    snapshot = logger_config.get_config()
+    registry = _registry
+    if registry is None or registry.config_version != snapshot.version:
+        with _registry_lock:
+            if _registry is None or _registry.config_version != snapshot.version:
+                settings = client_settings(snapshot)
+                if _registry is not None and settings == _registry_settings:
+                    _registry.config_version = snapshot.version
+                else:
+                    if _registry is not None:
+                        _retire(_registry)
+                    pool_config = snapshot.section('http_pool')
+                    _registry = ClientRegistry(
+                        pool_size=int(pool_config.get('pool_size', DEFAULT_POOL_SIZE)),
+                        connect_timeout=pool_config.get('connect_timeout'),
+                        config_version=snapshot.version
+                    )
+                    _registry_settings = settings
+            registry = _registry
+    return registry
+
+
+def close_client_registry():
+    """关闭全局客户端注册表和等待关闭的旧注册表（应用退出时调用）"""
+    global _registry, _registry_settings
+    with _registry_lock:
+        registries = list(_retired)
+        for timer in _retired.values():
+            timer.cancel()
+        _retired.clear()
+        if _registry is not None:
+            registries.append(_registry)
+            _registry = _registry_settings = None
+    for registry in registries:
+        registry.close()
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""
+并发执行模块
+阿里云SDK、oss2 和 DeepSeek 流式调用都是同步阻塞的，
+统一放到一个有界线程池中执行，避免阻塞 FastAPI 的事件循环
+"""
+
+import asyncio
+import contextvars
+import functools
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import logger_config
+
+DEFAULT_MAX_WORKERS = 16
+DEFAULT_PART_WORKERS = 16
+# serve.py 以多个工作进程运行服务时设置：工作进程总数和当前进程的编号（从 0 开始）
+WORKERS_ENV = 'SKIN_ANALYSIS_WORKERS'
+WORKER_ID_ENV = 'SKIN_ANALYSIS_WORKER_ID'
+
+_executor = None
+_part_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """获取全局线程池（首次调用时按配置创建）"""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                concurrency = logger_config.Config().get_concurrency()
+                max_workers = int(concurrency.get('max_workers') or DEFAULT_MAX_WORKERS)
+                _executor = ThreadPoolExecutor(
+                    max_workers=max_workers,
+                    thread_name_prefix='upstream'
+                )
+    return _executor
+
+
+def get_part_executor():
+    """
+    获取OSS分片上传的线程池（首次调用时按 upload.multipart.pool_size 创建）
+    分片由已经在全局线程池中执行的上传任务提交，使用单独的线程池，避免全局线程池被等待分片的任务占满
+    """
+    global _part_executor
+    if _part_executor is None:
+        with _executor_lock:
+            if _part_executor is None:
+                multipart = logger_config.Config().get_upload().get('multipart') or {}
+                _part_executor = ThreadPoolExecutor(
+                    max_workers=int(multipart.get('pool_size') or DEFAULT_PART_WORKERS),
+                    thread_name_prefix='oss-part'
+                )
+    return _part_executor
+
+
+async def run_blocking(func, *args, **kwargs):
+    """
+    在线程池中执行阻塞函数，并在事件循环中等待其结果
+    函数在调用方的 contextvars 上下文中执行（可以读到请求的截止时间，见 resilience）
+    Args:
+        func: 同步函数
+        *args, **kwargs: 传给 func 的参数
+
+    Returns:
+        func 的返回值
+    """
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(get_executor(), functools.partial(context.run, func, *args, **kwargs))
+
+
+def submit_blocking(func, *args, **kwargs):
+    """
+    把阻塞函数提交到全局线程池（在调用方的 contextvars 上下文中执行），返回 concurrent.futures.Future
+    需要知道线程中的调用何时真正结束时使用：等待它的协程被取消后，已经开始的调用仍在线程中继续执行
+    """
+    context = contextvars.copy_context()
+    return get_executor().submit(context.run, func, *args, **kwargs)
+
+
+def shutdown_executor(wait=True):
+    """关闭全局线程池和分片上传线程池（应用退出时调用）"""
+    global _executor, _part_executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=wait)
+            _executor = None
+        if _part_executor is not None:
+            _part_executor.shutdown(wait=wait)
+            _part_executor = None
+
+
+def worker_count():
+    """服务的工作进程数（单进程运行时为 1）"""
+    try:
+        return max(1, int(os.environ.get(WORKERS_ENV) or 1))
+    except ValueError:
+        return 1
+
+
+def worker_id():
+    """当前工作进程的编号，不是由 serve.py 启动的工作进程时为 None"""
+    value = os.environ.get(WORKER_ID_ENV)
+    return int(value) if value and value.isdigit() else None
+
+
+def is_primary_worker():
+    """是否负责全局的后台任务（如临时目录清理）：单进程运行时，或 0 号工作进程"""
+    return worker_id() in (None, 0)
+
+
+def pid_alive(pid):
+    """本机上进程号为 pid 的进程是否仍在运行"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        # 没有权限向该进程发信号，说明进程存在
+        return True
+    return True
@@ -1,123 +1,306 @@
 # -*- coding: utf-8 -*-
 """
 日志管理模块
-自动创建按日期命名的日志文件，收集运行过程中的错误信息
+整个服务（包括 main.py、uvicorn 和各模块的 logging.getLogger）共用一个日志后端：
+调用方只把日志记录放入队列（微秒级，不做格式化和磁盘I/O，不会阻塞事件循环），
+由一个后台线程统一格式化，写入 JSON Lines 日志文件和控制台；
+日志文件按天和大小轮转，轮转后的旧文件以 gzip 压缩，超过保留天数的删除
 """
 
+import atexit
+import functools
+import glob
+import gzip
 import logging
 import os
+import queue
+import shutil
 import sys
+import threading
+import time
 from datetime import datetime
-from logging.handlers import RotatingFileHandler
-import traceback
-import functools
+from logging.handlers import QueueHandler, QueueListener
+
+import json_codec
+import logger_config
+from concurrency import worker_id
+from metrics import LOG_RECORDS_DROPPED
+
+BACK_END_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_LOG_DIR = os.path.join(BACK_END_DIR, 'logger_log')
+DEFAULT_FILE_NAME = 'app.log'
+DEFAULT_MAX_BYTES = 10 * 1024 * 1024
+DEFAULT_BACKUP_DAYS = 14
+DEFAULT_QUEUE_SIZE = 10000
+# 队列已满时 WARNING 及以上的日志等待后台线程腾出空间的最长时间（秒），超时后仍然放入队列
+FULL_QUEUE_WAIT_SECONDS = 0.5
+TEXT_FORMAT = '%(asctime)s - %(levelname)s - %(module)s:%(funcName)s:%(lineno)d - %(message)s'
+
+# LogRecord 自带的属性，其余属性（logger.info(..., extra={...}) 传入的）作为结构化字段写入日志
+_RECORD_ATTRS = frozenset(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime'}
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """每条日志一行 JSON：时间、级别、来源、消息、异常堆栈和 extra 中的字段"""
+
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            "level": record.levelname,
+            "logger": record.name,
+            "module": record.module,
+            "func": record.funcName,
+            "line": record.lineno,
+            "thread": record.threadName,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        if record.stack_info:
+            entry["stack_info"] = record.stack_info
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and key not in entry:
+                entry[key] = value
+        try:
+            return json_codec.dumps_str(entry)
+        except TypeError:
+            return json_codec.dumps_str({k: v if isinstance(v, (str, int, float, bool, type(None))) else repr(v)
+                                         for k, v in entry.items()})
+
+
+class CompressingRotatingFileHandler(logging.Handler):
+    """
+    按天和大小轮转的日志文件（只在后台线程中写入）
+    当前文件为 app.log；跨天或超过 max_bytes 时改名为 app.YYYY-MM-DD.N.log 并压缩为 .gz，
+    超过 backup_days 天的旧文件删除
+    """
+
+    def __init__(self, filename, max_bytes=DEFAULT_MAX_BYTES, backup_days=DEFAULT_BACKUP_DAYS, compress=True):
+        super().__init__()
+        self.filename = os.path.abspath(filename)
+        self.max_bytes = max_bytes
+        self.backup_days = backup_days
+        self.compress = compress
+        os.makedirs(os.path.dirname(self.filename), exist_ok=True)
+        self._open()
+
+    def _open(self):
+        self.stream = open(self.filename, 'a', encoding='utf-8')
+        self._size = self.stream.tell()
+        # 当前文件属于哪一天（沿用已有文件时以其修改时间为准）
+        started = os.path.getmtime(self.filename) if self._size else time.time()
+        self._day = time.strftime('%Y-%m-%d', time.localtime(started))
+        self._next_day_at = _next_midnight(started)
+
+    def emit(self, record):
+        try:
+            if self.stream is None:
+                # 已被 close()（例如其他代码调用了 logging.config.dictConfig），后台线程还有日志要写时重新打开
+                self._open()
+            line = self.format(record) + '\n'
+            size = len(line.encode('utf-8'))
+            if record.created >= self._next_day_at or (self.max_bytes and self._size and self._size + size > self.max_bytes):
+                self.rollover()
+            self.stream.write(line)
+            self._size += size
+        except Exception:
+            self.handleError(record)
+
+    def flush(self):
+        if self.stream is not None and not self.stream.closed:
+            self.stream.flush()
+
+    def rollover(self):
+        self.stream.close()
+        stem, ext = os.path.splitext(self.filename)
+        index = 1
+        while glob.glob(f"{stem}.{self._day}.{index}{ext}*"):
+            index += 1
+        rotated = f"{stem}.{self._day}.{index}{ext}"
+        os.replace(self.filename, rotated)
+        if self.compress:
+            with open(rotated, 'rb') as source, gzip.open(f"{rotated}.gz", 'wb') as target:
+                shutil.copyfileobj(source, target)
+            os.remove(rotated)
+        self._remove_expired(stem, ext)
+        self._open()
+
+    def _remove_expired(self, stem, ext):
+        if not self.backup_days:
+            return
+        cutoff = time.time() - self.backup_days * 86400
+        for path in glob.glob(f"{stem}.*{ext}*"):
+            try:
+                if path != self.filename and os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    def close(self):
+        self.acquire()
+        try:
+            if self.stream is not None:
+                self.stream.close()
+                self.stream = None
+        finally:
+            self.release()
+        super().close()
+
+
+def _next_midnight(timestamp):
+    day = datetime.fromtimestamp(timestamp).replace(hour=0, minute=0, second=0, microsecond=0)
+    return day.timestamp() + 86400
+
+
+class _EnqueueHandler(QueueHandler):
+    """
+    只在调用方合并消息参数后放入队列；队列满时丢弃 WARNING 以下的日志并计数（/metrics 的 skin_log_records_dropped_total），
+    WARNING 及以上的日志不丢弃：短暂等待后台线程腾出空间
+    """
+
+    def __init__(self, log_queue, max_size):
+        super().__init__(log_queue)
+        self.max_size = max_size
+        self.dropped = 0
+
+    def prepare(self, record):
+        # 参数对象之后可能被调用方修改，在这里先合并成字符串；时间格式化、JSON 编码和异常堆栈都在后台线程
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        # SimpleQueue 的 put 不加 Python 层的锁，长度上限按 qsize 近似判断
+        if self.queue.qsize() >= self.max_size:
+            if record.levelno < logging.WARNING:
+                self.dropped += 1
+                LOG_RECORDS_DROPPED.labels(record.levelname).inc()
+                return
+            deadline = time.monotonic() + FULL_QUEUE_WAIT_SECONDS
+            while self.queue.qsize() >= self.max_size and time.monotonic() < deadline:
+                time.sleep(0.001)
+        self.queue.put_nowait(record)
+
+
+class _Listener(QueueListener):
+    """后台写日志的线程：队列暂时为空时才刷新文件，连续的日志合并写入"""
+
+    def handle(self, record):
+        super().handle(record)
+        if self.queue.empty():
+            for handler in self.handlers:
+                handler.flush()
+
+
+_listener = None
+_enqueue_handler = None
+_setup_lock = threading.Lock()
+
+
+def setup_logging(log_dir=None):
+    """
+    为根日志记录器安装队列日志后端（只执行一次，重复调用直接返回）
+    配置见 config.yaml 的 logging 部分
+    """
+    global _listener, _enqueue_handler
+    with _setup_lock:
+        if _listener is not None:
+            return
+        try:
+            config = logger_config.Config().get_logging()
+        except Exception:  # 配置文件不存在时使用默认值
+            config = {}
+        level = getattr(logging, str(config.get('level', 'INFO')).upper(), logging.INFO)
+        log_dir = log_dir or config.get('dir') or DEFAULT_LOG_DIR
+        if not os.path.isabs(log_dir):
+            log_dir = os.path.join(BACK_END_DIR, log_dir)
+
+        file_name = config.get('file_name') or DEFAULT_FILE_NAME
+        if worker_id() is not None:
+            # 多进程运行时每个工作进程写各自的文件（app.worker0.log），避免多个进程同时轮转同一个文件
+            stem, ext = os.path.splitext(file_name)
+            file_name = f"{stem}.worker{worker_id()}{ext}"
+
+        handlers = []
+        file_handler = CompressingRotatingFileHandler(
+            os.path.join(log_dir, file_name),
+            max_bytes=int(config.get('max_bytes', DEFAULT_MAX_BYTES)),
+            backup_days=int(config.get('backup_days', DEFAULT_BACKUP_DAYS)),
+            compress=config.get('compress', True)
+        )
+        file_handler.setFormatter(JsonLinesFormatter() if config.get('json', True)
+                                  else logging.Formatter(TEXT_FORMAT, datefmt='%Y-%m-%d %H:%M:%S'))
+        handlers.append(file_handler)
+        if config.get('console', True):
+            console_handler = logging.StreamHandler(sys.stdout)
+            console_handler.setFormatter(logging.Formatter(TEXT_FORMAT, datefmt='%Y-%m-%d %H:%M:%S'))
+            handlers.append(console_handler)
+
+        log_queue = queue.SimpleQueue()
+        _enqueue_handler = _EnqueueHandler(log_queue, int(config.get('queue_size', DEFAULT_QUEUE_SIZE)))
+        root = logging.getLogger()
+        for handler in root.handlers[:]:
+            root.removeHandler(handler)
+        root.addHandler(_enqueue_handler)
+        root.setLevel(level)
+        _listener = _Listener(log_queue, *handlers, respect_handler_level=True)
+        _listener.start()
+        atexit.register(shutdown_logging)
+
+
+def shutdown_logging():
+    """写完队列中剩余的日志并关闭日志文件"""
+    global _listener
+    with _setup_lock:
+        if _listener is None:
+            return
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+        logging.getLogger().removeHandler(_enqueue_handler)
+
+
+def dropped_records():
+    """队列已满被丢弃的日志条数（WARNING 以下）"""
+    return _enqueue_handler.dropped if _enqueue_handler is not None else 0
+
 
 class DailyLogger:
-    """按日期管理的日志记录器"""
-    
-    def __init__(self, log_dir="logger_log"):
+    """
+    兼容原来接口的日志记录器（info/warning/error/exception/debug），
+    写入统一的日志后端（首次使用时安装），不再在每次调用时检查日期、也不再每天创建新的 logger
+    """
+
+    def __init__(self, log_dir=None):
         self.log_dir = log_dir
-        self.current_date = None
-        self.logger = None
-        self._ensure_log_dir()
-        self._setup_logger()
-    
-    def _ensure_log_dir(self):
-        """确保日志目录存在"""
-        if not os.path.exists(self.log_dir):
-            os.makedirs(self.log_dir)
-            print(f"[日志] 创建日志目录: {self.log_dir}")
-    
-    def _get_current_date(self):
-        """获取当前日期字符串 YYYY-M-D 格式"""
-        now = datetime.now()
-        return f"{now.year}-{now.month}-{now.day}"
-    
-    def _get_log_filename(self, date_str):
-        """获取日志文件名"""
-        return os.path.join(self.log_dir, f"{date_str}.log")
-    
-    def _setup_logger(self):
-        """设置日志记录器"""
-        current_date = self._get_current_date()
-        
-        # 如果日期变化，重新设置logger
-        if self.current_date != current_date:
-            self.current_date = current_date
-            
-            # 创建新的logger
-            logger_name = f"daily_logger_{current_date}"
-            self.logger = logging.getLogger(logger_name)
-            
-            # 清除之前的handlers
-            for handler in self.logger.handlers[:]:
-                self.logger.removeHandler(handler)
-            
-            self.logger.setLevel(logging.DEBUG)
-            
-            # 文件处理器
-            log_filename = self._get_log_filename(current_date)
-            file_handler = RotatingFileHandler(
-                log_filename, 
-                maxBytes=10*1024*1024,  # 10MB
-                backupCount=5,
-                encoding='utf-8'
-            )
-            
-            # 控制台处理器
-            console_handler = logging.StreamHandler(sys.stdout)
-            
-            # 设置格式
-            formatter = logging.Formatter(
-                '%(asctime)s - %(levelname)s - %(module)s:%(funcName)s:%(lineno)d - %(message)s',
-                datefmt='%Y-%m-%d %H:%M:%S'
-            )
-            
-            file_handler.setFormatter(formatter)
-            console_handler.setFormatter(formatter)
-            
-            # 添加处理器
-            self.logger.addHandler(file_handler)
-            self.logger.addHandler(console_handler)
-            
-            # 防止重复日志
-            self.logger.propagate = False
-            
-            print(f"[日志] 日志文件: {log_filename}")
-    
-    def _check_date_change(self):
-        """检查日期是否变化，如果变化则重新设置logger"""
-        current_date = self._get_current_date()
-        if self.current_date != current_date:
-            self._setup_logger()
-    
+        self._logger = logging.getLogger('daily_logger')
+
+    @property
+    def logger(self):
+        if _listener is None:
+            setup_logging(self.log_dir)
+        return self._logger
+
     def info(self, message):
         """记录信息日志"""
-        self._check_date_change()
-        self.logger.info(message)
-    
+        self.logger.info(message, stacklevel=2)
+
     def warning(self, message):
         """记录警告日志"""
-        self._check_date_change()
-        self.logger.warning(message)
-    
+        self.logger.warning(message, stacklevel=2)
+
     def error(self, message, exc_info=None):
         """记录错误日志"""
-        self._check_date_change()
-        if exc_info:
-            self.logger.error(message, exc_info=exc_info)
-        else:
-            self.logger.error(message)
-    
+        self.logger.error(message, exc_info=exc_info, stacklevel=2)
+
     def exception(self, message):
         """记录异常日志（自动包含堆栈信息）"""
-        self._check_date_change()
-        self.logger.exception(message)
-    
+        self.logger.exception(message, stacklevel=2)
+
     def debug(self, message):
         """记录调试日志"""
-        self._check_date_change()
-        self.logger.debug(message)
+        self.logger.debug(message, stacklevel=2)
 
 # 全局日志实例
 daily_logger = DailyLogger()
@@ -147,36 +330,36 @@ def log_function_call(func):
             raise
     return wrapper
 
-# 便捷函数
+# 便捷函数（stacklevel 指向调用便捷函数的位置）
 def log_info(message):
     """记录信息日志"""
-    daily_logger.info(message)
+    daily_logger.logger.info(message, stacklevel=2)
 
 def log_warning(message):
     """记录警告日志"""
-    daily_logger.warning(message)
+    daily_logger.logger.warning(message, stacklevel=2)
 
 def log_error(message, exc_info=None):
     """记录错误日志"""
-    daily_logger.error(message, exc_info=exc_info)
+    daily_logger.logger.error(message, exc_info=exc_info, stacklevel=2)
 
 def log_exception(message):
     """记录异常日志"""
-    daily_logger.exception(message)
+    daily_logger.logger.exception(message, stacklevel=2)
 
 def log_debug(message):
     """记录调试日志"""
-    daily_logger.debug(message)
+    daily_logger.logger.debug(message, stacklevel=2)
 
 if __name__ == "__main__":
     # 测试日志功能
     log_info("日志系统启动")
     log_debug("这是一个调试信息")
     log_warning("这是一个警告信息")
-    
+
     try:
         1 / 0
-    except Exception as e:
+    except Exception:
         log_exception("测试异常捕获")
-    
+
     log_info("日志系统测试完成")
@@ -1,71 +1,71 @@
-import re, sys, json, urllib.parse, requests
+import sys, json, urllib.parse, requests
 from skin_analysis import Sample
 import back_configuration as bc
+from skin_payload import llm_payload
+from json_stream import JsonObjectExtractor
+from metrics import LLMStreamMeter
+from resilience import check_deadline, deadline, guard, upstream_timeout
 
 sys.stdout.reconfigure(encoding='utf-8')
 
-def clean_json_string(json_str):
-    """清理JSON字符串，处理重复键等问题"""
-    try:
-        # 处理重复的plugins键问题
-        # 使用正则表达式找到并移除重复的plugins块
-
-        # 首先找到第一个plugins块的位置
-        first_plugins_match = re.search(r'"plugins"\s*:\s*\{', json_str)
-        if not first_plugins_match:
-            return json_str
-
-        # 找到第二个plugins块并移除它
-        # 查找第二个plugins出现的位置
-        second_plugins_start = json_str.find('"plugins"', first_plugins_match.end())
-        if second_plugins_start == -1:
-            return json_str  # 没有重复的plugins
-
-        # 找到第二个plugins块的结束位置
-        # 需要匹配对应的大括号
-        brace_count = 0
-        i = second_plugins_start
-        while i < len(json_str):
-            if json_str[i] == '{':
-                brace_count += 1
-            elif json_str[i] == '}':
-                brace_count -= 1
-                if brace_count == 0:
-                    # 找到了匹配的结束大括号
-                    # 移除整个第二个plugins块（包括前面的逗号）
-                    before_second_plugins = json_str[:second_plugins_start].rstrip()
-                    if before_second_plugins.endswith(','):
-                        before_second_plugins = before_second_plugins[:-1]
-
-                    after_second_plugins = json_str[i+1:]
-
-                    cleaned = before_second_plugins + after_second_plugins
-                    return cleaned
-            i += 1
-
-        # 如果没有找到匹配的结束大括号，返回原始字符串
-        return json_str
-
-    except Exception as e:
-        # 如果清理失败，返回原始字符串
-        return json_str
-
-def get_chart_config_from_nim(data, api_key, invoke_url, model_name, max_tokens):
-    """
-    用 NVIDIA NIM 的 google/gemma-3n-e4b-it 模型生成 Chart.js 配置
-    """
-    prompt = f"""
+def chart_prompt(payload):
+    """生成图表配置的提示词，payload 为已编码的皮肤数据字符串"""
+    return f"""
 你是一个专业数据可视化专家。请根据以下数据内容，分析其数据特征（如类别数量、数值分布、对比关系等），
 推荐最适合的可视化图表类型（如雷达图、柱状图、饼图等），并自动选择合适的配色和对比度，使不同类别对比清晰。
 最后只输出适用于 Chart.js 的 config JSON（不要输出任何解释说明），config 要包含合适的 type、labels、datasets、options（如颜色、标题、legend等）。
-数据：{json.dumps(data, ensure_ascii=False, indent=2)}
+数据：{payload}
 """
-    stream = False
+
+def iter_content_deltas(response, meter=None):
+    """
+    逐段产出 NIM 流式响应（OpenAI 兼容的 SSE）中的输出内容；
+    服务端没有按流式返回（application/json）时产出完整的输出
+    meter: LLMStreamMeter，记录首个 token 时间和 token 用量
+    """
+    if response.headers.get('Content-Type', '').startswith('application/json'):
+        result = response.json()
+        if "choices" not in result or not result["choices"]:
+            raise Exception("API 响应中缺少 choices 字段")
+        if meter is not None:
+            meter.delta()
+            usage = result.get("usage") or {}
+            meter.usage(usage.get("prompt_tokens"), usage.get("completion_tokens"))
+        yield result["choices"][0]["message"]["content"] or ""
+        return
+    # 按字节读取行再以 UTF-8 解码（text/event-stream 没有声明字符集时 requests 会按 ISO-8859-1 解码）
+    for line in response.iter_lines():
+        if not line.startswith(b'data:'):
+            continue
+        data = line[5:].strip()
+        if data == b'[DONE]':
+            return
+        chunk = json.loads(data)
+        usage = chunk.get("usage")
+        if meter is not None and usage:
+            meter.usage(usage.get("prompt_tokens"), usage.get("completion_tokens"))
+        for choice in chunk.get("choices") or []:
+            content = (choice.get("delta") or {}).get("content")
+            if content:
+                if meter is not None:
+                    meter.delta()
+                yield content
+
+def get_chart_config_from_nim(data, api_key, invoke_url, model_name, max_tokens, session=None):
+    """
+    用 NVIDIA NIM 的 google/gemma-3n-e4b-it 模型生成 Chart.js 配置
+    data: 皮肤分析结果（SkinAnalysisResult、dict 或 JSON 字符串），按 llm_payload 配置裁剪后写入提示词
+    session: 复用的 requests.Session（带连接池），为None时使用一次性连接
+    以流式读取输出，配置的 JSON 对象一闭合就停止读取（关闭连接，不再等待后面的说明文字）
+    整个调用不超过 resilience.upstreams.nim.timeout 和请求剩余的时间，经过 NIM 的熔断器
+    """
+    prompt = chart_prompt(llm_payload(data))
+    stream = True
 
     # 添加更详细的 headers
     headers = {
         "Authorization": f"Bearer {api_key}",
-        "Accept": "application/json",
+        "Accept": "text/event-stream",
         "Content-Type": "application/json"
     }
 
@@ -80,36 +80,32 @@ def get_chart_config_from_nim(data, api_key, invoke_url, model_name, max_tokens)
         "stream": stream
     }
 
+    timeout = upstream_timeout('nim')
+    meter = LLMStreamMeter('nim')
     try:
-        response = requests.post(invoke_url, headers=headers, json=payload, timeout=30)
-        response.raise_for_status()  # 检查 HTTP 错误
-        
-        if not response.text:
-            raise Exception("API 返回空响应")
-            
-        result = response.json()
-        
-        # 添加更多的错误检查
-        if "choices" not in result or not result["choices"]:
-            raise Exception("API 响应中缺少 choices 字段")
-            
-        # 取出大模型返回的内容
-        content = result["choices"][0]["message"]["content"]
-
-        # 提取 config JSON，兼容多种输出格式
-        match = re.search(r"```json\s*(\{.*?\})\s*```", content, re.DOTALL)
-        if match:
-            config_str = match.group(1)
-        else:
-            match = re.search(r"(\{.*\})", content, re.DOTALL)
-            if match:
-                config_str = match.group(1)
-            else:
-                raise ValueError("未能从大模型输出中提取到合法的 JSON 配置！原始内容：" + content)
-                
-        # 清理JSON字符串，处理重复键等问题
-        config_str = clean_json_string(config_str)
-        config = json.loads(config_str)
+        try:
+            with guard('nim'), deadline(timeout):
+                response = (session or requests).post(invoke_url, headers=headers, json=payload,
+                                                      timeout=(min(timeout, 10), timeout), stream=True)
+                with response:
+                    response.raise_for_status()  # 检查 HTTP 错误
+
+                    # 提取 config JSON（兼容代码块和前后的说明文字），同时修复重复键、多余逗号等问题
+                    extractor = JsonObjectExtractor()
+                    received = 0
+                    for delta in iter_content_deltas(response, meter):
+                        check_deadline("NIM 生成图表配置")
+                        received += len(delta)
+                        if extractor.feed(delta) is not None:
+                            break
+
+            if not received:
+                raise Exception("API 返回空响应")
+            config = extractor.finish()
+        except Exception as e:
+            meter.finish(e)
+            raise
+        meter.finish()
         return config
         
     except requests.exceptions.RequestException as e:
@@ -120,16 +116,13 @@ def get_chart_config_from_nim(data, api_key, invoke_url, model_name, max_tokens)
         except:
             print(f"网络请求错误: {str(e)}")
         raise
-    except json.JSONDecodeError as e:
+    except ValueError as e:
+        # 流式响应中的 JSON 解析错误，或输出中没有完整的配置
         try:
             from daily_logger import log_error
             log_error(f"Gemma3n JSON解析错误: {str(e)}")
-            if 'response' in locals() and hasattr(response, 'text'):
-                log_error(f"Gemma3n API响应: {response.text}")
         except:
             print(f"JSON 解析错误: {str(e)}")
-            if 'response' in locals() and hasattr(response, 'text'):
-                print(f"API 响应: {response.text}")
         raise
     except Exception as e:
         try:
@@ -146,9 +139,9 @@ def generate_quickchart_url(config):
     return chart_url
 
 #=========结果分析==========
-def gemma3n_skin_quickchartURL(data, api_key, invoke_url, model_name, max_tokens): 
+def gemma3n_skin_quickchartURL(data, api_key, invoke_url, model_name, max_tokens, session=None): 
     # 1. 让 NIM 生成 config
-    config = get_chart_config_from_nim(data, api_key, invoke_url, model_name, max_tokens)
+    config = get_chart_config_from_nim(data, api_key, invoke_url, model_name, max_tokens, session=session)
     # 2. 生成 quickchart URL
     chart_url = generate_quickchart_url(config)
     return chart_url, config
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""
+上传前的图片规范化
+手机照片通常 5~12MB，原样上传到OSS后，皮肤分析接口还要再从OSS把整张图下载一遍。
+这里在上传前按配置：按 EXIF 方向旋正、限制最长边、重新编码为 JPEG/WebP 并去掉元数据（包括GPS等隐私信息）。
+解码和编码是CPU密集的操作，在独立的进程池中执行，不占用事件循环和上游调用的线程池
+"""
+
+import io
+import logging
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import logger_config
+
+logger = logging.getLogger(__name__)
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow 未安装时跳过预处理
+    Image = ImageOps = None
+
+DEFAULT_MAX_EDGE = 2048
+DEFAULT_FORMAT = 'JPEG'
+DEFAULT_QUALITY = 85
+DEFAULT_WORKERS = 2
+FORMAT_EXTENSIONS = {'JPEG': '.jpg', 'WEBP': '.webp'}
+
+
+def normalize_image(content, max_edge=DEFAULT_MAX_EDGE, image_format=DEFAULT_FORMAT, quality=DEFAULT_QUALITY):
+    """
+    规范化一张图片（在进程池中执行）
+    Args:
+        content (bytes): 原始图片内容
+        max_edge (int): 最长边上限（像素），为 0 表示不缩放；
+            JPEG 会在解码时直接缩小，缩放后的最长边在上限的 3/4 到上限之间
+        image_format (str): 输出格式，JPEG 或 WEBP
+        quality (int): 编码质量
+
+    Returns:
+        tuple: (新的图片内容, 处理信息 dict)
+    """
+    started = time.perf_counter()
+    image_format = image_format.upper()
+    with Image.open(io.BytesIO(content)) as image:
+        original_size = image.size
+        if max_edge and max(original_size) > max_edge:
+            if image.format == 'JPEG':
+                # 让 JPEG 解码器直接按 1/2、1/4、1/8 缩小解码，省去大部分解码和缩放的时间和内存
+                scale = max_edge * 3 / 4 / max(original_size)
+                image.draft('RGB', (int(original_size[0] * scale), int(original_size[1] * scale)))
+            image.thumbnail((max_edge, max_edge), Image.LANCZOS)
+        # 按 EXIF 方向旋正（在缩小后的图上进行），之后不再需要 EXIF
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+
+        output = io.BytesIO()
+        # 不传 exif/icc_profile 等参数，输出中不包含任何元数据
+        save_options = {'quality': quality}
+        if image_format == 'JPEG':
+            save_options.update(optimize=True, progressive=True)
+        image.save(output, format=image_format, **save_options)
+
+    data = output.getvalue()
+    return data, {
+        "original_bytes": len(content),
+        "bytes": len(data),
+        "original_size": list(original_size),
+        "size": list(image.size),
+        "format": image_format,
+        "duration_ms": round((time.perf_counter() - started) * 1000, 1),
+    }
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_process_pool():
+    """获取图片处理进程池（上传前的预处理和图表渲染共用，按配置的 workers 创建）"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                workers = int(logger_config.Config().get_image_preprocess().get('workers', DEFAULT_WORKERS))
+                # 服务进程中已经有很多线程，不直接 fork，避免子进程继承被占用的锁；
+                # forkserver 预先导入本模块(和 Pillow)，新的工作进程启动更快，Windows 上只能用 spawn
+                if 'forkserver' in multiprocessing.get_all_start_methods():
+                    context = multiprocessing.get_context('forkserver')
+                    context.set_forkserver_preload([__name__])
+                else:
+                    context = multiprocessing.get_context('spawn')
+                _pool = ProcessPoolExecutor(max_workers=workers, mp_context=context)
+    return _pool
+
+
+def shutdown_process_pool():
+    """关闭预处理进程池（应用退出时调用）"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(cancel_futures=True)
+            _pool = None
+
+
+def preprocess_options():
+    """
+    当前配置下的预处理参数，未启用或 Pillow 不可用时返回 None
+    Returns:
+        dict: normalize_image 的关键字参数
+    """
+    config = logger_config.Config().get_image_preprocess()
+    if not config.get('enabled', True):
+        return None
+    if Image is None:
+        logger.warning("未安装 Pillow，跳过图片预处理")
+        return None
+    image_format = str(config.get('format', DEFAULT_FORMAT)).upper()
+    if image_format not in FORMAT_EXTENSIONS:
+        logger.warning(f"不支持的预处理输出格式 {image_format}，使用 {DEFAULT_FORMAT}")
+        image_format = DEFAULT_FORMAT
+    return {
+        "max_edge": int(config.get('max_edge', DEFAULT_MAX_EDGE)),
+        "image_format": image_format,
+        "quality": int(config.get('quality', DEFAULT_QUALITY)),
+    }
+
+
+def normalize_in_pool(content, options):
+    """
+    在进程池中规范化图片（同步等待结果，在线程池中调用）
+    图片无法解码时返回原始内容，交给下游接口处理
+    Returns:
+        tuple: (图片内容, 新的扩展名或 None, 处理信息 dict 或 None)
+    """
+    try:
+        data, info = get_process_pool().submit(normalize_image, content, **options).result()
+    except Exception as e:
+        logger.warning(f"图片预处理失败，上传原图: {str(e)}")
+        return content, None, None
+    return data, FORMAT_EXTENSIONS[info["format"]], info
@@ -0,0 +1,455 @@
+# -*- coding: utf-8 -*-
+"""
+异步分析任务
+POST /api/jobs 把上传的图片落盘并在 SQLite 中登记任务后立即返回任务ID，
+后台的工作协程依次领取任务、执行 上传 -> 皮肤分析 -> DeepSeek 推理，把每个阶段的进度和最终结果写回数据库；
+客户端通过 GET /api/jobs/{id} 轮询，不需要在整个推理期间保持连接，服务重启后未完成的任务会重新执行；
+上游熔断或排队已满（暂时性错误）时任务按指数退避重新排队，而不是直接失败；
+多个工作进程共享同一个数据库，每个任务记录领取它的进程，进程退出后只有它的任务重新排队
+"""
+
+import asyncio
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+
+import json_codec
+import logger_config
+from concurrency import run_blocking, pid_alive
+from resilience import CircuitOpen
+from upstream_scheduler import SchedulerBusy
+
+logger = logging.getLogger(__name__)
+
+BACK_END_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_DB_PATH = os.path.join(BACK_END_DIR, 'cache', 'jobs.sqlite3')
+DEFAULT_SPOOL_DIR = os.path.join(BACK_END_DIR, 'cache', 'jobs')
+DEFAULT_WORKERS = 4
+DEFAULT_MAX_ATTEMPTS = 3
+DEFAULT_RETENTION_HOURS = 168
+DEFAULT_PURGE_INTERVAL_SECONDS = 3600
+DEFAULT_TRANSIENT_RETRIES = 10
+# 暂时性错误后重新排队的等待时间：RETRY_BACKOFF_SECONDS * 2^重试次数，不超过 RETRY_BACKOFF_MAX_SECONDS
+RETRY_BACKOFF_SECONDS = 5
+RETRY_BACKOFF_MAX_SECONDS = 300
+# 上游熔断、调度器排队已满：稍后重试通常能成功，不计入 max_attempts
+TRANSIENT_ERRORS = (CircuitOpen, SchedulerBusy)
+POLL_INTERVAL = 1.0
+
+PENDING, RUNNING, SUCCEEDED, FAILED = 'pending', 'running', 'succeeded', 'failed'
+
+
+class JobStore:
+    """
+    基于 SQLite 的任务存储（WAL 模式，多个进程可以共享同一个数据库）
+    Args:
+        db_path (str): SQLite 文件路径
+        spool_dir (str): 等待处理的图片的存放目录
+    """
+
+    def __init__(self, db_path=DEFAULT_DB_PATH, spool_dir=DEFAULT_SPOOL_DIR):
+        self.db_path = db_path
+        self.spool_dir = spool_dir
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _connect(self):
+        if self._conn is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+            os.makedirs(self.spool_dir, exist_ok=True)
+            conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                " id TEXT PRIMARY KEY,"
+                " status TEXT NOT NULL,"
+                " filename TEXT,"
+                " spool_path TEXT,"
+                " question TEXT,"
+                " reasoning INTEGER,"
+                " stages TEXT,"
+                " result TEXT,"
+                " error TEXT,"
+                " attempts INTEGER DEFAULT 0,"
+                " created_at REAL,"
+                " updated_at REAL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status_created ON jobs (status, created_at)")
+            columns = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+            # 旧版本的数据库没有这些列
+            for column, definition in (("owner", "TEXT"), ("run_after", "REAL"), ("retries", "INTEGER DEFAULT 0")):
+                if column not in columns:
+                    conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {definition}")
+            self._conn = conn
+        return self._conn
+
+    def spool_path(self, job_id, filename):
+        """任务图片的落盘路径"""
+        ext = os.path.splitext(filename or '')[1] or '.jpg'
+        os.makedirs(self.spool_dir, exist_ok=True)
+        return os.path.join(self.spool_dir, f"{job_id}{ext}")
+
+    # ---------- 同步方法（在线程池中执行） ----------
+
+    def create(self, job_id, filename, spool_path, question, reasoning):
+        now = time.time()
+        with self._lock:
+            self._connect().execute(
+                "INSERT INTO jobs (id, status, filename, spool_path, question, reasoning, stages, created_at, updated_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, PENDING, filename, spool_path, question, int(reasoning), '{}', now, now)
+            )
+
+    def claim(self, max_attempts=DEFAULT_MAX_ATTEMPTS):
+        """
+        领取最早的待处理任务并标记为 running（事务中执行，多个进程不会领取到同一个任务），
+        退避等待中（run_after 未到）的任务跳过
+        """
+        with self._lock:
+            conn = self._connect()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    "SELECT * FROM jobs WHERE status = ? AND attempts < ? AND (run_after IS NULL OR run_after <= ?)"
+                    " ORDER BY created_at LIMIT 1",
+                    (PENDING, max_attempts, time.time())
+                ).fetchone()
+                if row is not None:
+                    conn.execute(
+                        "UPDATE jobs SET status = ?, owner = ?, attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                        (RUNNING, owner_id(), time.time(), row["id"])
+                    )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        return _row_to_job(row) if row is not None else None
+
+    def update_stages(self, job_id, stages):
+        with self._lock:
+            self._connect().execute(
+                "UPDATE jobs SET stages = ?, updated_at = ? WHERE id = ?",
+                (json.dumps(stages, ensure_ascii=False), time.time(), job_id)
+            )
+
+    def finish(self, job_id, result=None, error=None):
+        status = FAILED if error is not None else SUCCEEDED
+        with self._lock:
+            self._connect().execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, updated_at = ? WHERE id = ?",
+                (status, json_codec.dumps_str(result) if result is not None else None,
+                 error, time.time(), job_id)
+            )
+
+    def retry_later(self, job_id, delay, error):
+        """暂时性错误：任务重新排队，delay 秒后才能再次领取（不计入尝试次数）"""
+        now = time.time()
+        with self._lock:
+            self._connect().execute(
+                "UPDATE jobs SET status = ?, owner = NULL, attempts = attempts - 1, retries = retries + 1,"
+                " run_after = ?, error = ?, updated_at = ? WHERE id = ? AND status = ?",
+                (PENDING, now + delay, error, now, job_id, RUNNING)
+            )
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._connect().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                return None
+            job = _row_to_job(row)
+            if job["status"] == PENDING:
+                job["queue_position"] = self._connect().execute(
+                    "SELECT COUNT(*) FROM jobs WHERE status = ? AND created_at < ?", (PENDING, row["created_at"])
+                ).fetchone()[0]
+        return job
+
+    def requeue_interrupted(self, max_attempts=DEFAULT_MAX_ATTEMPTS):
+        """
+        服务（工作进程）启动时调用：领取它们的进程已经退出、仍标记为 running 的任务重新排队，
+        超过最大尝试次数的标记为失败并删除落盘的图片；其他工作进程正在执行的任务不受影响
+        """
+        with self._lock:
+            conn = self._connect()
+            now = time.time()
+            running = conn.execute("SELECT id, owner, attempts, spool_path FROM jobs WHERE status = ?",
+                                   (RUNNING,)).fetchall()
+            orphans = [row for row in running if not _owner_alive(row["owner"])]
+            abandoned = [row["spool_path"] for row in conn.execute(
+                "SELECT spool_path FROM jobs WHERE status = ? AND attempts >= ?", (PENDING, max_attempts)
+            )]
+            failed = conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, updated_at = ? WHERE status = ? AND attempts >= ?",
+                (FAILED, "任务多次中断，已放弃", now, PENDING, max_attempts)
+            ).rowcount
+            requeued = 0
+            for row in orphans:
+                changes = conn.execute(
+                    "UPDATE jobs SET status = CASE WHEN attempts >= ? THEN ? ELSE ? END,"
+                    " error = CASE WHEN attempts >= ? THEN ? ELSE error END, owner = NULL, updated_at = ?"
+                    " WHERE id = ? AND status = ?",
+                    (max_attempts, FAILED, PENDING, max_attempts, "任务多次中断，已放弃", now, row["id"], RUNNING)
+                ).rowcount
+                if changes and row["attempts"] >= max_attempts:
+                    failed += changes
+                    abandoned.append(row["spool_path"])
+                else:
+                    requeued += changes
+        for path in abandoned:
+            remove_spool(path)
+        if requeued or failed:
+            logger.info(f"重新处理 {requeued} 个中断的任务，放弃 {failed} 个超过重试次数的任务")
+        return requeued
+
+    def release_owned(self, job_ids):
+        """工作进程正常退出时调用：本进程未执行完的任务立即重新排队，由其他工作进程继续执行"""
+        if not job_ids:
+            return 0
+        with self._lock:
+            conn = self._connect()
+            now = time.time()
+            released = sum(conn.execute(
+                "UPDATE jobs SET status = ?, owner = NULL, updated_at = ? WHERE id = ? AND status = ? AND owner = ?",
+                (PENDING, now, job_id, RUNNING, owner_id())
+            ).rowcount for job_id in job_ids)
+        if released:
+            logger.info(f"退出前把 {released} 个未完成的任务交还队列")
+        return released
+
+    def purge(self, retention_seconds):
+        """删除已结束且超过保留时间的任务及其落盘的图片"""
+        cutoff = time.time() - retention_seconds
+        with self._lock:
+            conn = self._connect()
+            rows = conn.execute(
+                "SELECT spool_path FROM jobs WHERE status IN (?, ?) AND updated_at < ?", (SUCCEEDED, FAILED, cutoff)
+            ).fetchall()
+            conn.execute("DELETE FROM jobs WHERE status IN (?, ?) AND updated_at < ?", (SUCCEEDED, FAILED, cutoff))
+        for row in rows:
+            remove_spool(row["spool_path"])
+        return len(rows)
+
+    def counts(self):
+        with self._lock:
+            rows = self._connect().execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return {status: count for status, count in rows}
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+def owner_id():
+    """领取任务的进程标识：主机名:进程号"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _owner_alive(owner):
+    """领取任务的进程是否仍在运行（其他主机的进程无法判断，视为仍在运行）"""
+    if not owner:
+        return False
+    host, _, pid = owner.rpartition(':')
+    if host != socket.gethostname():
+        return True
+    if not pid.isdigit() or int(pid) == os.getpid():
+        # 本进程刚启动，不可能有自己领取的任务（进程号被复用）
+        return False
+    return pid_alive(int(pid))
+
+
+def _row_to_job(row):
+    job = dict(row)
+    job["reasoning"] = bool(job["reasoning"])
+    job["stages"] = json.loads(job["stages"] or '{}')
+    job["result"] = json_codec.loads(job["result"]) if job["result"] else None
+    return job
+
+
+def remove_spool(path):
+    if path:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning(f"删除任务图片失败 {path}: {str(e)}")
+
+
+class JobProgress:
+    """记录任务各阶段的开始时间、耗时和状态，并写回数据库"""
+
+    def __init__(self, store, job_id, stages=None):
+        self.store = store
+        self.job_id = job_id
+        self.stages = dict(stages or {})
+        self._started = {}
+
+    async def start(self, name):
+        self._started[name] = time.perf_counter()
+        self.stages[name] = {"status": RUNNING, "started_at": time.time()}
+        await run_blocking(self.store.update_stages, self.job_id, self.stages)
+
+    async def done(self, name, status=SUCCEEDED, error=None):
+        stage = self.stages.setdefault(name, {})
+        stage["status"] = status
+        stage["duration_ms"] = round((time.perf_counter() - self._started.get(name, time.perf_counter())) * 1000, 1)
+        if error is not None:
+            stage["error"] = error
+        await run_blocking(self.store.update_stages, self.job_id, self.stages)
+
+    async def run(self, name, coro):
+        """执行一个阶段并记录进度"""
+        await self.start(name)
+        try:
+            result = await coro
+        except Exception as e:
+            await self.done(name, FAILED, str(e))
+            raise
+        await self.done(name)
+        return result
+
+
+class JobWorkers:
+    """
+    后台工作协程：从任务存储中领取任务并交给 handler 执行
+    Args:
+        store (JobStore): 任务存储
+        handler: async 函数 handler(job, progress)，返回任务结果（可以 JSON 序列化）
+        workers (int): 工作协程数量（同时执行的任务数）
+        retention_seconds (float): 已结束的任务保留多久，启动时及之后每 purge_interval 秒清理一次
+        transient_retries (int): 暂时性错误（TRANSIENT_ERRORS）后最多重新排队的次数，超过后任务失败
+    """
+
+    def __init__(self, store, handler, workers=DEFAULT_WORKERS, max_attempts=DEFAULT_MAX_ATTEMPTS,
+                 retention_seconds=DEFAULT_RETENTION_HOURS * 3600, purge_interval=DEFAULT_PURGE_INTERVAL_SECONDS,
+                 transient_retries=DEFAULT_TRANSIENT_RETRIES):
+        self.store = store
+        self.handler = handler
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retention_seconds = retention_seconds
+        self.purge_interval = purge_interval
+        self.transient_retries = transient_retries
+        self._wakeup = asyncio.Event()
+        self._tasks = []
+        # 本进程正在执行的任务ID
+        self._running = set()
+
+    def notify(self):
+        """有新任务提交时唤醒空闲的工作协程"""
+        self._wakeup.set()
+
+    async def start(self):
+        await run_blocking(self.store.requeue_interrupted, self.max_attempts)
+        self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._purger()))
+
+    async def stop(self):
+        """停止工作协程，正在执行的任务交还队列，由其他工作进程或下次启动时重新执行"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        running, self._running = list(self._running), set()
+        await run_blocking(self.store.release_owned, running)
+
+    async def _worker(self, index):
+        while True:
+            job = await run_blocking(self.store.claim, self.max_attempts)
+            if job is None:
+                # 没有待处理的任务：等待新任务提交，或定期轮询（其他进程提交的任务）
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._run(job)
+
+    async def _purger(self):
+        """定期删除超过保留时间的任务，长时间运行的服务不必等到重启才清理"""
+        while True:
+            try:
+                purged = await run_blocking(self.store.purge, self.retention_seconds)
+                if purged:
+                    logger.info(f"已删除 {purged} 个超过保留时间的任务")
+            except Exception as e:
+                logger.error(f"清理过期任务失败: {str(e)}", exc_info=True)
+            await asyncio.sleep(self.purge_interval)
+
+    async def _run(self, job):
+        progress = JobProgress(self.store, job["id"], job["stages"])
+        logger.info(f"开始执行任务 {job['id']}（第 {job['attempts'] + 1} 次）")
+        self._running.add(job["id"])
+        try:
+            result = await self.handler(job, progress)
+        except asyncio.CancelledError:
+            # 服务退出，任务保持 running，由 stop() 交还队列
+            raise
+        except TRANSIENT_ERRORS as e:
+            if (job["retries"] or 0) >= self.transient_retries:
+                await self._fail(job, e)
+            else:
+                delay = retry_delay(job["retries"] or 0, getattr(e, 'retry_after', None))
+                logger.warning(f"任务 {job['id']} 遇到暂时性错误，{delay:.0f} 秒后重新执行: {str(e)}")
+                await run_blocking(self.store.retry_later, job["id"], delay, str(e))
+                # 图片保留到重新执行
+                self._running.discard(job["id"])
+                return
+        except Exception as e:
+            await self._fail(job, e)
+        else:
+            await run_blocking(self.store.finish, job["id"], result)
+            logger.info(f"任务 {job['id']} 已完成")
+        self._running.discard(job["id"])
+        remove_spool(job["spool_path"])
+
+    async def _fail(self, job, error):
+        logger.error(f"任务 {job['id']} 执行失败: {str(error)}", exc_info=error)
+        await run_blocking(self.store.finish, job["id"], None, str(error))
+
+
+def retry_delay(retries, retry_after=None):
+    """第 retries 次重新排队前的等待时间（秒）；熔断器给出了恢复时间时至少等到那时"""
+    delay = min(RETRY_BACKOFF_SECONDS * 2 ** retries, RETRY_BACKOFF_MAX_SECONDS)
+    return max(delay, retry_after or 0)
+
+
+def new_job_id():
+    return uuid.uuid4().hex
+
+
+_store = None
+
+
+def get_job_store():
+    """获取全局任务存储（按配置创建）"""
+    global _store
+    if _store is None:
+        jobs_config = logger_config.Config().get_jobs()
+        _store = JobStore(
+            db_path=_resolve(jobs_config.get('db_path'), DEFAULT_DB_PATH),
+            spool_dir=_resolve(jobs_config.get('spool_dir'), DEFAULT_SPOOL_DIR)
+        )
+    return _store
+
+
+def _resolve(path, default):
+    if not path:
+        return default
+    return path if os.path.isabs(path) else os.path.join(BACK_END_DIR, path)
+
+
+def close_job_store():
+    """关闭全局任务存储（应用退出时调用）"""
+    global _store
+    if _store is not None:
+        _store.close()
+        _store = None
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+"""
+JSON 编解码
+安装了 orjson 时使用 orjson（直接输出 UTF-8 bytes，原生支持 dataclass，比标准库快数倍），否则回退到标准库 json。
+分析结果在进程内保持为 SkinAnalysisResult 对象，只在出口处（HTTP 响应、SSE、NDJSON、缓存和任务存储）序列化一次
+"""
+
+import json
+
+from starlette.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:  # orjson 未安装时使用标准库
+    orjson = None
+
+
+def _default(obj):
+    """标准库 json 不支持的对象：带 to_dict 方法的结果对象转换为 dict"""
+    to_dict = getattr(obj, 'to_dict', None)
+    if to_dict is not None:
+        return to_dict()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps(obj):
+    """
+    紧凑编码（不带空白，中文不转义）
+    Returns:
+        bytes: UTF-8 编码的 JSON
+    """
+    if orjson is not None:
+        return orjson.dumps(obj, default=_default)
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':'), default=_default).encode('utf-8')
+
+
+def dumps_str(obj):
+    """与 dumps 相同，返回 str（写入 SQLite TEXT 列或拼接 SSE 事件时使用）"""
+    return dumps(obj).decode('utf-8')
+
+
+def loads(data):
+    """解析 JSON（str 或 bytes）"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+class FastJSONResponse(JSONResponse):
+    """用 dumps 编码的 JSON 响应，可以直接返回包含 SkinAnalysisResult 的结构"""
+
+    def render(self, content):
+        return dumps(content)
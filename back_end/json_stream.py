@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+"""
+从大模型的流式输出中增量提取 JSON 对象
+逐段接收输出的增量，跳过对象之前的说明文字和 ```json 代码块标记，
+在同一遍扫描中修复大模型常见的格式问题：
+  重复的键：保留第一次出现的值（例如 Chart.js 配置中重复输出的 plugins 块）
+  多余的逗号：对象或数组最后一项后面的逗号
+  字符串中未转义的换行等控制字符
+空白只在分隔两个裸值（数字、true/false/null）时保留，例如 {"a": 1 2} 仍然解析失败，不会被拼成 12
+第一个顶层对象一闭合就返回，调用方可以立即停止读取（和生成）
+"""
+
+import json
+import re
+
+_STRING_SPECIAL = re.compile(r'["\\]')
+_WHITESPACE = ' \t\r\n'
+
+
+class _Frame:
+    """正在解析的对象或数组"""
+    __slots__ = ('is_object', 'keys', 'expect_key')
+
+    def __init__(self, is_object):
+        self.is_object = is_object
+        self.keys = set()
+        self.expect_key = is_object
+
+
+class JsonObjectExtractor:
+    """
+    增量提取第一个完整的顶层 JSON 对象
+    用法:
+        extractor = JsonObjectExtractor()
+        for delta in stream:
+            if extractor.feed(delta) is not None:
+                break
+        config = extractor.finish()
+    """
+
+    def __init__(self):
+        self.value = None
+        self.done = False
+        self.consumed = 0
+        self._reset()
+
+    def _reset(self):
+        self._out = []
+        self._stack = []
+        self._in_string = False
+        self._escape = False
+        self._string = None
+        self._key = None
+        self._pending_comma = False
+        # 上一个字符是字符串之外的空白
+        self._space = False
+        self._skipping = False
+        self._skip_depth = 0
+
+    def feed(self, text):
+        """
+        接收一段输出
+        Returns:
+            dict: 对象已闭合时返回解析结果，否则返回 None
+        """
+        if self.done:
+            return self.value
+        i, n = 0, len(text)
+        while i < n:
+            if self._in_string:
+                i = self._scan_string(text, i)
+                continue
+            ch = text[i]
+            i += 1
+            if not self._stack:
+                # 对象开始之前的说明文字和代码块标记
+                if ch == '{':
+                    self._stack.append(_Frame(True))
+                    self._out.append(ch)
+                continue
+            if ch in _WHITESPACE:
+                self._space = True
+                continue
+            if self._skipping:
+                self._skip(ch)
+            else:
+                self._structural(ch)
+            self._space = False
+            if self.done:
+                self.consumed += i
+                return self.value
+        self.consumed += n
+        return None
+
+    def finish(self):
+        """
+        输出结束时调用
+        Raises:
+            ValueError: 输出中没有完整的 JSON 对象（例如达到 max_tokens 被截断）
+        """
+        if not self.done:
+            raise ValueError("大模型输出中没有完整的 JSON 对象")
+        return self.value
+
+    # ---------- 扫描 ----------
+
+    def _scan_string(self, text, i):
+        if self._escape:
+            self._append_string(text[i])
+            self._escape = False
+            return i + 1
+        match = _STRING_SPECIAL.search(text, i)
+        if match is None:
+            self._append_string(text[i:])
+            return len(text)
+        j = match.start()
+        self._append_string(text[i:j + 1])
+        if text[j] == '\\':
+            self._escape = True
+        else:
+            self._in_string = False
+            self._end_string()
+        return j + 1
+
+    def _append_string(self, text):
+        if self._string is not None:
+            self._string.append(text)
+
+    def _end_string(self):
+        if self._skipping:
+            return
+        token = ''.join(self._string)
+        self._string = None
+        frame = self._stack[-1]
+        if frame.is_object and frame.expect_key:
+            # 键先暂存，读到冒号后再判断是否重复
+            self._key = token
+        else:
+            self._value_start()
+            self._out.append(token)
+
+    def _value_start(self):
+        if self._key is not None:
+            # 缺少冒号的键按普通字符串输出，交给 json 解析时报错
+            self._out.append(self._key)
+            self._key = None
+        if self._pending_comma:
+            self._out.append(',')
+            self._pending_comma = False
+
+    def _structural(self, ch):
+        frame = self._stack[-1]
+        if ch == '"':
+            self._in_string = True
+            self._string = [ch]
+        elif ch == ':' and self._key is not None:
+            self._colon(frame)
+        elif ch == ',':
+            # 暂不输出，后面紧跟 } 或 ] 时丢弃（连续的逗号也只保留一个）
+            self._pending_comma = True
+            frame.expect_key = frame.is_object
+        elif ch in '}]':
+            self._pending_comma = False
+            self._key = None
+            self._close(ch)
+        elif ch in '{[':
+            self._value_start()
+            self._stack.append(_Frame(ch == '{'))
+            self._out.append(ch)
+        else:
+            self._value_start()
+            if self._space:
+                self._out.append(' ')
+            self._out.append(ch)
+
+    def _colon(self, frame):
+        key_token, self._key = self._key, None
+        try:
+            key = json.loads(key_token, strict=False)
+        except ValueError:
+            key = key_token
+        if key in frame.keys:
+            # 重复的键：连同前面的逗号一起丢弃，并跳过它的值
+            self._pending_comma = False
+            self._skipping = True
+            self._skip_depth = 0
+            return
+        frame.keys.add(key)
+        frame.expect_key = False
+        if self._pending_comma:
+            self._out.append(',')
+            self._pending_comma = False
+        self._out.append(key_token)
+        self._out.append(':')
+
+    def _skip(self, ch):
+        if ch == '"':
+            self._in_string = True
+        elif ch in '{[':
+            self._skip_depth += 1
+        elif ch in '}]' or ch == ',':
+            if self._skip_depth == 0:
+                # 被跳过的值结束，这个字符按正常流程处理
+                self._skipping = False
+                self._structural(ch)
+            elif ch != ',':
+                self._skip_depth -= 1
+
+    def _close(self, ch):
+        self._stack.pop()
+        self._out.append(ch)
+        if self._stack:
+            return
+        text = ''.join(self._out)
+        try:
+            value = json.loads(text, strict=False)
+        except ValueError:
+            value = None
+        if isinstance(value, dict):
+            self.value = value
+            self.done = True
+        else:
+            # 不是合法的 JSON（例如说明文字中的 {占位符}），继续寻找下一个对象
+            self._reset()
+
+
+def extract_json_object(text):
+    """从完整的输出中提取第一个 JSON 对象（非流式输出时使用）"""
+    extractor = JsonObjectExtractor()
+    extractor.feed(text)
+    return extractor.finish()
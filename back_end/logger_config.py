@@ -1,31 +1,272 @@
 # -*- coding: utf-8 -*-
-import yaml
+"""
+配置加载模块
+config.yaml 在进程内只解析一次，按 SCHEMA 检查各项的类型后生成不可变的配置快照
+（各部分是只读的 Mapping，列表转为 tuple，调用方无法修改共享的配置）；
+文件修改时间变化（或收到 SIGHUP）时重新解析并原子替换快照，
+Config() 和 get_config() 只是读取当前快照，开销很小
+"""
+import logging
 import os
+import signal
+import threading
+import time
+from collections.abc import Mapping
+from dataclasses import dataclass, field
+from types import MappingProxyType
 
-CONFIG_PATH = os.path.join(os.path.dirname(__file__), 'config.yaml')
+import yaml
 
-def load_config():
+# 可以用环境变量 SKIN_ANALYSIS_CONFIG 指定其他配置文件（例如连接本地模拟上游的压测配置）
+CONFIG_PATH = os.environ.get('SKIN_ANALYSIS_CONFIG') or os.path.join(os.path.dirname(__file__), 'config.yaml')
+# 两次检查文件修改时间的最小间隔（秒），避免每次读取配置都调用 stat
+CHECK_INTERVAL = 1.0
+
+logger = logging.getLogger(__name__)
+
+_EMPTY = MappingProxyType({})
+
+# 配置项的类型：NUMBER 为非负的数字，BOOL 为 true/false，STR 为字符串（可以为空），
+# dict 为嵌套的部分（'*' 匹配任意名称的子项，例如各上游、各临时目录）；未列出的配置项不检查
+NUMBER, BOOL, STR = 'number', 'bool', 'str'
+_CREDENTIALS = {'access_key_id': STR, 'access_key_secret': STR}
+SCHEMA = {
+    'skin_analysis_main_configuration': _CREDENTIALS,
+    'img_to_oss': {'bucket_name': STR, 'oss_endpoint': STR},
+    'skin_analysis': {**_CREDENTIALS, 'org_id': STR, 'org_name': STR, 'endpoint': STR, 'protocol': STR},
+    'deepseek_api': {'api_key': STR, 'base_url': STR, 'model_name': STR},
+    'gemma3n_api': {'api_key': STR, 'invoke_url': STR, 'model_name': STR, 'max_tokens': NUMBER},
+    'concurrency': {'max_workers': NUMBER},
+    'pipeline': {'chart_enabled': BOOL},
+    'chart': {'mode': STR, 'type': STR, 'top_k': NUMBER, 'creative_cache_entries': NUMBER, 'render_format': STR,
+              'width': NUMBER, 'height': NUMBER, 'font_path': STR, 'cache_dir': STR},
+    'analysis_cache': {'enabled': BOOL, 'max_entries': NUMBER, 'max_disk_entries': NUMBER, 'db_path': STR},
+    'http_pool': {'pool_size': NUMBER, 'connect_timeout': NUMBER, 'warm_up': BOOL, 'preload_sdks': BOOL},
+    'upload': {'max_bytes': NUMBER, 'chunk_size': NUMBER, 'keep_local_copy': BOOL,
+               'multipart': {'enabled': BOOL, 'threshold': NUMBER, 'part_size': NUMBER, 'concurrency': NUMBER,
+                             'max_retries': NUMBER, 'pool_size': NUMBER}},
+    'direct_upload': {'enabled': BOOL, 'prefix': STR, 'expires_seconds': NUMBER},
+    'temp_storage': {'enabled': BOOL, 'interval_seconds': NUMBER,
+                     'directories': {'*': {'max_age_hours': NUMBER, 'max_bytes': NUMBER}}},
+    'image_preprocess': {'enabled': BOOL, 'max_edge': NUMBER, 'format': STR, 'quality': NUMBER, 'workers': NUMBER},
+    'skin_analysis_quota': {'rate_per_second': NUMBER, 'burst': NUMBER, 'max_concurrency': NUMBER,
+                            'max_queue': NUMBER, 'max_retries': NUMBER, 'backoff_base': NUMBER,
+                            'backoff_max': NUMBER, 'shared_db': STR},
+    'batch': {'max_items': NUMBER, 'concurrency': NUMBER, 'max_concurrency': NUMBER},
+    'llm_payload': {'enabled': BOOL, 'top_k': NUMBER, 'min_score': NUMBER, 'precision': NUMBER},
+    'jobs': {'enabled': BOOL, 'workers': NUMBER, 'max_attempts': NUMBER, 'transient_retries': NUMBER,
+             'retention_hours': NUMBER, 'purge_interval_seconds': NUMBER, 'db_path': STR, 'spool_dir': STR},
+    'logging': {'level': STR, 'dir': STR, 'file_name': STR, 'json': BOOL, 'console': BOOL, 'max_bytes': NUMBER,
+                'backup_days': NUMBER, 'compress': BOOL, 'queue_size': NUMBER},
+    'resilience': {'request_deadline': NUMBER, 'stage_budgets': {'*': NUMBER},
+                   'upstreams': {'*': {'timeout': NUMBER, 'hedge_after': NUMBER, 'max_concurrency': NUMBER,
+                                       'max_retries': NUMBER, 'failure_threshold': NUMBER,
+                                       'open_seconds': NUMBER, 'half_open_calls': NUMBER}}},
+    'server': {'host': STR, 'port': NUMBER, 'workers': NUMBER, 'drain_seconds': NUMBER, 'backlog': NUMBER,
+               'access_log': BOOL},
+}
+
+
+def validate(data, schema=SCHEMA, path=''):
+    """
+    按 schema 检查配置项的类型
+    Raises:
+        ValueError: 某一项的类型不对（例如数字写成了字符串、某一部分不是映射）
+    """
+    if not isinstance(data, Mapping):
+        raise ValueError(f"配置 {path or '文件'} 应为映射（key: value），实际为 {data!r}")
+    for key, value in data.items():
+        expected = schema.get(key, schema.get('*'))
+        name = f"{path}.{key}" if path else str(key)
+        if expected is None:
+            continue
+        if isinstance(expected, dict):
+            if value is not None:
+                validate(value, expected, name)
+        elif expected == NUMBER:
+            if isinstance(value, bool) or not isinstance(value, (int, float)) or value < 0:
+                raise ValueError(f"配置 {name} 应为非负的数字，实际为 {value!r}")
+        elif expected == BOOL:
+            if not isinstance(value, bool):
+                raise ValueError(f"配置 {name} 应为 true 或 false，实际为 {value!r}")
+        elif value is not None and not isinstance(value, (str, int, float)):
+            raise ValueError(f"配置 {name} 应为字符串，实际为 {value!r}")
+
+
+def freeze(value):
+    """把解析出的配置转换为只读的结构：dict -> MappingProxyType，list -> tuple"""
+    if isinstance(value, Mapping):
+        return MappingProxyType({key: freeze(item) for key, item in value.items()})
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(item) for item in value)
+    return value
+
+
+def thaw(value):
+    """只读的配置转换回普通的 dict/list（序列化或需要修改副本时使用）"""
+    if isinstance(value, Mapping):
+        return {key: thaw(item) for key, item in value.items()}
+    if isinstance(value, tuple):
+        return [thaw(item) for item in value]
+    return value
+
+
+@dataclass(frozen=True)
+class ConfigSnapshot:
+    """某一时刻的配置快照，data 及其中的各部分都是只读的"""
+    data: Mapping = field(default_factory=lambda: _EMPTY)
+    mtime: float = 0.0
+    version: int = 0
+
+    def section(self, name):
+        return self.data.get(name) or _EMPTY
+
+
+_snapshot = None
+_checked_at = 0.0
+_reload_requested = False
+# 解析失败的文件修改时间，文件再次修改前不重复尝试
+_failed_mtime = None
+_lock = threading.Lock()
+
+
+def _read_snapshot(version):
+    mtime = os.path.getmtime(CONFIG_PATH)
     with open(CONFIG_PATH, 'r', encoding='utf-8') as f:
-        return yaml.safe_load(f)
+        data = yaml.safe_load(f) or {}
+    validate(data)
+    return ConfigSnapshot(data=freeze(data), mtime=mtime, version=version)
+
+
+def reload_config():
+    """强制重新解析配置文件；解析或类型检查失败时保留旧快照"""
+    global _snapshot, _checked_at, _reload_requested, _failed_mtime
+    with _lock:
+        _reload_requested = False
+        _checked_at = time.monotonic()
+        version = _snapshot.version + 1 if _snapshot else 1
+        try:
+            snapshot = _read_snapshot(version)
+        except Exception as e:
+            if _snapshot is None:
+                raise
+            try:
+                _failed_mtime = os.path.getmtime(CONFIG_PATH)
+            except OSError:
+                _failed_mtime = None
+            logger.error(f"重新加载配置失败，继续使用旧配置: {str(e)}")
+            return _snapshot
+        _snapshot = snapshot
+        _failed_mtime = None
+        if version > 1:
+            logger.info(f"配置已重新加载 (version={version})")
+        return _snapshot
+
+
+def get_config():
+    """获取当前配置快照，文件修改后自动重新加载"""
+    global _checked_at
+    snapshot = _snapshot
+    if snapshot is None or _reload_requested:
+        return reload_config()
+    now = time.monotonic()
+    if now - _checked_at >= CHECK_INTERVAL:
+        _checked_at = now
+        try:
+            mtime = os.path.getmtime(CONFIG_PATH)
+            changed = mtime != snapshot.mtime and mtime != _failed_mtime
+        except OSError:
+            changed = False
+        if changed:
+            return reload_config()
+    return snapshot
+
+
+def install_reload_signal():
+    """收到 SIGHUP 时重新加载配置（仅 POSIX 系统，需在主线程调用）"""
+    if not hasattr(signal, 'SIGHUP'):
+        return False
+
+    def request_reload(signum, frame):
+        # 信号处理函数里不加锁，只做标记，下一次读取配置时重新加载
+        global _reload_requested
+        _reload_requested = True
+
+    try:
+        signal.signal(signal.SIGHUP, request_reload)
+    except ValueError:
+        # 不在主线程中（例如测试客户端），忽略
+        return False
+    return True
+
+
+def load_config():
+    return get_config().data
 
 class Config:
     def __init__(self):
-        self._config = load_config()
+        self._snapshot = get_config()
+        self._config = self._snapshot.data
 
     def get_main_configuration(self):
-        return self._config.get('skin_analysis_main_configuration', {})
+        return self._snapshot.section('skin_analysis_main_configuration')
 
     def get_img_to_oss(self):
-        return self._config.get('img_to_oss', {})
+        return self._snapshot.section('img_to_oss')
 
     def get_skin_analysis(self):
-        return self._config.get('skin_analysis', {})
+        return self._snapshot.section('skin_analysis')
     
     def get_deepseek_api(self):
-        return self._config.get('deepseek_api', {})
+        return self._snapshot.section('deepseek_api')
     
     def get_gemma3n_api(self):
-        return self._config.get('gemma3n_api', {})
+        return self._snapshot.section('gemma3n_api')
     
     def get_front_end(self):
-        return self._config.get('front_end_configuration', {})
+        return self._snapshot.section('front_end_configuration')
+
+    def get_concurrency(self):
+        return self._snapshot.section('concurrency')
+
+    def get_pipeline(self):
+        return self._snapshot.section('pipeline')
+
+    def get_analysis_cache(self):
+        return self._snapshot.section('analysis_cache')
+
+    def get_http_pool(self):
+        return self._snapshot.section('http_pool')
+
+    def get_upload(self):
+        return self._snapshot.section('upload')
+
+    def get_direct_upload(self):
+        return self._snapshot.section('direct_upload')
+
+    def get_temp_storage(self):
+        return self._snapshot.section('temp_storage')
+
+    def get_image_preprocess(self):
+        return self._snapshot.section('image_preprocess')
+
+    def get_skin_analysis_quota(self):
+        return self._snapshot.section('skin_analysis_quota')
+
+    def get_batch(self):
+        return self._snapshot.section('batch')
+
+    def get_jobs(self):
+        return self._snapshot.section('jobs')
+
+    def get_llm_payload(self):
+        return self._snapshot.section('llm_payload')
+
+    def get_chart(self):
+        return self._snapshot.section('chart')
+
+    def get_logging(self):
+        return self._snapshot.section('logging')
+
+    def get_server(self):
+        return self._snapshot.section('server')
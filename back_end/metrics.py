@@ -0,0 +1,386 @@
+# -*- coding: utf-8 -*-
+"""
+运行指标（Prometheus 文本格式，由 GET /metrics 导出）
+  上游调用（OSS 上传、阿里云皮肤分析、DeepSeek、NIM）：耗时直方图、进行中的调用数、按原因分类的错误数
+  大模型流式输出：首个 token 的时间、token 数（提示/输出/推理）、输出长度和生成速度（tokens/s）
+  /api/analyze 流水线各阶段的耗时，以及各接口的请求耗时和进行中的请求数
+只实现这里用到的 Counter/Gauge/Histogram，不依赖 prometheus_client；
+指标只保存在当前进程内，多个 worker 进程时由 Prometheus 分别抓取
+"""
+
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+TOKEN_BUCKETS = (16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192)
+RATE_BUCKETS = (5, 10, 20, 40, 60, 80, 120, 160, 240, 320)
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+class _Metric:
+    kind = ''
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def labels(self, *values, **kwargs):
+        if kwargs:
+            values = tuple(kwargs[name] for name in self.labelnames)
+        key = tuple(str(value) for value in values)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        for key, child in sorted(self._children.items()):
+            lines.extend(child.render(self.name, self.labelnames, key))
+        return lines
+
+
+class _CounterChild:
+    def __init__(self):
+        self._value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self._value += amount
+
+    def render(self, name, labelnames, key):
+        return [f'{name}{_format_labels(labelnames, key)} {_format_value(self._value)}']
+
+
+class Counter(_Metric):
+    """只增不减的计数（名称以 _total 结尾）"""
+    kind = 'counter'
+
+    def _new_child(self):
+        return _CounterChild()
+
+
+class _GaugeChild(_CounterChild):
+    def __init__(self):
+        super().__init__()
+        self._function = None
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+    def set(self, value):
+        with self._lock:
+            self._value = value
+
+    def set_function(self, function):
+        """抓取时调用 function 取值（例如队列长度）"""
+        self._function = function
+
+    def render(self, name, labelnames, key):
+        value = self._value
+        if self._function is not None:
+            try:
+                value = self._function()
+            except Exception:
+                return []
+        return [f'{name}{_format_labels(labelnames, key)} {_format_value(value)}']
+
+
+class Gauge(_Metric):
+    """可增可减的当前值"""
+    kind = 'gauge'
+
+    def _new_child(self):
+        return _GaugeChild()
+
+
+class _HistogramChild:
+    def __init__(self, buckets):
+        self._buckets = buckets
+        self._counts = [0] * len(buckets)
+        self._sum = 0.0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        with self._lock:
+            self._sum += value
+            self._count += 1
+            for i, bound in enumerate(self._buckets):
+                if value <= bound:
+                    self._counts[i] += 1
+                    break
+
+    def render(self, name, labelnames, key):
+        with self._lock:
+            counts, total, count = list(self._counts), self._sum, self._count
+        lines, cumulative = [], 0
+        for bound, bucket_count in zip(self._buckets, counts):
+            cumulative += bucket_count
+            lines.append(f'{name}_bucket{_format_labels(labelnames, key, [("le", _format_value(bound))])} {cumulative}')
+        lines.append(f'{name}_bucket{_format_labels(labelnames, key, [("le", "+Inf")])} {count}')
+        lines.append(f'{name}_sum{_format_labels(labelnames, key)} {_format_value(total)}')
+        lines.append(f'{name}_count{_format_labels(labelnames, key)} {count}')
+        return lines
+
+
+class Histogram(_Metric):
+    """分桶统计的分布（导出为累计桶、总和与次数）"""
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+
+REGISTRY = []
+
+
+def render_metrics():
+    """所有指标的 Prometheus 文本格式"""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+# ---------- 指标定义 ----------
+
+UPSTREAM_DURATION = Histogram(
+    'skin_upstream_request_duration_seconds', '上游调用耗时（流式调用为从发出请求到读完或停止读取）',
+    ['upstream', 'outcome'])
+UPSTREAM_INFLIGHT = Gauge('skin_upstream_inflight_requests', '进行中的上游调用数', ['upstream'])
+UPSTREAM_ERRORS = Counter('skin_upstream_errors_total', '上游调用错误数（按原因分类）', ['upstream', 'cause'])
+
+LLM_TIME_TO_FIRST_TOKEN = Histogram(
+    'skin_llm_time_to_first_token_seconds', '大模型从发出请求到收到第一个输出增量的时间', ['upstream'])
+LLM_TOKENS = Counter('skin_llm_tokens_total', '大模型 token 数（prompt/completion/reasoning）', ['upstream', 'kind'])
+LLM_COMPLETION_TOKENS = Histogram(
+    'skin_llm_completion_tokens', '每次调用输出的 token 数（含推理过程）', ['upstream'], buckets=TOKEN_BUCKETS)
+LLM_TOKENS_PER_SECOND = Histogram(
+    'skin_llm_tokens_per_second', '输出阶段的生成速度（第一个增量之后）', ['upstream'], buckets=RATE_BUCKETS)
+
+STAGE_DURATION = Histogram('skin_pipeline_stage_duration_seconds', '/api/analyze 各阶段耗时', ['stage', 'status'])
+HTTP_DURATION = Histogram(
+    'skin_http_request_duration_seconds', 'HTTP 请求耗时（流式响应到发送完毕）', ['method', 'route', 'status'])
+HTTP_INFLIGHT = Gauge('skin_http_inflight_requests', '进行中的 HTTP 请求数')
+SCHEDULER_QUEUED = Gauge('skin_scheduler_queued_calls', '皮肤分析调度器中排队等待的调用数')
+SCHEDULER_ACTIVE = Gauge('skin_scheduler_active_calls', '皮肤分析调度器中正在执行的调用数')
+CIRCUIT_STATE = Gauge('skin_upstream_circuit_state', '熔断器状态（0 关闭，1 半开，2 打开）', ['upstream'])
+CIRCUIT_REJECTED = Counter('skin_upstream_rejected_total', '熔断器拒绝的调用数（熔断中或并发已满）', ['upstream', 'reason'])
+HEDGED_REQUESTS = Counter('skin_upstream_hedged_requests_total', '发出的对冲请求数（按哪一个请求先成功）',
+                          ['upstream', 'winner'])
+UPLOAD_PARTS = Counter('skin_oss_upload_parts_total', 'OSS 分片上传的分片数（uploaded 成功，retried 失败后重试）',
+                       ['outcome'])
+LOG_RECORDS_DROPPED = Counter('skin_log_records_dropped_total', '日志队列已满被丢弃的日志条数（只丢弃 WARNING 以下）',
+                              ['level'])
+
+
+# ---------- 埋点工具 ----------
+
+def error_cause(error):
+    """把异常归类为少量的原因，作为错误计数的标签"""
+    name = type(error).__name__
+    code = str(getattr(error, 'code', '') or '')
+    status = getattr(error, 'status_code', None) or getattr(error, 'status', None)
+    response = getattr(error, 'response', None)
+    if status is None and response is not None:
+        status = getattr(response, 'status_code', None)
+    data = getattr(error, 'data', None)
+    if status is None and isinstance(data, dict):
+        status = data.get('statusCode')
+    if name == 'CancelledError' or isinstance(error, GeneratorExit):
+        return 'cancelled'
+    if name == 'DeadlineExceeded':
+        # 请求自己的截止时间已到（resilience.DeadlineExceeded），不是上游超时
+        return 'deadline'
+    if 'Timeout' in name or isinstance(error, TimeoutError):
+        return 'timeout'
+    if code.startswith('Throttling') or 'RateLimit' in name or status == 429:
+        return 'rate_limited'
+    if isinstance(status, int) and status >= 400:
+        return f'http_{status // 100}xx'
+    if 'Connection' in name or isinstance(error, ConnectionError):
+        return 'connection'
+    if isinstance(error, ValueError):
+        return 'invalid_response'
+    return 'other'
+
+
+@contextmanager
+def track_upstream(upstream):
+    """
+    记录一次上游调用的耗时、进行中的调用数和错误原因
+    用法: with track_upstream('oss_put'): bucket.put_object(...)
+    """
+    inflight = UPSTREAM_INFLIGHT.labels(upstream)
+    inflight.inc()
+    started = time.perf_counter()
+    outcome = 'ok'
+    try:
+        yield
+    except BaseException as e:
+        outcome = 'error'
+        UPSTREAM_ERRORS.labels(upstream, error_cause(e)).inc()
+        raise
+    finally:
+        inflight.dec()
+        UPSTREAM_DURATION.labels(upstream, outcome).observe(time.perf_counter() - started)
+
+
+class LLMStreamMeter:
+    """
+    统计一次大模型流式调用：创建时开始计时，每收到一个输出增量调用 delta()，
+    有 usage 时调用 usage()，结束（包括提前停止读取）时调用 finish()
+    服务端不返回 usage 时，以输出增量的个数近似 completion token 数
+    """
+
+    def __init__(self, upstream):
+        self.upstream = upstream
+        self.started = time.perf_counter()
+        self.first_at = None
+        self.deltas = 0
+        self.prompt_tokens = None
+        self.completion_tokens = None
+        self.reasoning_tokens = None
+        self._finished = False
+        self._lock = threading.Lock()
+        UPSTREAM_INFLIGHT.labels(upstream).inc()
+
+    def delta(self):
+        if self.first_at is None:
+            self.first_at = time.perf_counter()
+            LLM_TIME_TO_FIRST_TOKEN.labels(self.upstream).observe(self.first_at - self.started)
+        self.deltas += 1
+
+    def usage(self, prompt_tokens=None, completion_tokens=None, reasoning_tokens=None):
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+        self.reasoning_tokens = reasoning_tokens
+
+    def finish(self, error=None):
+        # 读取线程和关闭流的线程都可能调用，只统计一次
+        with self._lock:
+            if self._finished:
+                return
+            self._finished = True
+        now = time.perf_counter()
+        UPSTREAM_INFLIGHT.labels(self.upstream).dec()
+        outcome = 'ok'
+        if error is not None:
+            outcome = 'error'
+            UPSTREAM_ERRORS.labels(self.upstream, error_cause(error)).inc()
+        UPSTREAM_DURATION.labels(self.upstream, outcome).observe(now - self.started)
+
+        completion = self.completion_tokens if self.completion_tokens is not None else self.deltas
+        if self.prompt_tokens:
+            LLM_TOKENS.labels(self.upstream, 'prompt').inc(self.prompt_tokens)
+        if self.reasoning_tokens:
+            LLM_TOKENS.labels(self.upstream, 'reasoning').inc(self.reasoning_tokens)
+        if completion:
+            LLM_TOKENS.labels(self.upstream, 'completion').inc(completion)
+            LLM_COMPLETION_TOKENS.labels(self.upstream).observe(completion)
+            if self.first_at is not None and now > self.first_at:
+                LLM_TOKENS_PER_SECOND.labels(self.upstream).observe(completion / (now - self.first_at))
+
+
+class MeteredStream:
+    """
+    包装 OpenAI SDK 的流式响应（DeepSeek），迭代时统计首个 token 时间、token 数和生成速度
+    需要请求时带上 stream_options={"include_usage": True}，最后一个数据块中才有 usage
+    """
+
+    def __init__(self, stream, meter):
+        self._stream = stream
+        self.meter = meter
+
+    def __iter__(self):
+        error = None
+        try:
+            for chunk in self._stream:
+                usage = getattr(chunk, 'usage', None)
+                if usage is not None:
+                    details = getattr(usage, 'completion_tokens_details', None)
+                    self.meter.usage(getattr(usage, 'prompt_tokens', None),
+                                     getattr(usage, 'completion_tokens', None),
+                                     getattr(details, 'reasoning_tokens', None))
+                if chunk.choices:
+                    self.meter.delta()
+                yield chunk
+        except GeneratorExit:
+            # 调用方提前停止读取（例如客户端断开），不算错误
+            raise
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            self.meter.finish(error)
+
+    def close(self):
+        close = getattr(self._stream, 'close', None)
+        if close is not None:
+            close()
+        self.meter.finish()
+
+
+class MetricsMiddleware:
+    """ASGI 中间件：按路由模板统计请求耗时和进行中的请求数（流式响应统计到发送完毕）"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        state = {"status": 500}
+        inflight = HTTP_INFLIGHT.labels()
+        inflight.inc()
+
+        async def send_wrapper(message):
+            if message['type'] == 'http.response.start':
+                state["status"] = message['status']
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            inflight.dec()
+            route = scope.get('route')
+            HTTP_DURATION.labels(
+                scope.get('method', ''), getattr(route, 'path', 'unmatched'), state["status"]
+            ).observe(time.perf_counter() - started)
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""
+分析流水线执行器
+每个阶段声明自己依赖的阶段，依赖完成后立即启动，
+互不依赖的阶段并发执行，整体耗时取决于关键路径而不是所有阶段之和
+"""
+
+import asyncio
+import time
+
+from metrics import STAGE_DURATION
+from resilience import DeadlineExceeded, deadline, remaining
+
+
+class StageError(Exception):
+    """必需阶段执行失败"""
+
+    def __init__(self, stage_name, error):
+        super().__init__(f"阶段 {stage_name} 执行失败: {error}")
+        self.stage_name = stage_name
+        self.error = error
+
+
+class Stage:
+    """
+    流水线中的一个阶段
+    Args:
+        name (str): 阶段名称，其结果以该名称存入上下文
+        func: async 函数，接收上下文 dict，返回阶段结果
+        deps (tuple): 依赖的阶段名称
+        optional (bool): 可选阶段失败时不会中断整个流水线，依赖它的阶段会被跳过
+        timeout (float): 阶段的时间预算（秒），不超过请求剩余的时间；阶段内的上游调用按此设置超时
+    """
+
+    def __init__(self, name, func, deps=(), optional=False, timeout=None):
+        self.name = name
+        self.func = func
+        self.deps = tuple(deps)
+        self.optional = optional
+        self.timeout = timeout
+
+
+class Pipeline:
+    """按依赖关系并发执行各个阶段"""
+
+    def __init__(self, stages):
+        self.stages = {}
+        for stage in stages:
+            if stage.name in self.stages:
+                raise ValueError(f"重复的阶段名称: {stage.name}")
+            self.stages[stage.name] = stage
+        self._check_deps()
+
+    def _check_deps(self):
+        """检查依赖是否存在以及是否有环"""
+        for stage in self.stages.values():
+            for dep in stage.deps:
+                if dep not in self.stages:
+                    raise ValueError(f"阶段 {stage.name} 依赖了不存在的阶段 {dep}")
+
+        visiting, visited = set(), set()
+
+        def visit(name):
+            if name in visited:
+                return
+            if name in visiting:
+                raise ValueError(f"阶段依赖存在环: {name}")
+            visiting.add(name)
+            for dep in self.stages[name].deps:
+                visit(dep)
+            visiting.discard(name)
+            visited.add(name)
+
+        for name in self.stages:
+            visit(name)
+
+    async def run(self, context=None):
+        """
+        执行流水线
+        Args:
+            context (dict): 初始上下文，各阶段结果会以阶段名写入其中
+
+        Returns:
+            tuple: (context, timings)，timings 记录每个阶段的开始时间、耗时和状态（毫秒）
+        """
+        context = dict(context or {})
+        timings = {}
+        started = time.perf_counter()
+        tasks = {}
+
+        async def run_stage(stage):
+            # 等待依赖阶段完成
+            for dep in stage.deps:
+                await tasks[dep]
+            if any(timings[dep]["status"] != "ok" for dep in stage.deps):
+                timings[stage.name] = {"start_ms": None, "duration_ms": 0, "status": "skipped"}
+                context[stage.name] = None
+                return
+
+            stage_start = time.perf_counter()
+            try:
+                with deadline(stage.timeout):
+                    context[stage.name] = await _run_with_deadline(stage, context)
+            except Exception as e:
+                timings[stage.name] = _timing(started, stage_start, "error")
+                timings[stage.name]["error"] = str(e)
+                STAGE_DURATION.labels(stage.name, "error").observe(time.perf_counter() - stage_start)
+                if not stage.optional:
+                    raise StageError(stage.name, e) from e
+                context[stage.name] = None
+                return
+            timings[stage.name] = _timing(started, stage_start, "ok")
+            STAGE_DURATION.labels(stage.name, "ok").observe(time.perf_counter() - stage_start)
+
+        for stage in self.stages.values():
+            tasks[stage.name] = asyncio.ensure_future(run_stage(stage))
+
+        try:
+            await asyncio.gather(*tasks.values())
+        except BaseException:
+            # 任一必需阶段失败（或请求被取消），取消其余阶段
+            for task in tasks.values():
+                task.cancel()
+            await asyncio.gather(*tasks.values(), return_exceptions=True)
+            raise
+
+        timings["total_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        return context, timings
+
+
+async def _run_with_deadline(stage, context):
+    """在截止时间内执行阶段，超时时取消并抛出 DeadlineExceeded"""
+    left = remaining()
+    if left is None:
+        return await stage.func(context)
+    task = asyncio.ensure_future(stage.func(context))
+    try:
+        done, _ = await asyncio.wait({task}, timeout=max(0.0, left))
+    except BaseException:
+        task.cancel()
+        raise
+    if not done:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        raise DeadlineExceeded(f"阶段 {stage.name} 超过时间预算")
+    return task.result()
+
+
+def _timing(pipeline_start, stage_start, status):
+    now = time.perf_counter()
+    return {
+        "start_ms": round((stage_start - pipeline_start) * 1000, 1),
+        "duration_ms": round((now - stage_start) * 1000, 1),
+        "status": status,
+    }
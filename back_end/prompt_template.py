@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""
+系统提示模板
+模板语法与 LangChain ChatPromptTemplate.from_template 的默认(f-string)格式相同：
+{name} 为变量，{{ 和 }} 为字面量的花括号。
+只做变量替换，不需要为此在启动和首次请求时导入整个 LangChain
+"""
+
+import os
+import re
+import threading
+
+_PLACEHOLDER = re.compile(r'\{\{|\}\}|\{([^{}]*)\}')
+
+
+class PromptTemplateError(ValueError):
+    """模板格式错误或缺少变量"""
+
+
+class PromptTemplate:
+    """
+    预先解析好的模板，渲染时只拼接字符串
+    Args:
+        template (str): 模板文本
+    """
+
+    def __init__(self, template):
+        self.template = template
+        self._parts = []
+        self.variables = []
+        position = 0
+        for match in _PLACEHOLDER.finditer(template):
+            self._append_text(_check_text(template[position:match.start()]))
+            token = match.group(0)
+            if token in ('{{', '}}'):
+                self._append_text(token[0])
+            else:
+                name = match.group(1).strip()
+                if not name.isidentifier():
+                    raise PromptTemplateError(f"无效的模板变量: {token}")
+                self._parts.append((True, name))
+                if name not in self.variables:
+                    self.variables.append(name)
+            position = match.end()
+        self._append_text(_check_text(template[position:]))
+
+    def _append_text(self, text):
+        if not text:
+            return
+        if self._parts and not self._parts[-1][0]:
+            self._parts[-1] = (False, self._parts[-1][1] + text)
+        else:
+            self._parts.append((False, text))
+
+    def render(self, **values):
+        """
+        替换模板变量
+        Raises:
+            PromptTemplateError: 缺少模板中的变量
+        """
+        missing = [name for name in self.variables if name not in values]
+        if missing:
+            raise PromptTemplateError(f"缺少模板变量: {', '.join(missing)}")
+        return ''.join(str(values[value]) if is_variable else value for is_variable, value in self._parts)
+
+
+def _check_text(text):
+    """变量之间的普通文本中不应再有花括号"""
+    if '{' in text or '}' in text:
+        raise PromptTemplateError("模板中存在未配对的花括号，字面量请写作 {{ 或 }}")
+    return text
+
+
+_templates = {}
+_templates_lock = threading.Lock()
+
+
+def load_prompt(path):
+    """
+    读取并解析模板文件，按文件修改时间缓存（修改模板文件后自动重新加载）
+    Returns:
+        PromptTemplate
+    """
+    mtime = os.stat(path).st_mtime_ns
+    cached = _templates.get(path)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    with open(path, 'r', encoding='utf-8') as file_p:
+        template = PromptTemplate(file_p.read())
+    with _templates_lock:
+        _templates[path] = (mtime, template)
+    return template
@@ -0,0 +1,398 @@
+# -*- coding: utf-8 -*-
+"""
+上游调用的容错
+  截止时间：每个请求（和流水线的每个阶段）在 contextvar 中带着截止时间，线程池中的上游调用也能读到，
+      各上游单次调用的超时取 min(该上游的超时配置, 截止时间剩余)，已经超时的调用不再发出
+  熔断器：每个上游一个，连续失败（超时、连接错误、5xx）达到阈值后打开，打开期间立即拒绝，
+      过一段时间放少量探测请求（半开），成功后关闭；同时限制同一上游的并发调用数，上游变慢时不会占满线程和连接
+  对冲请求：幂等的调用（皮肤分析、NIM 设计图表样式）超过设定时间仍未返回时再发一个相同的请求，使用先成功的结果
+配置见 config.yaml 的 resilience 部分
+"""
+
+import asyncio
+import contextvars
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+import logger_config
+from metrics import CIRCUIT_STATE, CIRCUIT_REJECTED, HEDGED_REQUESTS, error_cause
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_REQUEST_DEADLINE = 150
+DEFAULT_STAGE_BUDGETS = {"upload": 30, "skin_analysis": 60, "reasoning": 120, "chart": 30}
+# 各上游单次调用的默认参数；hedge_after 为 0 表示不发对冲请求，max_concurrency 为 0 表示不限制
+DEFAULT_UPSTREAMS = {
+    "oss": {"timeout": 15},
+    "skin_analysis": {"timeout": 20},
+    "deepseek": {"timeout": 120, "max_concurrency": 8},
+    "nim": {"timeout": 30, "hedge_after": 5},
+}
+DEFAULT_TIMEOUT = 30
+DEFAULT_FAILURE_THRESHOLD = 5
+DEFAULT_OPEN_SECONDS = 30
+DEFAULT_HALF_OPEN_CALLS = 1
+# 计入熔断的失败原因（限流、参数错误等说明上游是健康的）
+FAILURE_CAUSES = frozenset({'timeout', 'connection', 'http_5xx'})
+# 超时时截止时间剩余不超过这个值（秒），视为调用方的截止时间导致的超时
+DEADLINE_SLACK_SECONDS = 0.05
+
+_STATE_VALUES = {'closed': 0, 'half_open': 1, 'open': 2}
+
+
+class DeadlineExceeded(Exception):
+    """
+    请求（或阶段）的截止时间已到
+    不是 TimeoutError 的子类：调用方自己的时间预算用完不说明上游不健康，不计入熔断
+    """
+
+
+class CircuitOpen(Exception):
+    """上游熔断中（或并发调用数已满），立即失败而不是继续等待"""
+
+    def __init__(self, upstream, message, retry_after=None):
+        super().__init__(message)
+        self.upstream = upstream
+        self.retry_after = retry_after
+
+
+# ---------- 截止时间 ----------
+
+_deadline = contextvars.ContextVar('deadline', default=None)
+
+
+@contextmanager
+def deadline(seconds):
+    """
+    在当前上下文中设置截止时间（seconds 秒后）；外层已有更早的截止时间时保留外层的
+    用法: with deadline(30): await ...
+    """
+    if seconds is None:
+        yield
+        return
+    at = time.monotonic() + seconds
+    current = _deadline.get()
+    token = _deadline.set(at if current is None else min(current, at))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining():
+    """截止时间剩余的秒数，没有截止时间时返回 None"""
+    at = _deadline.get()
+    return None if at is None else at - time.monotonic()
+
+
+def check_deadline(what="请求"):
+    """截止时间已到时抛出 DeadlineExceeded"""
+    left = remaining()
+    if left is not None and left <= 0:
+        raise DeadlineExceeded(f"{what}已超过截止时间")
+
+
+def request_deadline():
+    """每个请求的总时间预算（秒）"""
+    return float(_config().get('request_deadline', DEFAULT_REQUEST_DEADLINE))
+
+
+def stage_budget(stage):
+    """流水线阶段的时间预算（秒），未配置时返回 None"""
+    budgets = {**DEFAULT_STAGE_BUDGETS, **(_config().get('stage_budgets') or {})}
+    budget = budgets.get(stage)
+    return float(budget) if budget else None
+
+
+def upstream_options(upstream):
+    options = dict(DEFAULT_UPSTREAMS.get(upstream, {}))
+    options.update((_config().get('upstreams') or {}).get(upstream) or {})
+    return options
+
+
+def upstream_timeout(upstream):
+    """
+    本次上游调用的超时（秒）：min(该上游的超时配置, 截止时间剩余)
+    Raises:
+        DeadlineExceeded: 截止时间已到，不再发出调用
+    """
+    timeout = float(upstream_options(upstream).get('timeout', DEFAULT_TIMEOUT))
+    left = remaining()
+    if left is not None:
+        if left <= 0:
+            raise DeadlineExceeded(f"调用 {upstream} 前已超过截止时间")
+        timeout = min(timeout, left)
+    return timeout
+
+
+def _config():
+    return logger_config.get_config().section('resilience')
+
+
+# ---------- 熔断器 ----------
+
+class CircuitBreaker:
+    """
+    单个上游的熔断器（线程安全，在线程池和事件循环中都可以使用）
+    Args:
+        name (str): 上游名称
+        failure_threshold (int): 连续失败多少次后打开
+        open_seconds (float): 打开多久后进入半开状态
+        half_open_calls (int): 半开状态下允许同时进行的探测调用数
+        max_concurrency (int): 同时进行的调用数上限，0 表示不限制
+    """
+
+    def __init__(self, name, failure_threshold=DEFAULT_FAILURE_THRESHOLD, open_seconds=DEFAULT_OPEN_SECONDS,
+                 half_open_calls=DEFAULT_HALF_OPEN_CALLS, max_concurrency=0):
+        self.name = name
+        self._lock = threading.Lock()
+        self._state = 'closed'
+        self._failures = 0
+        self._opened_until = 0.0
+        self._probes = 0
+        self._active = 0
+        self.rejected = 0
+        self.opened = 0
+        self.configure(failure_threshold, open_seconds, half_open_calls, max_concurrency)
+        CIRCUIT_STATE.labels(name).set(0)
+
+    def configure(self, failure_threshold, open_seconds, half_open_calls, max_concurrency):
+        """更新参数（配置热更新时调用），保留当前状态"""
+        self.failure_threshold = max(1, failure_threshold)
+        self.open_seconds = open_seconds
+        self.half_open_calls = max(1, half_open_calls)
+        self.max_concurrency = max_concurrency
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._current_state(time.monotonic())
+
+    def _current_state(self, now):
+        if self._state == 'open' and now >= self._opened_until:
+            self._set_state('half_open')
+            self._probes = 0
+        return self._state
+
+    def _set_state(self, state):
+        self._state = state
+        CIRCUIT_STATE.labels(self.name).set(_STATE_VALUES[state])
+
+    def _reject(self, reason, message, retry_after=None):
+        self.rejected += 1
+        CIRCUIT_REJECTED.labels(self.name, reason).inc()
+        raise CircuitOpen(self.name, message, retry_after)
+
+    def acquire(self):
+        """
+        开始一次调用
+        Raises:
+            CircuitOpen: 熔断器打开、半开状态下探测名额已满，或并发调用数已满
+        """
+        with self._lock:
+            now = time.monotonic()
+            state = self._current_state(now)
+            if state == 'open':
+                retry_after = max(0.0, self._opened_until - now)
+                self._reject('open', f"{self.name} 暂时不可用（熔断中），请 {retry_after:.0f} 秒后重试", retry_after)
+            if state == 'half_open' and self._probes >= self.half_open_calls:
+                self._reject('open', f"{self.name} 暂时不可用（正在探测恢复），请稍后重试", self.open_seconds)
+            if self.max_concurrency and self._active >= self.max_concurrency:
+                self._reject('concurrency', f"{self.name} 的并发调用数已达上限 {self.max_concurrency}，请稍后重试", 1)
+            self._active += 1
+            if state == 'half_open':
+                self._probes += 1
+
+    def release(self, error=None):
+        """结束一次调用；error 为超时、连接错误或 5xx 时计为失败"""
+        with self._lock:
+            self._active -= 1
+            state = self._current_state(time.monotonic())
+            if state == 'half_open':
+                self._probes = max(0, self._probes - 1)
+            if error is None:
+                self._failures = 0
+                if state == 'half_open':
+                    self._set_state('closed')
+                    logger.info(f"{self.name} 已恢复，熔断器关闭")
+                return
+            if not is_failure(error) or _caller_out_of_time(error):
+                return
+            self._failures += 1
+            if state == 'half_open' or (state == 'closed' and self._failures >= self.failure_threshold):
+                self._opened_until = time.monotonic() + self.open_seconds
+                self._set_state('open')
+                self.opened += 1
+                logger.warning(f"{self.name} 连续失败 {self._failures} 次，熔断 {self.open_seconds} 秒: {error}")
+
+    @contextmanager
+    def guard(self):
+        """用法: with breaker.guard(): 上游调用"""
+        self.acquire()
+        try:
+            yield
+        except BaseException as e:
+            self.release(e)
+            raise
+        self.release()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "state": self._current_state(time.monotonic()),
+                "consecutive_failures": self._failures,
+                "active": self._active,
+                "max_concurrency": self.max_concurrency,
+                "opened": self.opened,
+                "rejected": self.rejected,
+            }
+
+
+def is_failure(error):
+    """是否说明上游不健康（计入熔断）；调用方取消、限流和请求参数错误不计入"""
+    return error_cause(error) in FAILURE_CAUSES
+
+
+def _caller_out_of_time(error):
+    """上游调用的超时被缩短到请求剩余的时间，超时发生时请求的截止时间也已到：是调用方的时间不够"""
+    left = remaining()
+    return left is not None and left <= DEADLINE_SLACK_SECONDS and error_cause(error) == 'timeout'
+
+
+_breakers = {}
+_breakers_version = None
+_breakers_lock = threading.Lock()
+
+
+def _breaker_options(upstream):
+    options = upstream_options(upstream)
+    return (
+        int(options.get('failure_threshold', DEFAULT_FAILURE_THRESHOLD)),
+        float(options.get('open_seconds', DEFAULT_OPEN_SECONDS)),
+        int(options.get('half_open_calls', DEFAULT_HALF_OPEN_CALLS)),
+        int(options.get('max_concurrency', 0)),
+    )
+
+
+def get_breaker(upstream):
+    """获取上游的熔断器，配置更新后应用新的参数"""
+    global _breakers_version
+    version = logger_config.get_config().version
+    with _breakers_lock:
+        if _breakers_version != version:
+            for name, breaker in _breakers.items():
+                breaker.configure(*_breaker_options(name))
+            _breakers_version = version
+        breaker = _breakers.get(upstream)
+        if breaker is None:
+            breaker = _breakers[upstream] = CircuitBreaker(upstream, *_breaker_options(upstream))
+        return breaker
+
+
+def guard(upstream):
+    """经过上游熔断器的调用，用法: with guard('oss'): bucket.put_object(...)"""
+    return get_breaker(upstream).guard()
+
+
+def breaker_stats():
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    return {breaker.name: breaker.stats() for breaker in breakers}
+
+
+class GuardedStream:
+    """
+    包装流式响应：迭代时检查截止时间，结束（包括提前关闭）时归还熔断器的调用名额
+    Args:
+        stream: 上游的流式响应（可迭代，最好带 close 方法）
+        breaker (CircuitBreaker): 已经 acquire 的熔断器
+        timeout (float): 整个流式响应的时间上限（秒），与当前的截止时间取较早者
+    """
+
+    def __init__(self, stream, breaker, timeout=None):
+        self._stream = stream
+        self._breaker = breaker
+        self._deadline = _deadline.get()
+        if timeout is not None:
+            at = time.monotonic() + timeout
+            self._deadline = at if self._deadline is None else min(self._deadline, at)
+        self._released = False
+        self._lock = threading.Lock()
+
+    def __iter__(self):
+        error = None
+        try:
+            for item in self._stream:
+                if self._deadline is not None and time.monotonic() >= self._deadline:
+                    raise DeadlineExceeded(f"{self._breaker.name} 流式响应超过截止时间")
+                yield item
+        except GeneratorExit:
+            raise
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            if error is not None:
+                self._close_stream()
+            self._release(error)
+
+    def _close_stream(self):
+        close = getattr(self._stream, 'close', None)
+        if close is not None:
+            close()
+
+    def _release(self, error=None):
+        with self._lock:
+            if self._released:
+                return
+            self._released = True
+        self._breaker.release(error)
+
+    def close(self):
+        self._close_stream()
+        self._release()
+
+
+# ---------- 对冲请求 ----------
+
+async def hedged(upstream, make_call):
+    """
+    对幂等的调用发对冲请求：第一个请求超过 hedge_after 秒仍未返回时，再发一个相同的请求，返回先成功的结果
+    （另一个请求的结果被丢弃；线程池中的调用无法中断，由上游超时保证结束）
+    Args:
+        upstream (str): 上游名称（读取 resilience.upstreams.<upstream>.hedge_after）
+        make_call: 无参函数，每次调用返回一个新的 awaitable
+    """
+    hedge_after = float(upstream_options(upstream).get('hedge_after', 0) or 0)
+    first = asyncio.ensure_future(make_call())
+    if hedge_after <= 0:
+        return await first
+    try:
+        done, _ = await asyncio.wait({first}, timeout=hedge_after)
+    except BaseException:
+        first.cancel()
+        raise
+    left = remaining()
+    if done or (left is not None and left <= 0) or get_breaker(upstream).state != 'closed':
+        # 已返回、已经没有时间，或上游不健康时不再加压
+        return await first
+
+    second = asyncio.ensure_future(make_call())
+    tasks = {first: 'primary', second: 'hedge'}
+    pending = set(tasks)
+    error = None
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    HEDGED_REQUESTS.labels(upstream, tasks[task]).inc()
+                    return task.result()
+                error = error or task.exception()
+        HEDGED_REQUESTS.labels(upstream, 'none').inc()
+        raise error
+    finally:
+        for task in pending:
+            task.cancel()
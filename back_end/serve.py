@@ -0,0 +1,272 @@
+# -*- coding: utf-8 -*-
+"""
+生产模式启动入口（main.py 中的 uvicorn.run 只用于开发：单进程、修改代码后自动重启）
+  主进程绑定端口，预先导入应用和上游 SDK，再 fork 出多个工作进程共享监听的套接字：
+  代码和 SDK 只导入一次，工作进程启动快，只读内存在进程间共享；工作进程意外退出时自动重启
+  收到 SIGTERM/SIGINT 时所有工作进程停止接受新连接，等待进行中的请求（包括 DeepSeek 流式响应）完成后退出，
+  超过 drain_seconds 仍未结束的强制终止；SIGHUP 转发给工作进程，重新加载配置
+  分析结果缓存、异步任务和皮肤分析配额（skin_analysis_quota.shared）通过本机的 SQLite 文件在工作进程间共享，
+  增加工作进程不会成倍放大上游调用量；0 号工作进程负责临时目录清理，每个工作进程写各自的日志文件
+
+用法（可以在任意目录执行，参数默认取 config.yaml 的 server 部分）:
+    python back_end/serve.py
+    python back_end/serve.py --workers 4 --port 8000
+    SKIN_ANALYSIS_CONFIG=/etc/skin-analysis/config.yaml python back_end/serve.py
+不支持 fork 的平台（Windows）退回 uvicorn 自带的多进程模式（每个工作进程各自导入应用）
+"""
+
+import argparse
+import logging
+import os
+import signal
+import socket
+import sys
+import time
+
+BACK_END_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.join(BACK_END_DIR, 'ALi_skin_model')
+for path in (APP_DIR, BACK_END_DIR):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+import logger_config
+from concurrency import WORKERS_ENV, WORKER_ID_ENV
+
+logger = logging.getLogger('serve')
+
+DEFAULT_HOST = '0.0.0.0'
+DEFAULT_PORT = 8000
+DEFAULT_BACKLOG = 2048
+# 应大于 resilience.request_deadline，让进行中的请求都能完成
+DEFAULT_DRAIN_SECONDS = 160
+# 工作进程启动后这么快就退出视为启动失败，重启前的等待时间逐次加倍
+MIN_UPTIME_SECONDS = 5
+MAX_RESTART_DELAY = 30
+POLL_INTERVAL = 0.2
+
+
+def default_workers():
+    """默认的工作进程数：本进程可用的 CPU 核数"""
+    if hasattr(os, 'sched_getaffinity'):
+        return max(1, len(os.sched_getaffinity(0)))
+    return max(1, os.cpu_count() or 1)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host')
+    parser.add_argument('--port', type=int)
+    parser.add_argument('--workers', type=int, help='工作进程数，0 表示按 CPU 核数')
+    parser.add_argument('--drain-seconds', type=float, help='退出时等待进行中的请求完成的最长时间（秒）')
+    parser.add_argument('--backlog', type=int)
+    args = parser.parse_args(argv)
+
+    server_config = logger_config.Config().get_server()
+    options = argparse.Namespace(
+        host=args.host or server_config.get('host') or DEFAULT_HOST,
+        port=args.port if args.port is not None else int(server_config.get('port', DEFAULT_PORT)),
+        workers=args.workers if args.workers is not None else int(server_config.get('workers', 0) or 0),
+        drain_seconds=(args.drain_seconds if args.drain_seconds is not None
+                       else float(server_config.get('drain_seconds', DEFAULT_DRAIN_SECONDS))),
+        backlog=args.backlog if args.backlog is not None else int(server_config.get('backlog', DEFAULT_BACKLOG)),
+        access_log=server_config.get('access_log', True),
+    )
+    options.workers = options.workers or default_workers()
+    return options
+
+
+def bind_socket(host, port, backlog):
+    """主进程绑定监听的套接字，工作进程继承后共同 accept"""
+    family = socket.AF_INET6 if ':' in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def preload():
+    """导入应用和上游 SDK（工作进程 fork 后直接使用，不再重复导入）"""
+    import main
+    from clients import preload_sdks
+    preload_sdks()
+    return main.app
+
+
+def uvicorn_config(app, options):
+    import uvicorn
+    return uvicorn.Config(
+        app,
+        lifespan='on',
+        access_log=options.access_log,
+        # 不使用 uvicorn 自己的日志配置，访问日志等也写入统一的日志后端
+        log_config=None,
+        # 收到退出信号后等待进行中的请求完成，超时后取消
+        timeout_graceful_shutdown=options.drain_seconds,
+    )
+
+
+def run_worker(app, sock, index, options):
+    """工作进程：以继承的套接字运行 uvicorn，退出时不返回主进程的代码"""
+    from daily_logger import setup_logging, shutdown_logging
+    os.environ[WORKER_ID_ENV] = str(index)
+    # uvicorn 运行期间自己处理 SIGTERM/SIGINT，结束后会重新触发收到的信号：
+    # 这里换成空的处理函数，让工作进程走完下面的清理；SIGHUP 在应用启动后由 logger_config 接管
+    signal.signal(signal.SIGTERM, lambda signum, frame: None)
+    signal.signal(signal.SIGINT, lambda signum, frame: None)
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    setup_logging()
+    exit_code = 0
+    try:
+        import uvicorn
+        uvicorn.Server(uvicorn_config(app, options)).run(sockets=[sock])
+    except BaseException:
+        logger.exception(f"工作进程 {index} 异常退出")
+        exit_code = 1
+    finally:
+        shutdown_logging()
+        os._exit(exit_code)
+
+
+class Arbiter:
+    """
+    主进程：启动并监视工作进程，转发信号，退出时平滑停止所有工作进程
+    Args:
+        app: 预加载的 ASGI 应用
+        sock: 监听的套接字
+        options: parse_args 的结果
+    """
+
+    def __init__(self, app, sock, options):
+        self.app = app
+        self.sock = sock
+        self.options = options
+        # pid -> (编号, 启动时间)
+        self.workers = {}
+        # 等待重启的工作进程：编号 -> 重启时间；以及每个编号上次重启前等待的秒数
+        self.pending_restarts = {}
+        self.restart_delays = {}
+        self.stopping = False
+
+    def spawn(self, index):
+        from daily_logger import setup_logging, shutdown_logging
+        # fork 时进程中不能有其他线程（日志后台线程），子进程重新启动自己的日志后端
+        shutdown_logging()
+        pid = os.fork()
+        if pid == 0:
+            run_worker(self.app, self.sock, index, self.options)
+        setup_logging()
+        self.workers[pid] = (index, time.monotonic())
+        logger.info(f"工作进程 {index} 已启动 (pid={pid})")
+
+    def reap(self):
+        """回收已退出的工作进程，安排重启"""
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            if pid not in self.workers:
+                continue
+            index, started = self.workers.pop(pid)
+            exit_code = os.waitstatus_to_exitcode(status)
+            if self.stopping:
+                logger.info(f"工作进程 {index} 已退出 (pid={pid}, exit={exit_code})")
+                continue
+            uptime = time.monotonic() - started
+            previous = self.restart_delays.get(index, 0)
+            delay = 0 if uptime >= MIN_UPTIME_SECONDS else min(MAX_RESTART_DELAY, max(1, previous * 2))
+            self.restart_delays[index] = delay
+            self.pending_restarts[index] = time.monotonic() + delay
+            logger.warning(f"工作进程 {index} 意外退出 (pid={pid}, exit={exit_code}, 运行 {uptime:.1f}s)，"
+                           f"{delay}s 后重启")
+
+    def restart_due(self):
+        now = time.monotonic()
+        for index, restart_at in list(self.pending_restarts.items()):
+            if restart_at <= now:
+                del self.pending_restarts[index]
+                self.spawn(index)
+
+    def signal_workers(self, signum):
+        for pid in list(self.workers):
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                pass
+
+    def handle_stop(self, signum, frame):
+        self.stopping = True
+
+    def handle_reload(self, signum, frame):
+        # 工作进程各自重新加载配置（见 logger_config.install_reload_signal）
+        self.signal_workers(signal.SIGHUP)
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.handle_stop)
+        signal.signal(signal.SIGINT, self.handle_stop)
+        signal.signal(signal.SIGHUP, self.handle_reload)
+        for index in range(self.options.workers):
+            self.spawn(index)
+        while not self.stopping:
+            self.reap()
+            self.restart_due()
+            time.sleep(POLL_INTERVAL)
+        self.drain()
+
+    def drain(self):
+        """通知工作进程停止接受新连接并等待进行中的请求完成，超时后强制终止"""
+        logger.info(f"正在停止 {len(self.workers)} 个工作进程，最多等待 {self.options.drain_seconds:.0f}s")
+        # 主进程也关闭监听的套接字，新连接立即被拒绝（负载均衡可以马上切换），而不是在队列中等待超时
+        self.sock.close()
+        self.signal_workers(signal.SIGTERM)
+        # uvicorn 等待 drain_seconds 后取消剩余的请求，再留出执行应用退出逻辑的时间
+        deadline = time.monotonic() + self.options.drain_seconds + 10
+        while self.workers and time.monotonic() < deadline:
+            self.reap()
+            time.sleep(POLL_INTERVAL)
+        if self.workers:
+            logger.warning(f"{len(self.workers)} 个工作进程未按时退出，强制终止")
+            self.signal_workers(signal.SIGKILL)
+            for pid in list(self.workers):
+                try:
+                    os.waitpid(pid, 0)
+                except ChildProcessError:
+                    pass
+            self.workers.clear()
+        logger.info("服务已停止")
+
+
+def main(argv=None):
+    from daily_logger import setup_logging
+    options = parse_args(argv)
+    os.environ[WORKERS_ENV] = str(options.workers)
+    # 主进程的日志写入 app.log，工作进程写 app.worker{N}.log
+    setup_logging()
+
+    if not hasattr(os, 'fork'):
+        import uvicorn
+        logger.info(f"当前平台不支持 fork，使用 uvicorn 多进程模式启动 {options.workers} 个工作进程（不预加载）")
+        uvicorn.run('main:app', app_dir=APP_DIR, host=options.host, port=options.port, workers=options.workers,
+                    backlog=options.backlog, access_log=options.access_log, log_config=None,
+                    timeout_graceful_shutdown=options.drain_seconds)
+        return
+
+    sock = bind_socket(options.host, options.port, options.backlog)
+    started = time.perf_counter()
+    app = preload()
+    logger.info(f"应用预加载完成，耗时 {time.perf_counter() - started:.2f}s；"
+                f"监听 {options.host}:{options.port}，工作进程 {options.workers} 个")
+    if options.workers == 1:
+        # 单进程：直接在主进程中运行，uvicorn 自己处理平滑退出
+        import uvicorn
+        uvicorn.Server(uvicorn_config(app, options)).run(sockets=[sock])
+        return
+    Arbiter(app, sock, options).run()
+
+
+if __name__ == '__main__':
+    main()
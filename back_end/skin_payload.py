@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""
+发给大模型（DeepSeek 推理、NIM 图表）的皮肤数据
+Sample.main 返回的是 SDK 响应的全部字段（results 与 results_english 内容重复，概率保留十几位小数），
+并以 indent=2 编码，大部分提示词 token 花在了空白和重复数据上。
+这里按配置只保留提示词用到的字段、截断小数位、可选只保留概率最高的前 K 项，并以紧凑的 JSON 编码
+"""
+
+import json
+import logging
+
+import logger_config
+from skin_result import SkinAnalysisResult
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FIELDS = ('body_part', 'image_quality', 'image_type', 'results')
+DEFAULT_PRECISION = 3
+
+
+def compact_json(obj):
+    """不带空白的 JSON 编码（保留中文字符，不转义为 \\uXXXX）"""
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':'))
+
+
+def _round(value, precision):
+    if isinstance(value, float):
+        return round(value, precision)
+    if isinstance(value, dict):
+        return {k: _round(v, precision) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_round(v, precision) for v in value]
+    return value
+
+
+def _score(value):
+    return value if isinstance(value, (int, float)) and not isinstance(value, bool) else None
+
+
+def project_analysis(data, fields=DEFAULT_FIELDS, top_k=0, min_score=0.0, precision=DEFAULT_PRECISION):
+    """
+    裁剪皮肤分析结果
+    Args:
+        data (dict): Sample.main 的结果（已解析的 JSON）
+        fields (list): 保留的顶层字段，为空时保留全部
+        top_k (int): results 中只保留概率最高的前 K 项，0 表示全部保留
+        min_score (float): 丢弃 results 中概率低于此值的项
+        precision (int): 小数保留的位数，为 None 时不截断
+
+    Returns:
+        dict: 裁剪后的数据，results 按概率从高到低排列
+    """
+    if not isinstance(data, dict):
+        return data
+    projected = {k: v for k, v in data.items() if not fields or k in fields}
+    results = projected.get('results')
+    if isinstance(results, dict):
+        scored = [(name, value) for name, value in results.items()
+                  if _score(value) is None or _score(value) >= min_score]
+        scored.sort(key=lambda item: _score(item[1]) if _score(item[1]) is not None else -1, reverse=True)
+        if top_k:
+            scored = scored[:top_k]
+        projected['results'] = dict(scored)
+    if precision is not None:
+        projected = _round(projected, precision)
+    return projected
+
+
+def payload_options():
+    """
+    当前配置下的裁剪参数，未启用时返回 None
+    Returns:
+        dict: project_analysis 的关键字参数
+    """
+    config = logger_config.Config().get_llm_payload()
+    if not config.get('enabled', True):
+        return None
+    precision = config.get('precision', DEFAULT_PRECISION)
+    return {
+        "fields": tuple(config.get('fields') or DEFAULT_FIELDS),
+        "top_k": int(config.get('top_k', 0) or 0),
+        "min_score": float(config.get('min_score', 0.0) or 0.0),
+        "precision": None if precision is None else int(precision),
+    }
+
+
+def llm_payload(analysis, options=None):
+    """
+    生成提示词中的皮肤数据
+    Args:
+        analysis: 皮肤分析结果，SkinAnalysisResult、dict 或 JSON 字符串
+        options (dict): project_analysis 的参数，为 None 时读取配置
+
+    Returns:
+        str: 紧凑编码的 JSON；未启用裁剪时与原来一样以 indent=2 编码，无法解析的字符串原样返回
+    """
+    if isinstance(analysis, (str, bytes)):
+        try:
+            analysis = json.loads(analysis)
+        except ValueError:
+            logger.warning("皮肤分析结果不是合法的JSON，原样写入提示词")
+            return analysis if isinstance(analysis, str) else analysis.decode('utf-8', 'replace')
+    if isinstance(analysis, SkinAnalysisResult):
+        analysis = analysis.to_dict()
+    if options is None:
+        options = payload_options()
+    if options is None:
+        return json.dumps(analysis, ensure_ascii=False, indent=2)
+    return compact_json(project_analysis(analysis, **options))
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""
+皮肤分析结果
+Sample.main 原来递归地把 SDK 响应对象转换成 dict，再以 indent=2 编码为字符串返回，
+各接口、DeepSeek 和图表又分别把字符串解析回来。现在直接从 SDK 响应中取字段构造 SkinAnalysisResult，
+进程内一直传递这个对象，只在出口处由 json_codec 序列化一次
+"""
+
+from dataclasses import dataclass, field
+from typing import Any, Dict, Optional
+
+import json_codec
+
+# 与 DetectSkinDiseaseResponseBodyData 的字段相同，序列化后的结构与原来 Sample.main 的输出一致
+FIELDS = ('body_part', 'image_quality', 'image_type', 'results', 'results_english')
+
+
+@dataclass(slots=True)
+class SkinAnalysisResult:
+    """DetectSkinDisease 的结果（results / results_english 为 病症名称 -> 概率）"""
+    body_part: Optional[str] = None
+    image_quality: Optional[float] = None
+    image_type: Optional[str] = None
+    results: Dict[str, Any] = field(default_factory=dict)
+    results_english: Dict[str, Any] = field(default_factory=dict)
+
+    @classmethod
+    def from_sdk(cls, data):
+        """从 SDK 的响应数据（response.body.data）直接构造，data 为 None 时返回 None"""
+        if data is None:
+            return None
+        return cls(
+            body_part=getattr(data, 'body_part', None),
+            image_quality=getattr(data, 'image_quality', None),
+            image_type=getattr(data, 'image_type', None),
+            results=getattr(data, 'results', None) or {},
+            results_english=getattr(data, 'results_english', None) or {},
+        )
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**{name: data[name] for name in FIELDS if data.get(name) is not None})
+
+    @classmethod
+    def from_json(cls, text):
+        """解析缓存中保存的 JSON（包括旧版本以 indent=2 保存的结果）"""
+        return cls.from_dict(json_codec.loads(text))
+
+    def to_dict(self):
+        """浅拷贝为 dict（不复制 results）"""
+        return {name: getattr(self, name) for name in FIELDS}
+
+    def to_json(self):
+        return json_codec.dumps_str(self)
+
+
+def as_dict(analysis):
+    """
+    统一转换为 dict，供按字段处理的代码使用
+    Args:
+        analysis: SkinAnalysisResult、dict 或 JSON 字符串
+    """
+    if isinstance(analysis, SkinAnalysisResult):
+        return analysis.to_dict()
+    if isinstance(analysis, (str, bytes)):
+        return json_codec.loads(analysis)
+    return analysis
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""
+Server-Sent Events 工具
+把同步的上游流（如 DeepSeek 的流式响应）放到线程池中迭代，逐条转交给事件循环，
+客户端断开时关闭上游流，停止继续生成（和计费）
+"""
+
+import asyncio
+import contextvars
+import threading
+
+import json_codec
+from concurrency import get_executor
+
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "Connection": "keep-alive",
+    # 关闭 nginx 等反向代理的响应缓冲，保证事件实时送达
+    "X-Accel-Buffering": "no",
+}
+
+
+def format_sse(event, data):
+    """格式化一条 SSE 事件，data 序列化为 JSON"""
+    payload = json_codec.dumps_str(data)
+    return f"event: {event}\ndata: {payload}\n\n"
+
+
+async def iterate_in_thread(open_stream, transform=None):
+    """
+    在线程池中打开并迭代一个阻塞的流，以异步生成器的形式逐条产出
+    Args:
+        open_stream: 无参函数，返回可迭代的上游流（最好带 close 方法）
+        transform: 可选，接收上游流并返回要产出的迭代器
+
+    调用方停止迭代（例如客户端断开导致生成器被取消）时，会关闭上游流
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    stop = threading.Event()
+    holder = {}
+
+    def put(kind, value):
+        try:
+            loop.call_soon_threadsafe(queue.put_nowait, (kind, value))
+        except RuntimeError:
+            # 事件循环已经关闭
+            pass
+
+    def worker():
+        try:
+            stream = open_stream()
+            holder["stream"] = stream
+            if stop.is_set():
+                # 调用方在上游流打开前就已经离开
+                _close(stream)
+                return
+            for item in (transform(stream) if transform else stream):
+                if stop.is_set():
+                    break
+                put("item", item)
+        except Exception as e:
+            if not stop.is_set():
+                put("error", e)
+        finally:
+            put("done", None)
+
+    # 在调用方的上下文中读取上游流（继承请求的截止时间）
+    loop.run_in_executor(get_executor(), contextvars.copy_context().run, worker)
+    try:
+        while True:
+            kind, value = await queue.get()
+            if kind == "item":
+                yield value
+            elif kind == "error":
+                raise value
+            else:
+                break
+    finally:
+        stop.set()
+        # 关闭底层 HTTP 响应，正在阻塞读取的线程会随之退出
+        _close(holder.get("stream"))
+
+
+def _close(stream):
+    if stream is not None and hasattr(stream, "close"):
+        try:
+            stream.close()
+        except Exception:
+            pass
@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+"""
+临时图片目录的生命周期管理
+temp_image/、user_TempImage/ 和 cache/charts/（本地渲染的图表）中的文件按文件名哈希分散到子目录中（避免单个目录文件过多），
+后台定期清理：超过最长保留时间的文件直接删除，目录总大小超过配额时按最近访问时间(LRU)淘汰
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+import threading
+import time
+
+import logger_config
+from concurrency import run_blocking
+
+logger = logging.getLogger(__name__)
+
+BACK_END_DIR = os.path.dirname(os.path.abspath(__file__))
+# 受管理的目录，key 为配置中的名称
+MANAGED_DIRECTORIES = {
+    'temp_image': os.path.join(BACK_END_DIR, 'ALi_skin_model', 'temp_image'),
+    'user_TempImage': os.path.join(BACK_END_DIR, 'user_TempImage'),
+    'charts': os.path.join(BACK_END_DIR, 'cache', 'charts'),
+}
+DEFAULT_INTERVAL_SECONDS = 600
+DEFAULT_MAX_AGE_HOURS = 72
+DEFAULT_MAX_BYTES = 2 * 1024 * 1024 * 1024
+
+
+def shard_name(filename):
+    """文件所在的分片子目录名（文件名哈希的前两位，共256个子目录）"""
+    return hashlib.md5(filename.encode('utf-8')).hexdigest()[:2]
+
+
+def sharded_path(base_dir, filename):
+    """
+    返回文件在分片子目录中的路径，并确保子目录存在
+    Returns:
+        tuple: (完整路径, 相对 base_dir 的路径，使用 / 分隔)
+    """
+    shard = shard_name(filename)
+    os.makedirs(os.path.join(base_dir, shard), exist_ok=True)
+    return os.path.join(base_dir, shard, filename), f"{shard}/{filename}"
+
+
+class DirectoryPolicy:
+    """
+    单个目录的清理策略
+    Args:
+        name (str): 目录名称（用于日志和指标）
+        path (str): 目录路径
+        max_age_seconds (float): 文件最长保留时间，为 0 表示不限制
+        max_bytes (int): 目录总大小上限，为 0 表示不限制
+    """
+
+    def __init__(self, name, path, max_age_seconds=0, max_bytes=0):
+        self.name = name
+        self.path = path
+        self.max_age_seconds = max_age_seconds
+        self.max_bytes = max_bytes
+
+
+class TempJanitor:
+    """按策略清理目录，并记录磁盘占用和淘汰统计"""
+
+    def __init__(self, policies):
+        self._lock = threading.Lock()
+        self._stats = {}
+        self.policies = []
+        self.set_policies(policies)
+        self.sweeps = 0
+        self.last_sweep_at = None
+        self.last_sweep_ms = None
+
+    def set_policies(self, policies):
+        """更新清理策略（配置热更新时调用），保留已累计的统计"""
+        with self._lock:
+            self.policies = list(policies)
+            for policy in self.policies:
+                stats = self._stats.setdefault(policy.name, _empty_stats(policy))
+                stats.update(path=policy.path, max_age_seconds=policy.max_age_seconds, max_bytes=policy.max_bytes)
+
+    def sweep(self, now=None):
+        """清理一遍所有目录（同步，在线程池中执行）"""
+        now = time.time() if now is None else now
+        started = time.perf_counter()
+        with self._lock:
+            for policy in self.policies:
+                self._sweep_directory(policy, now)
+            self.sweeps += 1
+            self.last_sweep_at = now
+            self.last_sweep_ms = round((time.perf_counter() - started) * 1000, 1)
+        return self.stats()
+
+    def _sweep_directory(self, policy, now):
+        stats = self._stats[policy.name]
+        files = []
+        for entry in _walk_files(policy.path):
+            try:
+                st = entry.stat()
+            except OSError:
+                continue
+            # 以访问时间和修改时间中较新的一个作为最近使用时间（挂载了 noatime 时退化为修改时间）
+            files.append((max(st.st_atime, st.st_mtime), st.st_mtime, st.st_size, entry.path))
+
+        kept = []
+        for last_used, mtime, size, path in files:
+            if policy.max_age_seconds and now - mtime > policy.max_age_seconds:
+                if self._remove(path, stats):
+                    stats["evicted_ttl"] += 1
+                    stats["evicted_bytes"] += size
+                    continue
+            kept.append((last_used, size, path))
+
+        total = sum(size for _, size, _ in kept)
+        if policy.max_bytes and total > policy.max_bytes:
+            # 超出配额，从最久未使用的文件开始淘汰
+            kept.sort()
+            remaining = []
+            for index, (last_used, size, path) in enumerate(kept):
+                if total <= policy.max_bytes:
+                    remaining.extend(kept[index:])
+                    break
+                if self._remove(path, stats):
+                    stats["evicted_quota"] += 1
+                    stats["evicted_bytes"] += size
+                    total -= size
+                else:
+                    remaining.append((last_used, size, path))
+            kept = remaining
+
+        stats["files"] = len(kept)
+        stats["bytes"] = total
+
+    @staticmethod
+    def _remove(path, stats):
+        try:
+            os.remove(path)
+            return True
+        except FileNotFoundError:
+            return True
+        except OSError as e:
+            stats["errors"] += 1
+            logger.warning(f"删除临时文件失败 {path}: {str(e)}")
+            return False
+
+    def stats(self):
+        """各目录的磁盘占用和淘汰统计"""
+        return {
+            "sweeps": self.sweeps,
+            "last_sweep_at": self.last_sweep_at,
+            "last_sweep_ms": self.last_sweep_ms,
+            "directories": {name: dict(stats) for name, stats in self._stats.items()},
+        }
+
+
+def _empty_stats(policy):
+    return {
+        "path": policy.path,
+        "max_age_seconds": policy.max_age_seconds,
+        "max_bytes": policy.max_bytes,
+        "files": 0,
+        "bytes": 0,
+        "evicted_ttl": 0,
+        "evicted_quota": 0,
+        "evicted_bytes": 0,
+        "errors": 0,
+    }
+
+
+def _walk_files(path):
+    """递归列出目录中的文件（包括分片子目录和旧版本留下的平铺文件）"""
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    yield from _walk_files(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    yield entry
+    except FileNotFoundError:
+        return
+
+
+def policies_from_config(storage_config):
+    """按 temp_storage 配置生成各目录的清理策略"""
+    directories = storage_config.get('directories') or {}
+    policies = []
+    for name, path in MANAGED_DIRECTORIES.items():
+        policy_config = directories.get(name) or {}
+        policies.append(DirectoryPolicy(
+            name,
+            path,
+            max_age_seconds=float(policy_config.get('max_age_hours', DEFAULT_MAX_AGE_HOURS)) * 3600,
+            max_bytes=int(policy_config.get('max_bytes', DEFAULT_MAX_BYTES))
+        ))
+    return policies
+
+
+_janitor = None
+_janitor_version = None
+
+
+def get_janitor():
+    """获取全局清理器，配置更新后应用新的策略"""
+    global _janitor, _janitor_version
+    snapshot = logger_config.get_config()
+    if _janitor is None:
+        _janitor = TempJanitor(policies_from_config(snapshot.section('temp_storage')))
+        _janitor_version = snapshot.version
+    elif _janitor_version != snapshot.version:
+        _janitor.set_policies(policies_from_config(snapshot.section('temp_storage')))
+        _janitor_version = snapshot.version
+    return _janitor
+
+
+async def run_janitor():
+    """后台任务：按配置的间隔定期清理，应用退出时取消"""
+    while True:
+        storage_config = logger_config.Config().get_temp_storage()
+        if storage_config.get('enabled', True):
+            try:
+                stats = await run_blocking(get_janitor().sweep)
+                logger.info(f"临时目录清理完成: {stats}")
+            except Exception as e:
+                logger.error(f"临时目录清理失败: {str(e)}", exc_info=True)
+        await asyncio.sleep(float(storage_config.get('interval_seconds', DEFAULT_INTERVAL_SECONDS)))
@@ -0,0 +1,529 @@
+# -*- coding: utf-8 -*-
+"""
+上游配额调度器
+阿里云皮肤分析（DetectSkinDisease）公测版对调用速率和并发量有限制，
+所有调用都经过这里：令牌桶限制速率、并发数有上限，调用方按到达顺序(FIFO)排队；
+遇到限流错误时清空令牌桶（整个队列一起放慢），带随机抖动退避后回到队首重试，
+让上游稳定运行在限额附近，而不是一拥而上触发限流、再集体空等；
+多个工作进程（serve.py）运行时，令牌桶和并发数通过 SQLite 在进程间共享，增加进程不会成倍放大调用量
+"""
+
+import asyncio
+import collections
+import contextlib
+import functools
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import logger_config
+from concurrency import submit_blocking, worker_count, pid_alive
+from resilience import DeadlineExceeded, remaining
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RATE = 2.0
+DEFAULT_BURST = 2
+DEFAULT_MAX_CONCURRENCY = 2
+DEFAULT_MAX_QUEUE = 200
+DEFAULT_MAX_RETRIES = 4
+DEFAULT_BACKOFF_BASE = 0.5
+DEFAULT_BACKOFF_MAX = 8.0
+# 阿里云 POP 接口的限流错误码
+DEFAULT_THROTTLE_CODES = ('Throttling', 'Throttling.User', 'Throttling.Api', 'Throttling.System', 'ServiceUnavailable')
+BACK_END_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_SHARED_DB = os.path.join(BACK_END_DIR, 'cache', 'quota.sqlite3')
+# 共享的并发名额被其他进程占满时，隔多久再检查一次（秒）
+SHARED_POLL_INTERVAL = 0.05
+
+
+class SchedulerBusy(Exception):
+    """排队的调用方已达上限，拒绝新的调用"""
+
+
+class TokenBucket:
+    """
+    令牌桶（非线程安全，只在事件循环中使用）
+    Args:
+        rate (float): 每秒补充的令牌数
+        burst (int): 令牌桶容量
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def delay(self, tokens=1):
+        """还需要等待多少秒才有 tokens 个令牌"""
+        self._refill()
+        missing = tokens - self._tokens
+        return max(0.0, missing / self.rate) if self.rate > 0 else 0.0
+
+    def take(self):
+        self._refill()
+        self._tokens -= 1
+
+    def drain(self):
+        """清空令牌（收到限流错误后调用）"""
+        self._refill()
+        self._tokens = min(self._tokens, 0)
+
+    def try_acquire(self, max_concurrency):
+        """有令牌时取走一个并返回 0，否则返回还需等待的秒数（并发数由调度器在进程内检查）"""
+        delay = self.delay()
+        if delay <= 0:
+            self.take()
+        return delay
+
+    def release(self):
+        """调用结束（进程内的令牌桶不需要记录）"""
+
+
+class SharedTokenBucket:
+    """
+    多个工作进程共享的令牌桶和并发数（同一台机器上的 SQLite 文件，WAL 模式）
+    令牌数和补充时间保存在数据库中，每个进程进行中的调用数按进程号记录，
+    进程异常退出后，它占用的并发名额在并发数占满时回收
+    读写数据库时可能等待其他进程的写锁，调度器通过 submit 在专用线程中按提交顺序执行，不阻塞事件循环
+    Args:
+        db_path (str): SQLite 文件路径
+        name (str): 上游名称
+        rate (float): 每秒补充的令牌数
+        burst (int): 令牌桶容量
+    """
+
+    def __init__(self, db_path, name, rate, burst):
+        self.db_path = db_path
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self._lock = threading.Lock()
+        self._conn = None
+        self._executor = None
+        # 与 _lock 分开：_lock 在等待数据库写锁期间一直被持有，提交操作不能等它
+        self._executor_lock = threading.Lock()
+        # 最近一次读写时看到的令牌数和时间，estimate 据此估算，不读写数据库
+        self._seen = None
+
+    def submit(self, method, *args):
+        """在专用线程中执行 method（按提交顺序），返回 concurrent.futures.Future"""
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f'quota-{self.name}')
+            return self._executor.submit(method, *args)
+
+    def _connect(self):
+        if self._conn is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+            conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS buckets (name TEXT PRIMARY KEY, tokens REAL, updated REAL)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS active_calls ("
+                " name TEXT, pid INTEGER, calls INTEGER, PRIMARY KEY (name, pid))"
+            )
+            # 进程号可能被复用：本进程启动时清除同一进程号遗留的记录
+            conn.execute("DELETE FROM active_calls WHERE name = ? AND pid = ?", (self.name, os.getpid()))
+            self._conn = conn
+        return self._conn
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        with self._lock:
+            conn = self._connect()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+    def _tokens(self, conn, now):
+        row = conn.execute("SELECT tokens, updated FROM buckets WHERE name = ?", (self.name,)).fetchone()
+        if row is None:
+            return float(self.burst)
+        tokens, updated = row
+        return min(self.burst, tokens + max(0.0, now - updated) * self.rate)
+
+    def _store_tokens(self, conn, tokens, now):
+        conn.execute(
+            "INSERT OR REPLACE INTO buckets (name, tokens, updated) VALUES (?, ?, ?)", (self.name, tokens, now)
+        )
+        self._seen = (tokens, now)
+
+    def _active_calls(self, conn, max_concurrency):
+        active = conn.execute(
+            "SELECT COALESCE(SUM(calls), 0) FROM active_calls WHERE name = ?", (self.name,)
+        ).fetchone()[0]
+        if active >= max_concurrency:
+            # 回收已退出的进程占用的名额
+            rows = conn.execute("SELECT pid FROM active_calls WHERE name = ? AND pid != ?",
+                                (self.name, os.getpid())).fetchall()
+            dead = [pid for (pid,) in rows if not pid_alive(pid)]
+            if dead:
+                conn.executemany("DELETE FROM active_calls WHERE name = ? AND pid = ?",
+                                 [(self.name, pid) for pid in dead])
+                active = conn.execute(
+                    "SELECT COALESCE(SUM(calls), 0) FROM active_calls WHERE name = ?", (self.name,)
+                ).fetchone()[0]
+        return active
+
+    def delay(self, tokens=1):
+        """
+        估算还需要等待多少秒才有 tokens 个令牌：按本进程最近一次读写时看到的令牌数推算，
+        不访问数据库（其他进程之后取走的令牌不计入，只用于估算排队时间）
+        """
+        if self.rate <= 0:
+            return 0.0
+        seen = self._seen
+        available = self.burst if seen is None else min(self.burst, seen[0] + max(0.0, time.time() - seen[1]) * self.rate)
+        return max(0.0, (tokens - available) / self.rate)
+
+    def try_acquire(self, max_concurrency):
+        """取走一个令牌并占用一个并发名额，返回 0；令牌或名额不足时返回还需等待的秒数"""
+        with self._transaction() as conn:
+            if self._active_calls(conn, max_concurrency) >= max_concurrency:
+                return SHARED_POLL_INTERVAL
+            if self.rate > 0:
+                now = time.time()
+                tokens = self._tokens(conn, now)
+                if tokens < 1:
+                    self._seen = (tokens, now)
+                    return (1 - tokens) / self.rate
+                self._store_tokens(conn, tokens - 1, now)
+            conn.execute(
+                "INSERT INTO active_calls (name, pid, calls) VALUES (?, ?, 1)"
+                " ON CONFLICT (name, pid) DO UPDATE SET calls = calls + 1",
+                (self.name, os.getpid())
+            )
+        return 0.0
+
+    def release(self):
+        """调用结束，归还并发名额"""
+        with self._transaction() as conn:
+            conn.execute("UPDATE active_calls SET calls = MAX(calls - 1, 0) WHERE name = ? AND pid = ?",
+                         (self.name, os.getpid()))
+
+    def drain(self):
+        """清空令牌（收到限流错误后调用，所有进程一起放慢）"""
+        with self._transaction() as conn:
+            now = time.time()
+            self._store_tokens(conn, min(self._tokens(conn, now), 0.0), now)
+
+    def close(self):
+        with self._executor_lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+def is_throttling_error(error, codes=DEFAULT_THROTTLE_CODES):
+    """判断是否为上游的限流错误（阿里云 Tea SDK 的异常带有 code 和 HTTP 状态码）"""
+    code = str(getattr(error, 'code', '') or '')
+    if code in codes or code.startswith('Throttling'):
+        return True
+    data = getattr(error, 'data', None)
+    status = data.get('statusCode') if isinstance(data, dict) else None
+    return status == 429
+
+
+class UpstreamScheduler:
+    """
+    按令牌桶和最大并发数调度上游调用
+    Args:
+        name (str): 上游名称（用于日志）
+        rate (float): 每秒允许的调用数
+        burst (int): 允许的突发调用数
+        max_concurrency (int): 最大并发调用数
+        max_queue (int): 最多排队的调用方数量，超出时抛出 SchedulerBusy
+        max_retries (int): 限流错误的最大重试次数
+        backoff_base (float): 退避的基础时间（秒），第 n 次重试最多等待 base * 2^n
+        backoff_max (float): 单次退避的最长时间（秒）
+        shared_db (str): 与其他工作进程共享令牌桶和并发数的 SQLite 文件，为 None 时只在本进程内限制
+    """
+
+    def __init__(self, name, rate=DEFAULT_RATE, burst=DEFAULT_BURST, max_concurrency=DEFAULT_MAX_CONCURRENCY,
+                 max_queue=DEFAULT_MAX_QUEUE, max_retries=DEFAULT_MAX_RETRIES,
+                 backoff_base=DEFAULT_BACKOFF_BASE, backoff_max=DEFAULT_BACKOFF_MAX,
+                 throttle_codes=DEFAULT_THROTTLE_CODES, shared_db=None):
+        self.name = name
+        self._bucket = SharedTokenBucket(shared_db, name, rate, burst) if shared_db else TokenBucket(rate, burst)
+        self._queue = collections.deque()
+        self._active = 0
+        # 放行任务（队列不为空时运行）和唤醒它的事件
+        self._dispatcher = None
+        self._wakeup = None
+        # 单次调用耗时的指数滑动平均，用于估算排队时间
+        self._service_seconds = 1.0
+        self.configure(rate=rate, burst=burst, max_concurrency=max_concurrency, max_queue=max_queue,
+                       max_retries=max_retries, backoff_base=backoff_base, backoff_max=backoff_max,
+                       throttle_codes=throttle_codes)
+        self.calls = 0
+        self.throttled = 0
+        self.rejected = 0
+        self.failed = 0
+
+    def configure(self, rate, burst, max_concurrency, max_queue, max_retries, backoff_base, backoff_max,
+                  throttle_codes=DEFAULT_THROTTLE_CODES):
+        """更新调度参数（配置热更新时调用），已排队的调用方不受影响"""
+        self._bucket.rate = rate
+        self._bucket.burst = burst
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_queue = max_queue
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.throttle_codes = tuple(throttle_codes)
+
+    # ---------- 排队和放行 ----------
+
+    @property
+    def _shared(self):
+        return isinstance(self._bucket, SharedTokenBucket)
+
+    async def _bucket_op(self, method, *args):
+        """执行令牌桶的操作：进程内的令牌桶直接执行，共享的令牌桶在它的专用线程中执行"""
+        if not self._shared:
+            return method(*args)
+        return await asyncio.wrap_future(self._bucket.submit(method, *args))
+
+    async def _dispatch(self):
+        """
+        放行任务：按顺序放行队首的调用方，队列为空时结束；
+        没有空闲并发或令牌时等待，有调用结束或重试的调用方回到队首时提前唤醒
+        """
+        while True:
+            self._wakeup.clear()
+            while self._queue and self._queue[0].done():
+                # 调用方已取消
+                self._queue.popleft()
+            if not self._queue:
+                return
+            if self._active >= self.max_concurrency:
+                await self._wakeup.wait()
+                continue
+            ticket = self._queue[0]
+            try:
+                delay = await self._bucket_op(self._bucket.try_acquire, self.max_concurrency)
+            except Exception as e:
+                # 共享的令牌桶读写失败：交给队首的调用方处理，避免队列卡住
+                logger.error(f"{self.name} 读写共享配额失败: {str(e)}")
+                if not ticket.done():
+                    ticket.set_exception(e)
+                continue
+            if delay > 0:
+                with contextlib.suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                continue
+            if ticket.done():
+                # 等待令牌桶期间调用方取消了，归还刚占用的名额
+                self._release_bucket()
+                continue
+            self._queue.remove(ticket)
+            self._active += 1
+            ticket.set_result(None)
+
+    def _schedule_dispatch(self):
+        """唤醒放行任务，没有在运行时启动"""
+        if self._dispatcher is None or self._dispatcher.done():
+            self._wakeup = asyncio.Event()
+            self._dispatcher = asyncio.get_running_loop().create_task(self._dispatch())
+        else:
+            self._wakeup.set()
+
+    async def _acquire(self, front=False):
+        ticket = asyncio.get_running_loop().create_future()
+        if front:
+            self._queue.appendleft(ticket)
+        else:
+            self._queue.append(ticket)
+        # 排在队尾时不影响正在等待的队首，不必唤醒放行任务
+        if front or len(self._queue) == 1 or self._dispatcher is None or self._dispatcher.done():
+            self._schedule_dispatch()
+        try:
+            await ticket
+        except asyncio.CancelledError:
+            if ticket.done() and not ticket.cancelled():
+                # 已经被放行但调用方取消了，归还并发名额
+                self._release()
+            raise
+
+    def _release_bucket(self):
+        """归还令牌桶中的并发名额；共享时在专用线程中执行，不等待结果（排在之后的 try_acquire 之前执行）"""
+        if not self._shared:
+            self._bucket.release()
+            return
+        future = self._bucket.submit(self._bucket.release)
+        future.add_done_callback(
+            lambda f: f.exception() and logger.error(f"{self.name} 归还共享并发名额失败: {str(f.exception())}")
+        )
+
+    def _release(self):
+        self._active -= 1
+        self._release_bucket()
+        self._schedule_dispatch()
+
+    def _release_threadsafe(self, loop, work):
+        """线程池中的调用结束（或还没开始就被取消）时，在事件循环中归还并发名额"""
+        try:
+            loop.call_soon_threadsafe(self._release)
+        except RuntimeError:
+            # 事件循环已关闭（应用退出）
+            pass
+
+    # ---------- 对外接口 ----------
+
+    def estimate(self, position=None):
+        """
+        估算排在 position（默认队尾）的调用方还要等待多久（不读写共享的令牌桶，可以在事件循环中直接调用）
+        Returns:
+            dict: queue_position、active、estimated_wait_ms
+        """
+        position = len(self._queue) if position is None else position
+        rate = self._bucket.rate
+        token_wait = self._bucket.delay(position + 1) if rate > 0 else 0.0
+        # 并发名额：前面的调用方按 max_concurrency 一批批完成
+        batches = (position + self._active) // self.max_concurrency
+        concurrency_wait = batches * self._service_seconds
+        return {
+            "queue_position": position,
+            "active": self._active,
+            "estimated_wait_ms": round(max(token_wait, concurrency_wait) * 1000),
+        }
+
+    async def call(self, func, *args, **kwargs):
+        """
+        排队执行阻塞的上游调用（在线程池中执行），遇到限流错误时退避重试
+        Raises:
+            SchedulerBusy: 排队的调用方过多
+            DeadlineExceeded: 排队或退避等待期间到了请求的截止时间
+        """
+        if len(self._queue) >= self.max_queue:
+            self.rejected += 1
+            raise SchedulerBusy(f"{self.name} 排队请求过多，请稍后再试")
+
+        attempt = 0
+        while True:
+            # 重试的调用方回到队首，保持先来先服务；排队不超过请求的截止时间
+            left = remaining()
+            if left is None:
+                await self._acquire(front=attempt > 0)
+            else:
+                try:
+                    await asyncio.wait_for(self._acquire(front=attempt > 0), max(0.0, left))
+                except asyncio.TimeoutError:
+                    self.failed += 1
+                    raise DeadlineExceeded(f"{self.name} 排队超过截止时间") from None
+            started = time.monotonic()
+            loop = asyncio.get_running_loop()
+            work = submit_blocking(func, *args, **kwargs)
+            # 线程中的调用真正结束时才归还并发名额：调用方被取消（对冲请求落败、客户端断开、截止时间）后，
+            # 已经开始的调用仍在访问上游，提前归还会让实际并发超过 max_concurrency
+            work.add_done_callback(functools.partial(self._release_threadsafe, loop))
+            try:
+                result = await asyncio.wrap_future(work)
+            except Exception as e:
+                if not is_throttling_error(e, self.throttle_codes) or attempt >= self.max_retries:
+                    self.failed += 1
+                    raise
+                self.throttled += 1
+                # 被限流说明实际限额低于配置，清空令牌让整个队列一起放慢
+                await self._bucket_op(self._bucket.drain)
+                backoff = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+                left = remaining()
+                if left is not None and backoff >= left:
+                    # 退避后已经来不及重试
+                    self.failed += 1
+                    raise
+                logger.warning(f"{self.name} 被限流（第 {attempt + 1} 次），{backoff:.2f}s 后重试: {str(e)}")
+                attempt += 1
+            else:
+                elapsed = time.monotonic() - started
+                self._service_seconds = 0.8 * self._service_seconds + 0.2 * elapsed
+                self.calls += 1
+                return result
+            await asyncio.sleep(backoff)
+
+    def stats(self):
+        """调度器统计信息"""
+        return {
+            "name": self.name,
+            "shared": self._shared,
+            "rate": self._bucket.rate,
+            "burst": self._bucket.burst,
+            "max_concurrency": self.max_concurrency,
+            "queued": sum(1 for ticket in self._queue if not ticket.done()),
+            "active": self._active,
+            "calls": self.calls,
+            "throttled": self.throttled,
+            "rejected": self.rejected,
+            "failed": self.failed,
+            "avg_service_ms": round(self._service_seconds * 1000),
+            **self.estimate(),
+        }
+
+
+def scheduler_options(quota_config):
+    """把配置转换为 UpstreamScheduler 的参数"""
+    return {
+        "rate": float(quota_config.get('rate_per_second', DEFAULT_RATE)),
+        "burst": int(quota_config.get('burst', DEFAULT_BURST)),
+        "max_concurrency": int(quota_config.get('max_concurrency', DEFAULT_MAX_CONCURRENCY)),
+        "max_queue": int(quota_config.get('max_queue', DEFAULT_MAX_QUEUE)),
+        "max_retries": int(quota_config.get('max_retries', DEFAULT_MAX_RETRIES)),
+        "backoff_base": float(quota_config.get('backoff_base', DEFAULT_BACKOFF_BASE)),
+        "backoff_max": float(quota_config.get('backoff_max', DEFAULT_BACKOFF_MAX)),
+        "throttle_codes": quota_config.get('throttle_codes') or DEFAULT_THROTTLE_CODES,
+    }
+
+
+def shared_db_path(quota_config):
+    """
+    进程间共享配额的 SQLite 文件路径，不共享时返回 None
+    shared 为 auto（默认）时，多个工作进程运行（serve.py --workers > 1）才共享
+    """
+    shared = quota_config.get('shared', 'auto')
+    if shared == 'auto':
+        shared = worker_count() > 1
+    if not shared:
+        return None
+    path = quota_config.get('shared_db') or DEFAULT_SHARED_DB
+    return path if os.path.isabs(path) else os.path.join(BACK_END_DIR, path)
+
+
+_scheduler = None
+_scheduler_version = None
+_scheduler_lock = threading.Lock()
+
+
+def get_skin_scheduler():
+    """获取阿里云皮肤分析的全局调度器，配置更新后就地应用新的参数（是否共享在创建时确定）"""
+    global _scheduler, _scheduler_version
+    snapshot = logger_config.get_config()
+    with _scheduler_lock:
+        if _scheduler is None:
+            quota_config = snapshot.section('skin_analysis_quota')
+            _scheduler = UpstreamScheduler(
+                'DetectSkinDisease', **scheduler_options(quota_config), shared_db=shared_db_path(quota_config)
+            )
+            _scheduler_version = snapshot.version
+        elif _scheduler_version != snapshot.version:
+            _scheduler.configure(**scheduler_options(snapshot.section('skin_analysis_quota')))
+            _scheduler_version = snapshot.version
+    return _scheduler